@@ -1,4 +1,5 @@
 import random
+import threading
 import tkinter as tk
 from tkinter import ttk, colorchooser  # 导入 colorchooser
 
@@ -19,6 +20,8 @@ import datetime
 import ui_config as uc
 from database_manager import DatabaseManager, UserDetails
 from data_analyst import DataAnalyst
+from frame_schema import FACE_FEATURES
+from retention import HotWindow, SpillFile
 from custom_widgets import (Clock,
                             TkCustomImage,
                             UserDetailsWindow,
@@ -55,10 +58,11 @@ from port_detection import GetPortName
 import markdown2
 from tkinterweb import HtmlFrame
 from sound_player import play_sound_in_thread
+from frame_queue import FrameQueue, OverflowPolicy
 
 
 class App(ThemedTk):
-    def __init__(self, title: str, fullscreen=False, test=False):
+    def __init__(self, title: str, fullscreen=False, test=False, detect_port=True):
         super().__init__()
         self.theme = uc.main_theme
         self.set_theme(theme_name="adapta")
@@ -91,14 +95,17 @@ class App(ThemedTk):
         # style.configure('TButton', background='#FFEBEE', foreground='#FF1744')
 
         # 初始化串口管理器
-        self.serial_manager = SerialManager(port=GetPortName())
+        # without port detection the manager stays closed, e.g. when replaying the recorded logs
+        self.serial_manager = SerialManager(port=GetPortName() if detect_port else None,
+                                            timeout=uc.Measurements.serial_read_timeout.value)
 
         # 创建各个框架和UI元素
+        hot_window_size = uc.Measurements.hot_window_size.value
         self.sensor_values = dict()
-        self.sensor_time = list()
+        self.sensor_time = HotWindow(capacity=hot_window_size)
         self.latest_facial_values = None
         self.alarm_texts = list()
-        self.elapsed_time = list()
+        self.elapsed_time = HotWindow(capacity=hot_window_size)
         self.alarm_num = 0
         self.alarm_duration = 0
         self.last_alarm_time = None
@@ -124,6 +131,11 @@ class App(ThemedTk):
         self.body_frame = ttk.Frame(self)
         self.footer_row = 2
         self.footer_frame = ttk.Frame(self)
+        # frames pushed by the reader thread and drawn by the main loop
+        self.render_queue = FrameQueue(maxsize=uc.Measurements.render_queue_size.value,
+                                       policy=OverflowPolicy(uc.Measurements.render_queue_policy.value))
+        # Tk calls of the other threads, e.g. the alerts of the reader, run by the main loop
+        self.ui_calls = FrameQueue(maxsize=uc.Measurements.render_queue_size.value, policy=OverflowPolicy.drop_oldest)
         self.db_manager = DatabaseManager()
         self.logger = Logger(session_id=self.db_manager.session.id, test=test)
         self.data_analyst = DataAnalyst()
@@ -186,7 +198,7 @@ class App(ThemedTk):
         self.current_user_features = None
         base_path = os.path.dirname(os.path.abspath(__file__))
         self.csv_path = os.path.join(base_path, 'data', 'users', 'logins.csv')
-        self.sensor_values = {"Sensor 2": [], "Sensor 4": []}
+        self.sensor_values = self.create_sensor_series()
         self.alarm_text_file_path = self.get_alarm_logger_path()
         self.feedback_collector = None
 
@@ -195,6 +207,8 @@ class App(ThemedTk):
         self.add_guide_button()
         self.add_generate_report_button()
 
+        self.after(uc.Measurements.render_tick.value, self.process_render_queue)
+
         # 需要用户登录后才能进行数据采集
         if not test:
             self.after(500, func=self.show_sign_in_popup)
@@ -551,9 +565,6 @@ class App(ThemedTk):
             self.graph.lines[i].set_data(list(range(len(y))), y)
 
     def default_update(self, lr: Union[None, int], ur: Union[None, int]):
-        # Local flags
-        anomaly_detected = False
-        anomaly_graph_position = None
         for i, sensor_name in enumerate(self.sensor_values.keys()):
             x, y = self.data_analyst.get_axes_values(self.sensor_values,
                                                      self.elapsed_time,
@@ -565,6 +576,17 @@ class App(ThemedTk):
             if x[0] != x[-1]:
                 self.graph.ax.set_xlim(x[0], x[-1])
 
+        for collection in self.graph.ax.collections:
+            if isinstance(collection, matplotlib.collections.PolyCollection):
+                collection.remove()
+
+    def predict_posture(self) -> None:
+        """ Predict the posture of the latest frame and raise the alarm, called for every frame drawn
+        so the number of the alarms does not depend on how many frames a render tick draws
+        """
+        # Local flags
+        anomaly_detected = False
+        anomaly_graph_position = None
         if self.is_test_mode:
             self.lastest_prediction = self.data_analyst.detect_anomaly_test(data=self.sensor_values)
         else:
@@ -591,9 +613,6 @@ class App(ThemedTk):
             anomaly_detected = True
             anomaly_graph_position = len(self.sensor_values['Sensor 2']) - 1
 
-        for collection in self.graph.ax.collections:
-            if isinstance(collection, matplotlib.collections.PolyCollection):
-                collection.remove()
         if anomaly_detected:
             self.show_alarm(pos=anomaly_graph_position)
             print("Alarm raised.")
@@ -653,21 +672,96 @@ class App(ThemedTk):
         if is_valid and not too_close:
             self.remove_error_notification()
         self.logger.update_notes(timestamp=self.logger.last_timestamp, notes=notes)
+        if self.is_paused:
+            return sens_2, sens_4  # the values are logged, but the user is not alarmed
+        # called by the reader thread, the message boxes are shown by the main loop
         if not self.error_notify_messagebox \
                 and not is_valid \
                 and self.val_replacing_num >= uc.Measurements.val_replacing_limit.value:
-            play_sound_in_thread()
-            self.error_notify_messagebox = messagebox.showerror("Error", "Sensor cannot detect distance to participant!\nPlease adjust the posture or sensor!")
+            self.error_notify_messagebox = True
+            self.call_in_main_loop(self.show_sensor_alert, messagebox.showerror,
+                                   "Error", "Sensor cannot detect distance to participant!\nPlease adjust the posture or sensor!")
         if not self.error_notify_messagebox \
                 and too_close \
                 and self.screen_distance_num >= uc.Measurements.val_replacing_limit.value:
-            play_sound_in_thread()
-            self.error_notify_messagebox = messagebox.showwarning("Warning", "You are too close to the screen!\nKeep an appropriate distance to protect your eyesight.")
+            self.error_notify_messagebox = True
+            self.call_in_main_loop(self.show_sensor_alert, messagebox.showwarning,
+                                   "Warning", "You are too close to the screen!\nKeep an appropriate distance to protect your eyesight.")
         return sens_2, sens_4
 
-    def update_sensor_values(self, sens_2: int, sens_4: int, timestamp: int, local_time: str) -> None:
-        if pd.isna(sens_2) or pd.isna(sens_4):
+    @staticmethod
+    def show_sensor_alert(show_messagebox: Callable, title: str, message: str) -> None:
+        play_sound_in_thread()
+        show_messagebox(title, message)
+
+    def call_in_main_loop(self, func: Callable, *args, **kwargs) -> None:
+        """ Tk is not thread-safe, the other threads queue their Tk calls for process_render_queue """
+        self.ui_calls.put((func, args, kwargs))
+
+    def notify_log_success(self, subject: str) -> None:
+        """ Called by the log writer thread """
+        self.call_in_main_loop(self.show_notify_log_success, subject=subject)
+
+    def set_serial_manager(self, serial_manager: SerialManager) -> None:
+        """ Send the commands of the controllers to the given port """
+        self.serial_manager = serial_manager
+        self.sound_controller.serial_manager = serial_manager
+        self.light_controller.serial_manager = serial_manager
+
+    def push_sensor_values(self, sens_2: int, sens_4: int, timestamp: int, local_time: str,
+                           facial_data: Union[None, dict], local_timestamp: float) -> None:
+        """ Called by the reader thread, the values are drawn by process_render_queue """
+        self.render_queue.put((sens_2, sens_4, timestamp, local_time, facial_data, local_timestamp))
+
+    def process_render_queue(self) -> None:
+        """ Run the queued Tk calls, drain the values pushed since the last tick and redraw the graph once for the batch
+        While paused, the values are only added to the series and the graph catches up on resume
+        """
+        if self.is_stopped:
             return None
+        for func, args, kwargs in self.ui_calls.get_batch():
+            func(*args, **kwargs)
+        is_updated = self.drain_render_queue()
+        if is_updated and not self.is_paused:
+            self.redraw_graph()
+        self.after(uc.Measurements.render_tick.value, self.process_render_queue)
+
+    def drain_render_queue(self) -> bool:
+        """ Add the queued values to the series without redrawing, return True if any was valid """
+        is_updated = False
+        for sens_2, sens_4, timestamp, local_time, facial_data, local_timestamp in self.render_queue.get_batch():
+            is_valid = self.update_sensor_values(sens_2=sens_2, sens_4=sens_4,
+                                                 timestamp=timestamp, local_time=local_time,
+                                                 redraw=False)
+            self.update_facial_values(facial_data=facial_data,
+                                      timestamp=timestamp,
+                                      local_timestamp=local_timestamp)
+            if is_valid and not self.is_paused:
+                self.predict_posture()  # once per frame, as before the frames were drawn in batches
+            is_updated |= is_valid
+        return is_updated
+
+    def redraw_graph(self) -> None:
+        self.p_tester.start()
+        self.update_graph()
+        self.p_tester.end()
+        self.p_tester.show_time_summary(function_name=f"update_graph() with updated redrawing function",
+                                        notes="Line 327 at app_ui.py", critical=True)
+
+    def create_sensor_series(self) -> dict[str, HotWindow]:
+        """ The older values are spilled to the session folder and read back by the paused history view """
+        series = {}
+        for sensor_name in ["Sensor 2", "Sensor 4"]:
+            file_name = f"history_{sensor_name.lower().replace(' ', '_')}.bin"
+            spill_file = SpillFile(os.path.join(self.logger.folder_path, file_name))
+            series[sensor_name] = HotWindow.spilled_to(spill_file, capacity=uc.Measurements.hot_window_size.value)
+        return series
+
+    def update_sensor_values(self, sens_2: int, sens_4: int, timestamp: int, local_time: str,
+                             redraw=True) -> bool:
+        """ Append the values to the graph series, return False if they are not valid """
+        if pd.isna(sens_2) or pd.isna(sens_4):
+            return False
         values = self.sensor_values
         values["Sensor 2"].append(sens_2)
         values["Sensor 4"].append(sens_4)
@@ -675,11 +769,9 @@ class App(ThemedTk):
         self.sensor_values = values
         self.sensor_time.append((local_time, self.db_manager.session.user_id))
         self.elapsed_time.append(self.p_tester.get_this_timestamp().split(' ')[-1])
-        self.p_tester.start()
-        self.update_graph()
-        self.p_tester.end()
-        self.p_tester.show_time_summary(function_name=f"update_graph() with updated redrawing function",
-                                        notes="Line 327 at app_ui.py", critical=True)
+        if redraw:
+            self.redraw_graph()
+        return True
         # rand_moment = random.randint(self.bpc_lr,
         #                              self.bpc_hr)
         # if self.is_bad_posture_command_allowed(next_time_call=rand_moment):
@@ -692,12 +784,7 @@ class App(ThemedTk):
         #           f"Number of side quests left: {self.bad_posture_comm_limit}")
 
     def update_facial_values(self, facial_data: dict, timestamp: int, local_timestamp: str) -> None:
-        face_features = ['bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2',
-                'left_eye_x', 'left_eye_y', 'right_eye_x', 'right_eye_y',
-                'nose_x', 'nose_y',
-                'mouth_left_x', 'mouth_left_y', 'mouth_right_x', 'mouth_right_y']
-        
-        if facial_data is None or any([np.isnan(facial_data[feature]) for feature in face_features]):
+        if facial_data is None or any([np.isnan(facial_data[feature]) for feature in FACE_FEATURES]):
             return None
         
         facial_data['local_timestamp'] = local_timestamp
@@ -986,6 +1073,7 @@ class App(ThemedTk):
     """ Sensor Comm Control """
 
     def pause_comm(self) -> None:
+        """ Stop rendering and alarming, the data is still read and logged """
         self.is_paused = True
 
     def resume_comm(self) -> None:
@@ -1072,7 +1160,7 @@ class App(ThemedTk):
     def save_last_data(self):
         self.save_graph()
         save_paths: dict[str, str] = self.db_manager.save_data()
-        self.logger.log_buffer()  # save the remaining values in the buffer
+        self.logger.flush()  # save the remaining values in the buffer
         notify_content = (f"Report saved in {save_paths['report_path']}\n"
                           f"Graph saved in {save_paths['graph_path']}\n")
         if self.notification_frame:
@@ -1089,7 +1177,8 @@ class App(ThemedTk):
             self.p_tester.save_report()
 
     def save_all_log(self):
-        self.logger.log_all_data()
+        """ The file is written by a separate thread, so the UI does not freeze on long sessions """
+        threading.Thread(target=self.logger.log_all_data, daemon=False).start()
 
     def sign_in(self):
         pop_up: UserDetailsWindow = self.sign_in_popup
@@ -1101,6 +1190,8 @@ class App(ThemedTk):
         pop_up.show_message_frame(subject="Success",
                                   details=f"Welcome back, {self.db_manager.session.user_details.get_full_name()}")
         self.set_user_photo()
+        # the first prediction does not wait for the models
+        threading.Thread(target=self.data_analyst.load_models, daemon=True).start()
 
         print(f"Checking if file exists at path: {self.csv_path}")
         if os.path.exists(self.csv_path):
@@ -1144,6 +1235,7 @@ class App(ThemedTk):
         self.set_user_photo()
 
         self.current_user_features = None
+        self.data_analyst.models.print_metrics()
 
         # Change button config
         sign_in_button: ttk.Button = self.control_buttons[uc.ElementNames.sign_in_button_txt.value]
@@ -1198,7 +1290,7 @@ class App(ThemedTk):
             self.remove_graph_scrollbar()
         self.scroll_bar_frame = tk.Frame(self.body_frame)
         self.scroll_bar_frame.grid(row=3, column=1, pady=10, padx=10, sticky=tk.NSEW)
-        options: list[int] = [sen[0] for sen in self.sensor_time]
+        options: list[int] = list(range(len(self.sensor_time)))
         self.graph_scroll_bar = GraphScrollBar(parent=self.scroll_bar_frame,
                                                options=options,
                                                figure_func=self.update_graph)
@@ -1223,6 +1315,9 @@ class App(ThemedTk):
         button.config(text=stop_txt, command=self.pause)
         self.remove_note_frame()
         self.remove_graph_scrollbar()
+        # Catch up with the values received during the pause in one redraw
+        self.drain_render_queue()
+        self.redraw_graph()
 
     def save_graph(self):
         file_path = self.db_manager.session.get_graph_save_path(ask_path=False)
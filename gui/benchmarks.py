@@ -0,0 +1,545 @@
+""" Micro-benchmarks of the data pipeline, which can be run without the device:
+python benchmarks.py parser
+python benchmarks.py serial  # full serial ingestion against device_simulator, Linux and macOS only
+python benchmarks.py logger  # saving all the session data at 10k/100k/1M rows
+python benchmarks.py segments  # size and loading time of the CSV logs against the binary segments
+python benchmarks.py postprocess  # Logger.post_process_df steps at 100k/1M rows, checked against the legacy loops
+python benchmarks.py integration  # time and peak memory of the in-memory integration against the streaming one
+python benchmarks.py incremental  # save of the integrated session after a new segment, appended against integrated again
+python benchmarks.py database  # logging into the frames database against the CSV logs, late updates and queries
+python benchmarks.py compaction  # size of a finished session before and after its compaction, reading it from both
+python benchmarks.py models  # predictions loading the voting models on every call against the model registry
+"""
+import argparse
+import contextlib
+import copy
+import glob
+import io
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from typing import Callable
+from frame_source import SyntheticSource, SerialFrameSource
+from line_parser import LineParser
+from frame_assembler import FrameAssembler
+from frame_schema import Frame, COLUMNS, FACE_FEATURES, format_local_time
+from frame_source import generate_frame_values, format_frame_lines
+from logger import CsvLogSink, DatabaseLogSink, Logger
+from log_database import LogDatabase, write_reference, read_reference_rows
+from session_catalog import SessionCatalog
+from session_archive import compact_session, get_folder_size
+from log_integration import (integrate_csv_files, get_session_log_paths, stream_integrated_csv, save_integrated_csv,
+                             IntegrationCheckpoint)
+from log_segments import write_segment, load_segments, ATTRIBUTE_COLUMNS
+from serial_manager import SerialManager
+import ui_config as uc
+
+
+def measure(func: Callable, repeat=3) -> float:
+    """ Return the best wall time of the function in seconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def legacy_parse_line(line: str, data_entry: dict) -> dict:
+    """ The parsing done by ThreadManager before the LineParser, kept as the baseline """
+    line = re.sub(r'\x1B\[[0-9;]*[A-Za-z]', '', line)  # SerialManager.read_line
+    line = re.sub(r'\x1B\[[0-9;]*[A-Za-z]', '', line)  # ThreadManager.clean_line
+    re.search(r'I \((\d+)\)', line)
+    range_pattern = re.compile(r'Range: (\d+)\s+(\d+),')
+    bbox_pattern = re.compile(r'detection_result:\s*\[\s*\d+\]:\s*\(\s*(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\)')
+    face_pattern = re.compile(
+        r'left eye: \(\s*(\d+),\s*(\d+)\), right eye: \(\s*(\d+),\s*(\d+)\), nose: \(\s*(\d+),\s*(\d+)\), mouth left: \(\s*(\d+),\s*(\d+)\), mouth right: \(\s*(\d+),\s*(\d+)\)')
+    fhp_pattern = re.compile(r'FHP detected.*?(\d+), mm')
+    mv_pattern = re.compile(r'MV: (\d+), (\d+), (\d+), (\d+)')
+
+    range_match = range_pattern.search(line)
+    if range_match:
+        data_entry['sensor_2'] = int(range_match.group(1))
+        data_entry['sensor_4'] = int(range_match.group(2))
+    bbox_match = bbox_pattern.search(line)
+    if bbox_match:
+        data_entry['bbox_x1'], data_entry['bbox_y1'], data_entry['bbox_x2'], data_entry['bbox_y2'] = [
+            int(bbox_match.group(i)) for i in range(1, 5)]
+    face_match = face_pattern.search(line)
+    if face_match:
+        data_entry['left_eye_x'], data_entry['left_eye_y'], data_entry['right_eye_x'], data_entry['right_eye_y'], \
+            data_entry['nose_x'], data_entry['nose_y'], data_entry['mouth_left_x'], data_entry['mouth_left_y'], \
+            data_entry['mouth_right_x'], data_entry['mouth_right_y'] = [int(face_match.group(i)) for i in range(1, 11)]
+    mv_match = mv_pattern.search(line)
+    if mv_match:
+        data_entry['mv_1'], data_entry['mv_2'], data_entry['mv_3'], data_entry['mv_4'] = [
+            int(mv_match.group(i)) for i in range(1, 5)]
+    fhp_match = fhp_pattern.search(line)
+    if fhp_match:
+        data_entry['fhp'] = int(fhp_match.group(1))
+    return data_entry
+
+
+def bench_line_parser(num_frames=20000) -> None:
+    lines = list(SyntheticSource(num_frames=num_frames, speed=None, missing_face_ratio=0.1,
+                                 color=True).iter_lines())
+    parser = LineParser()
+
+    # Both implementations have to produce the same entries
+    for line in lines[:500]:
+        assert legacy_parse_line(line, {}) == LineParser.apply(parser.parse(line), {}), line
+
+    def run_legacy():
+        entry = {}
+        for line in lines:
+            legacy_parse_line(line, entry)
+
+    def run_parser():
+        entry = {}
+        for line in lines:
+            LineParser.apply(parser.parse(line), entry)
+
+    legacy_time = measure(run_legacy)
+    parser_time = measure(run_parser)
+    print(f"Line parser benchmark on {len(lines)} lines:")
+    print(f"legacy regex searches: {len(lines) / legacy_time:12.0f} lines/s")
+    print(f"LineParser:            {len(lines) / parser_time:12.0f} lines/s")
+    print(f"speedup:               {legacy_time / parser_time:12.2f}x")
+
+
+def bench_serial_ingest(rates=(50, 100, 500), duration=2.0) -> None:
+    """ Read the simulated device through SerialManager, LineParser and FrameAssembler """
+    from device_simulator import DeviceSimulator
+
+    print(f"Serial ingestion benchmark, {duration} s per rate:")
+    for rate in rates:
+        simulator = DeviceSimulator(rate=rate, jitter=0.1 / rate, missing_face_ratio=0.1, color=True)
+        serial_manager = SerialManager(port=simulator.port_name, timeout=uc.Measurements.serial_read_timeout.value)
+        source = SerialFrameSource(serial_manager)
+        parser = LineParser()
+        assembler = FrameAssembler(create_frame=Frame, timeout=uc.Measurements.frame_timeout.value)
+        frames = 0
+        simulator.start()
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            for line in source.read_lines():
+                if assembler.feed(parser.parse(line)) is not None:
+                    frames += 1
+        simulator.stop()
+        source.close()
+        frames += assembler.flush() is not None
+        print(f"{rate:5d} Hz: {simulator.frames_sent:6d} frames sent, {frames:6d} assembled, "
+              f"{simulator.dropped_lines} lines dropped, {assembler.late_records} late records")
+
+
+def legacy_log_all_data(logs: dict, columns: list[str], path: str) -> None:
+    """ Logger.log_all_data before the CsvLogSink, kept as the baseline """
+    data = copy.deepcopy(logs)
+    df = pd.DataFrame(columns=columns)
+    for timestamp, data in data.items():
+        new_row = {'timestamp': timestamp}
+        for key in df.columns:
+            new_row[key] = data.get(key, np.nan)
+        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+    df.to_csv(path, index=False)
+
+
+def create_session_logs(num_rows: int) -> dict[str, Frame]:
+    """ Logger.logs of a session with the given number of frames """
+    parser = LineParser()
+    rnd = random.Random(0)
+    logs = {}
+    for frame_num in range(num_rows):
+        timestamp = str(frame_num * 100)
+        frame = Frame(timestamp)
+        for line in format_frame_lines(frame_num * 100, generate_frame_values(rnd, missing_face_ratio=0.1)):
+            LineParser.apply(parser.parse(line), frame)
+        frame['user_id'] = 1
+        frame['prediction'] = rnd.randint(0, 1)
+        logs[timestamp] = frame
+    return logs
+
+
+def bench_log_all_data(sizes=(10000, 100000, 1000000), legacy_limit=10000) -> None:
+    """ The legacy baseline takes minutes already at 10k rows """
+    print("Saving all the session data:")
+    with tempfile.TemporaryDirectory() as folder_path:
+        for num_rows in sizes:
+            logs = create_session_logs(num_rows)
+            path = os.path.join(folder_path, f"all_{num_rows}.csv")
+
+            def run_sink():
+                if os.path.exists(path):
+                    os.remove(path)
+                sink = CsvLogSink(path=path, columns=COLUMNS, flush_rows=num_rows, flush_interval=float('inf'))
+                sink.write(list(logs.values()))
+                sink.close()
+
+            sink_time = measure(run_sink, repeat=1)
+            saved = pd.read_csv(path, header=None)
+            assert saved.shape == (num_rows, len(COLUMNS)), saved.shape
+            result = f"{num_rows:8d} rows: CsvLogSink {sink_time:8.2f} s"
+            if num_rows <= legacy_limit:
+                legacy_time = measure(lambda: legacy_log_all_data(logs, COLUMNS, path + ".legacy"), repeat=1)
+                result += f", legacy deepcopy + concat {legacy_time:8.2f} s, speedup {legacy_time / sink_time:.1f}x"
+            else:
+                result += ", legacy skipped (quadratic)"
+            print(result)
+
+
+def bench_log_segments(sizes=(100000, 1000000)) -> None:
+    print("Loading the session logs:")
+    with tempfile.TemporaryDirectory() as folder_path:
+        for num_rows in sizes:
+            frames = list(create_session_logs(num_rows).values())
+            csv_path = os.path.join(folder_path, f"log_{num_rows}.csv")
+            segment_path = os.path.join(folder_path, f"log_{num_rows}.npz")
+            pd.DataFrame(columns=COLUMNS).to_csv(csv_path, index=False)
+            sink = CsvLogSink(path=csv_path, columns=COLUMNS, flush_rows=num_rows, flush_interval=float('inf'))
+            sink.write(frames)
+            sink.close()
+            write_segment(segment_path, np.stack([frame.values for frame in frames]),
+                          {column: [getattr(frame, column) for frame in frames] for column in ATTRIBUTE_COLUMNS})
+            csv_time = measure(lambda: pd.read_csv(csv_path), repeat=1)
+            segment_time = measure(lambda: load_segments([segment_path]), repeat=1)
+            loaded = load_segments([segment_path])
+            assert loaded.shape == (num_rows, len(COLUMNS)), loaded.shape
+            csv_size = os.path.getsize(csv_path) / 1024 ** 2
+            segment_size = os.path.getsize(segment_path) / 1024 ** 2
+            print(f"{num_rows:8d} rows: CSV {csv_size:7.1f} MB read in {csv_time:6.2f} s, "
+                  f"segment {segment_size:7.1f} MB loaded in {segment_time:6.2f} s")
+
+
+def legacy_process_notes_gaps(df: pd.DataFrame) -> pd.DataFrame:
+    """ Logger.process_notes_gaps before the vectorization, kept as the baseline """
+    col = 'Notes'
+    mask = ~pd.isna(df[col])
+    rows_with_notes = df.loc[mask].index
+    for row in rows_with_notes:
+        df.loc[row-2:row-1, col] = df.loc[row, col]
+    return df
+
+
+def legacy_process_alarm_notifications(df: pd.DataFrame) -> pd.DataFrame:
+    is_alarm = df['alarm_notification'] == "yes"
+    alarm_indexes: list[int] = df[is_alarm].index
+    for i in alarm_indexes:
+        time = df.loc[i, 'local_time']
+        interval = int(df.loc[i, 'notification_interval'])
+        indicated_feedback = df.loc[i, 'feedback']
+        timestamps = Logger.get_timestamps_by_interval(time, interval)
+        df = Logger.set_status_by_local_time(df, local_times=timestamps,
+                                             new_statuses={"alarm_notification": "yes",
+                                                           "notification_interval": interval,
+                                                           "feedback": indicated_feedback})
+    return df
+
+
+def legacy_process_models_thresholds_gaps(df: pd.DataFrame) -> pd.DataFrame:
+    col_name = 'model_threshold'
+    mask = ~pd.isna(df[col_name])
+    indexes = df[mask].index
+    if len(indexes) == 0:
+        return df
+    lower = 0  # start with 0
+    for i in range(len(indexes)):
+        upper: int = indexes[i]  # determine the limits
+        threshold = df.loc[lower, col_name]
+        selected_indexes = [i for i in range(lower, upper)]
+        df.loc[selected_indexes, col_name] = threshold
+        lower = upper
+    else:
+        lower = indexes[-1]
+        upper = df.shape[0]
+        threshold = df.loc[lower, col_name]
+        selected_indexes = [i for i in range(lower, upper)]
+        df.loc[selected_indexes, col_name] = threshold
+    return df
+
+
+def create_integrated_df(num_rows: int, rows_per_alarm=5000, rows_per_note=200, rows_per_threshold=20000) -> pd.DataFrame:
+    """ Integrated session at 10 rows per second with the notes, alarms and threshold changes spread over it """
+    rnd = np.random.default_rng(0)
+    seconds = 1721900000 + np.arange(num_rows) // 10
+    local_times = pd.to_datetime(seconds, unit='s').strftime(uc.Measurements.time_format.value)
+    notes = np.full(num_rows, np.nan, dtype=object)
+    note_rows = rnd.choice(num_rows, num_rows // rows_per_note, replace=False)
+    notes[note_rows] = [f"note {i % 7}" for i in range(len(note_rows))]
+    alarm_notification = np.full(num_rows, 'no', dtype=object)
+    intervals = np.full(num_rows, np.nan)
+    feedback = np.full(num_rows, np.nan)
+    alarm_rows = rnd.choice(num_rows, num_rows // rows_per_alarm, replace=False)
+    alarm_rows = np.concatenate([alarm_rows, alarm_rows[:5] + 3])  # alarms within the window of another one
+    alarm_notification[alarm_rows] = 'yes'
+    intervals[alarm_rows] = rnd.integers(0, 30, len(alarm_rows))
+    feedback[alarm_rows] = rnd.choice([0.0, 1.0, np.nan], len(alarm_rows))
+    thresholds = np.full(num_rows, np.nan)
+    threshold_rows = rnd.choice(num_rows, max(1, num_rows // rows_per_threshold), replace=False)
+    thresholds[threshold_rows] = rnd.uniform(0.5, 1.0, len(threshold_rows)).round(2)
+    return pd.DataFrame({'timestamp': np.arange(num_rows) * 100, 'local_time': local_times,
+                         'sensor_2': rnd.integers(100, 800, num_rows), 'Notes': notes,
+                         'alarm_notification': alarm_notification, 'notification_interval': intervals,
+                         'feedback': feedback, 'model_threshold': thresholds})
+
+
+def bench_post_process(sizes=(100000, 1000000)) -> None:
+    print("Post-processing of the integrated session:")
+    steps = [('notes gaps', legacy_process_notes_gaps, Logger.process_notes_gaps),
+             ('alarm notifications', legacy_process_alarm_notifications, Logger.process_alarm_notifications),
+             ('thresholds gaps', legacy_process_models_thresholds_gaps, Logger.process_models_thresholds_gaps)]
+    for num_rows in sizes:
+        df = create_integrated_df(num_rows)
+        for name, legacy_step, step in steps:
+            legacy_start = time.perf_counter()
+            expected = legacy_step(df.copy())
+            legacy_time = time.perf_counter() - legacy_start
+            start = time.perf_counter()
+            result = step(df.copy())
+            step_time = time.perf_counter() - start
+            pd.testing.assert_frame_equal(result, expected)
+            print(f"{num_rows:8d} rows, {name:20s}: legacy {legacy_time:8.2f} s, vectorized {step_time:6.3f} s, "
+                  f"speedup {legacy_time / step_time:.0f}x, identical output")
+
+
+def write_session_segments(folder_path: str, session_id: str, num_rows: int, segment_rows: int,
+                           extensions=('.csv',), rows_per_alarm=5000, rows_per_note=200) -> None:
+    """ Log segments of a session at 10 rows per second with alarms and threshold changes,
+    the extensions are used in turn, and the notes file of the session
+    """
+    rnd = np.random.default_rng(0)
+    frames = list(create_session_logs(num_rows).values())
+    for row, frame in enumerate(frames):
+        frame.local_timestamp = 1721900000.0 + row / 10
+    for row in rnd.choice(num_rows, max(1, num_rows // rows_per_alarm), replace=False).tolist():
+        frames[row].alarm_notification = 'yes'
+        frames[row]['notification_interval'] = int(rnd.integers(0, 30))
+        frames[row]['feedback'] = float(rnd.choice([0.0, 1.0, np.nan]))
+    for row in rnd.choice(num_rows, max(1, num_rows // 20000), replace=False).tolist():
+        frames[row]['model_threshold'] = round(float(rnd.uniform(0.5, 1.0)), 2)
+    note_rows = sorted(rnd.choice(num_rows, max(1, num_rows // rows_per_note), replace=False).tolist())
+    pd.DataFrame({"Sensor 2": [frames[row]['sensor_2'] for row in note_rows],
+                  "Sensor 4": [frames[row]['sensor_4'] for row in note_rows],
+                  "Time": [frames[row].local_time for row in note_rows],
+                  "Notes": [f"note {i % 7}" for i in range(len(note_rows))]}
+                 ).to_csv(os.path.join(folder_path, f"notes_{session_id}_all.csv"))
+    for number, start in enumerate(range(0, num_rows, segment_rows)):
+        segment = frames[start:start + segment_rows]
+        extension = extensions[number % len(extensions)]
+        path = os.path.join(folder_path, f"data_{number:06d}_{session_id}{extension}")
+        if extension == '.csv':
+            pd.DataFrame(columns=COLUMNS).to_csv(path, index=False)
+            sink = CsvLogSink(path=path, columns=COLUMNS, flush_rows=len(segment), flush_interval=float('inf'))
+            sink.write(segment)
+            sink.close()
+        else:
+            write_segment(path, np.stack([frame.values for frame in segment]),
+                          {column: [getattr(frame, column) for frame in segment] for column in ATTRIBUTE_COLUMNS})
+
+
+def legacy_save_integrated_csv(folder_path: str, session_id: str, output_path: str) -> None:
+    """ log_integration.save_integrated_csv before the streaming, kept as the baseline """
+    integrated_data = integrate_csv_files(folder_path, session_id)
+    notes = pd.read_csv(os.path.join(folder_path, f"notes_{session_id}_all.csv"), index_col=False)
+    integrated_data = Logger.post_process_df(df=integrated_data, notes=notes)
+    integrated_data = integrated_data.drop_duplicates()
+    integrated_data.to_csv(output_path, index=False)
+
+
+def measure_peak(func: Callable) -> tuple[float, float]:
+    """ Return the wall time in seconds and the peak of the memory allocated meanwhile in MB """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 ** 2
+
+
+def bench_integration(sizes=(100000, 1000000), segment_rows=36000) -> None:
+    """ Both run under tracemalloc, which slows them down several times """
+    print("Integration of the session logs:")
+    for num_rows in sizes:
+        with tempfile.TemporaryDirectory() as folder_path:
+            write_session_segments(folder_path, "1", num_rows, segment_rows)
+            legacy_path = os.path.join(folder_path, "legacy.csv")
+            streamed_path = os.path.join(folder_path, "streamed.csv")
+            with contextlib.redirect_stdout(io.StringIO()):  # post_process_df prints the merged notes
+                legacy_time, legacy_peak = measure_peak(
+                    lambda: legacy_save_integrated_csv(folder_path, "1", legacy_path))
+            notes = pd.read_csv(os.path.join(folder_path, "notes_1_all.csv"), index_col=False)
+            stream_time, stream_peak = measure_peak(
+                lambda: stream_integrated_csv(get_session_log_paths(folder_path, "1"), streamed_path, notes))
+            pd.testing.assert_frame_equal(pd.read_csv(streamed_path), pd.read_csv(legacy_path), check_dtype=False)
+            print(f"{num_rows:8d} rows: in memory {legacy_time:6.2f} s, peak {legacy_peak:7.1f} MB, "
+                  f"streamed {stream_time:6.2f} s, peak {stream_peak:7.1f} MB, identical rows")
+
+
+def bench_incremental_integration(sizes=(100000, 1000000), segment_rows=36000) -> None:
+    """ The alarms are rare, so the new segment can be appended """
+    print("Saving the integrated session after a new segment:")
+    for num_rows in sizes:
+        with tempfile.TemporaryDirectory() as temp_path:
+            folder_path = os.path.join(temp_path, "session_1")
+            os.makedirs(folder_path)
+            catalog = SessionCatalog(os.path.join(temp_path, "catalog.sqlite"))  # not the catalog of the station
+            write_session_segments(folder_path, "1", num_rows, segment_rows, rows_per_alarm=num_rows)
+            output_path = os.path.join(folder_path, "integrated_data_1.csv")
+            checkpoint_path = IntegrationCheckpoint.get_checkpoint_path(output_path)
+            last_segment = sorted(glob.glob(os.path.join(folder_path, "data_*")))[-1]
+            saved_paths = [(path, os.path.join(folder_path, f"saved_{i}")) for i, path in
+                           enumerate([output_path, checkpoint_path])]
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                os.rename(last_segment, last_segment + ".new")
+                save_integrated_csv(folder_path, "1", catalog)
+                os.rename(last_segment + ".new", last_segment)
+                for path, saved_path in saved_paths:
+                    shutil.copy(path, saved_path)
+                os.remove(checkpoint_path)
+                full_time = measure(lambda: save_integrated_csv(folder_path, "1", catalog), repeat=1)
+                expected = pd.read_csv(output_path)
+                for path, saved_path in saved_paths:
+                    shutil.copy(saved_path, path)
+                append_time = measure(lambda: save_integrated_csv(folder_path, "1", catalog), repeat=1)
+            catalog.close()
+            assert "again" not in log.getvalue(), log.getvalue()
+            pd.testing.assert_frame_equal(pd.read_csv(output_path), expected)
+            print(f"{num_rows:8d} rows: integrated again in {full_time:6.2f} s, "
+                  f"the last segment appended in {append_time:6.2f} s, identical rows")
+
+
+def bench_log_database(sizes=(100000, 1000000), num_updates=1000) -> None:
+    """ Rows flushed every log_flush_rows as the logger does, then the feedback of old rows and a query by user """
+    print("Logging into the frames database:")
+    flush_rows = uc.Measurements.log_flush_rows.value
+    for num_rows in sizes:
+        frames = list(create_session_logs(num_rows).values())
+        for i, frame in enumerate(frames):
+            frame.local_timestamp = 1.7e9 + i * 0.1
+            frame['user_id'] = i % 3
+        with tempfile.TemporaryDirectory() as folder_path:
+            csv_path = os.path.join(folder_path, "log.csv")
+            pd.DataFrame(columns=COLUMNS).to_csv(csv_path, index=False)
+            reference_path = os.path.join(folder_path, "log.dbref")
+            database = LogDatabase(os.path.join(folder_path, "frames.sqlite"))
+            write_reference(reference_path, database.path, "1")
+            sinks = [CsvLogSink(path=csv_path, columns=COLUMNS, flush_rows=flush_rows, flush_interval=float('inf')),
+                     DatabaseLogSink(path=reference_path, database=database, flush_rows=flush_rows,
+                                     flush_interval=float('inf'))]
+
+            def log_rows(sink):
+                for frame in frames:
+                    sink.add(frame)
+                sink.flush()
+
+            csv_time, database_time = [measure(lambda: log_rows(sink), repeat=1) for sink in sinks]
+            timestamps = random.Random(0).sample([frame.timestamp for frame in frames], num_updates)
+
+            def update_rows():
+                for timestamp in timestamps:
+                    sinks[1].update(timestamp, {'feedback': 1})
+                sinks[1].flush()
+
+            update_time = measure(update_rows, repeat=1)
+            for sink in sinks:
+                sink.close()
+            start, end = 1.7e9 + num_rows * 0.04, 1.7e9 + num_rows * 0.06
+
+            def read_csv():
+                df = pd.read_csv(csv_path)
+                return df[(df['user_id'] == 1) & (df['local_time'] >= format_local_time(start))
+                          & (df['local_time'] <= format_local_time(end))]
+
+            csv_query_time = measure(read_csv, repeat=1)
+            query_time = measure(lambda: database.get_frames(user_id=1, start_local_timestamp=start,
+                                                             end_local_timestamp=end))
+            saved = pd.concat(list(read_reference_rows(reference_path)), ignore_index=True)
+            assert len(saved) == num_rows and saved['feedback'].sum() == num_updates
+            database.close()
+            database_size = os.path.getsize(database.path)
+            print(f"{num_rows:8d} rows logged: CSV {csv_time:6.2f} s ({os.path.getsize(csv_path) / 2 ** 20:6.1f} MB), "
+                  f"database {database_time:6.2f} s ({database_size / 2 ** 20:6.1f} MB); "
+                  f"{num_updates} feedbacks of old rows {update_time * 1000:6.1f} ms; "
+                  f"rows of a user in 2% of the session: CSV {csv_query_time:6.2f} s, SQL {query_time:6.3f} s")
+
+
+def bench_compaction(sizes=(100000, 1000000), segment_rows=36000) -> None:
+    print("Compaction of a finished session:")
+    for num_rows in sizes:
+        with tempfile.TemporaryDirectory() as temp_path:
+            folder_path = os.path.join(temp_path, "session_1")
+            os.makedirs(folder_path)
+            write_session_segments(folder_path, "1", num_rows, segment_rows)
+            catalog = SessionCatalog(os.path.join(temp_path, "catalog.sqlite"))  # not the catalog of the station
+            with contextlib.redirect_stdout(io.StringIO()):
+                save_integrated_csv(folder_path, "1", catalog)
+            catalog.close()
+            notes = pd.read_csv(os.path.join(folder_path, "notes_1_all.csv"), index_col=False)
+            output_paths = [os.path.join(temp_path, f"integrated_{i}.csv") for i in range(2)]
+
+            def integrate(output_path):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stream_integrated_csv(get_session_log_paths(folder_path, "1"), output_path, notes)
+
+            size = get_folder_size(folder_path)
+            files_time = measure(lambda: integrate(output_paths[0]), repeat=1)
+            compaction_time = measure(lambda: compact_session(folder_path), repeat=1)
+            archive_time = measure(lambda: integrate(output_paths[1]), repeat=1)
+            with open(output_paths[0], 'rb') as files_output, open(output_paths[1], 'rb') as archive_output:
+                assert files_output.read() == archive_output.read()
+            print(f"{num_rows:8d} rows: {size / 2 ** 20:6.1f} MB -> {get_folder_size(folder_path) / 2 ** 20:6.1f} MB "
+                  f"({size / get_folder_size(folder_path):4.1f}x) in {compaction_time:6.2f} s; "
+                  f"integrated from the files {files_time:6.2f} s, from the archive {archive_time:6.2f} s, identical")
+
+
+def bench_model_registry(num_cold_calls=10, num_calls=1000) -> None:
+    from data_analyst import DataAnalyst  # torch, onnxruntime and scikit-learn are needed by this benchmark only
+    data = {'Sensor 2': 420, 'Sensor 4': 560, **{field: random.randint(100, 200) for field in FACE_FEATURES}}
+    data['bbox_x2'], data['bbox_y2'] = data['bbox_x1'] + 80, data['bbox_y1'] + 100
+    user_features = np.array([30, 40, 65, 170])
+
+    def predict(analyst):
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyst.detect_anomaly(data=dict(data), user_features=user_features)
+
+    cold_time = measure(lambda: [predict(DataAnalyst()) for _ in range(num_cold_calls)], repeat=1) / num_cold_calls
+    analyst = DataAnalyst()
+    first_time = measure(lambda: predict(analyst), repeat=1)
+    warm_time = measure(lambda: [predict(analyst) for _ in range(num_calls)], repeat=1) / num_calls
+    print(f"Prediction loading the models on every call: {cold_time * 1000:8.2f} ms")
+    print(f"Prediction with the model registry: first {first_time * 1000:8.2f} ms, then {warm_time * 1000:8.2f} ms "
+          f"({cold_time / warm_time:.0f}x)")
+    analyst.models.print_metrics()
+
+
+benchmarks = {
+    'parser': bench_line_parser,
+    'serial': bench_serial_ingest,
+    'logger': bench_log_all_data,
+    'segments': bench_log_segments,
+    'postprocess': bench_post_process,
+    'integration': bench_integration,
+    'incremental': bench_incremental_integration,
+    'database': bench_log_database,
+    'compaction': bench_compaction,
+    'models': bench_model_registry,
+}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Run the data pipeline benchmarks")
+    arg_parser.add_argument('names', nargs='*',
+                            help=f"benchmarks to run ({', '.join(benchmarks)}), all by default")
+    args = arg_parser.parse_args()
+    for name in args.names:
+        if name not in benchmarks:
+            arg_parser.error(f"unknown benchmark '{name}'")
+    for name in args.names or benchmarks:
+        benchmarks[name]()
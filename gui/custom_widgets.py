@@ -1,5 +1,6 @@
 import time
 import tkinter as tk
+from collections import deque
 from datetime import datetime
 from datetime import timedelta
 from typing import Callable, Union
@@ -780,7 +781,7 @@ class Graph:
     ax: Axes
     canvas: FigureCanvasTkAgg
     lines: list
-    spans_storage: list[Rectangle]
+    spans_storage: deque[Rectangle]
     span_selector: Union[None, SpanSelector]
     selected_span: tuple
     is_paused: bool
@@ -806,7 +807,8 @@ class Graph:
         self.figure, self.ax, self.canvas, self.lines = self.create_figure()
         self.span_rect = None
         self.selected_span = (0, 0)
-        self.spans_storage = list()  # list[span]
+        # the alarm spans older than the hot window are not kept for the whole session
+        self.spans_storage = deque(maxlen=ui_config.Measurements.hot_window_size.value)
         self.is_paused = paused
         if self.is_paused:
             self.span_selector = self.add_values_selector()
@@ -888,7 +890,7 @@ class Graph:
         if len(self.spans_storage) == 0:
             return None
         if visible_range is not None:
-            selected_spans = self.spans_storage[-visible_range:]  # select latest N number
+            selected_spans = list(self.spans_storage)[-visible_range:]  # select latest N number
         else:
             selected_spans = self.spans_storage  # select all
         for span in selected_spans:
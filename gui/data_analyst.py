@@ -8,14 +8,12 @@ import os
 import torch.nn as nn
 import joblib  
 import onnxruntime as ort
+from frame_schema import FACE_FEATURES
+from model_registry import ModelRegistry
 
 # Define input columns for each model
 
-model1_input_columns = [ 'bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2',
-                'left_eye_x', 'left_eye_y', 'right_eye_x', 'right_eye_y',
-                'nose_x', 'nose_y',
-                'mouth_left_x', 'mouth_left_y', 'mouth_right_x', 'mouth_right_y',
-                'facew', 'faceh', 'facea','height','weight']
+model1_input_columns = FACE_FEATURES + ['facew', 'faceh', 'facea', 'height', 'weight']
 
 model2_input_columns = [
     'weight', 'height', 'sensor4_2_diff', 'Sensor 2', 'Sensor 4'
@@ -56,6 +54,28 @@ class SimplifiedBinaryClassificationModel(nn.Module):
         x = self.fc4(x)  # No activation for final layer (logits)
         return x
 
+
+def load_pytorch_model(model_path, input_columns):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = SimplifiedBinaryClassificationModel(input_size=len(input_columns)).to(device)
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.eval()
+    return model, device
+
+
+def create_model_registry(models_dir: str) -> ModelRegistry:
+    """ The models and scalers of the voting, loaded by their first prediction or by DataAnalyst.load_models """
+    registry = ModelRegistry()
+    # Model 1 (PyTorch)
+    registry.register('model1', lambda: load_pytorch_model(os.path.join(models_dir, 'voting_model3.pth'),
+                                                            model1_input_columns))
+    registry.register('model1_scaler', lambda: joblib.load(os.path.join(models_dir, 'voting_model3_scaler.joblib')))
+    # Model 2 (ONNX)
+    registry.register('model2', lambda: ort.InferenceSession(os.path.join(models_dir, 'voting_model2.onnx')))
+    registry.register('model2_scaler', lambda: joblib.load(os.path.join(models_dir, 'model2scaler.pkl')))
+    return registry
+
+
 class DataAnalyst:
     """ Define the computation functions relevant for the project
     Provide convenience in testing and modification of algorithms
@@ -71,6 +91,11 @@ class DataAnalyst:
             "L": 88.857143,
             "XL": 95.187500
         }
+        self.models = create_model_registry(ui_config.FilePaths.model_path.value)
+
+    def load_models(self) -> None:
+        """ Load the models ahead of the first prediction, e.g. by a thread started at the sign-in """
+        self.models.preload()
 
     @staticmethod
     def detect_anomaly_test(data: dict[str, list[int]]) -> Union[None, int]:
@@ -96,13 +121,6 @@ class DataAnalyst:
         Returns:
             Union[None, int]: Returns 1 if an anomaly is detected, 0 otherwise, None if data is insufficient.
         """
-            
-        def load_pytorch_model(model_path, input_columns):
-            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            model = SimplifiedBinaryClassificationModel(input_size=len(input_columns)).to(device)
-            model.load_state_dict(torch.load(model_path, map_location=device))
-            model.eval()
-            return model, device
 
         def predict_with_pytorch_model(df, model, device, input_columns, scaler, prediction_column_name):
             missing_columns = set(input_columns) - set(df.columns)
@@ -199,33 +217,29 @@ class DataAnalyst:
         data['size'] = map_size(data['height'])
         self.data = data
 
-        models_dir = ui_config.FilePaths.model_path.value
-
         # Model 1 (PyTorch)
-        model1_path = os.path.join(models_dir, 'voting_model3.pth')
-        model1_scaler_path = os.path.join(models_dir, 'voting_model3_scaler.joblib')
-        model1_scaler = joblib.load(model1_scaler_path)
-        model1, device1 = load_pytorch_model(model1_path, model1_input_columns)
+        model1_scaler = self.models.get('model1_scaler')
+        model1, device1 = self.models.get('model1')
         #model 1 in tuning. now still out puts a lot 0. since phase 2 data were smaller.
 
         # Model 2 (ONNX)
-        model2_onnx_path = os.path.join(models_dir, 'voting_model2.onnx')
-        model2_scaler_path = os.path.join(models_dir, 'model2scaler.pkl')
-        model2_scaler = joblib.load(model2_scaler_path)
-        model2_session = ort.InferenceSession(model2_onnx_path)
+        model2_scaler = self.models.get('model2_scaler')
+        model2_session = self.models.get('model2')
 
         df = pd.DataFrame(data, index=[0])
         df_predictions = df.copy()
         
         # Predict with model1 (PyTorch)
-        df_predictions = predict_with_pytorch_model(
-            df_predictions, model1, device1, model1_input_columns, model1_scaler, 'prediction_model1'
-        )
+        with self.models.measure('model1'):
+            df_predictions = predict_with_pytorch_model(
+                df_predictions, model1, device1, model1_input_columns, model1_scaler, 'prediction_model1'
+            )
 
         # Predict with model2 (ONNX)
-        df_predictions = predict_with_onnx_model(
-            df_predictions, model2_session, model2_input_columns, model2_scaler, 'prediction_model2'
-        )
+        with self.models.measure('model2'):
+            df_predictions = predict_with_onnx_model(
+                df_predictions, model2_session, model2_input_columns, model2_scaler, 'prediction_model2'
+            )
 
         # Predict with threshold method
         df_predictions = predict_with_threshold(
@@ -305,7 +319,7 @@ class DataAnalyst:
         Retrieves the x and y values for the specified sensor, with optional upper and lower limits.
 
         Args:
-            sensor_values (dict[str, list[int]]): consists of the sensor name and list of their values
+            sensor_values (dict[str, list[int]]): consists of the sensor name and list (or HotWindow) of their values
             sensor_timestamps (list[str]): consists of the timestamps when new values were added respectively to the index of sensor values
             sensor (str): The name of the sensor.
             upper_limit (Union[None, int]): The upper limit for the number of data points to return. If `None`, all data points are returned.
@@ -316,19 +330,18 @@ class DataAnalyst:
         """
         if not sensor_values.get(sensor):
             return [0], [0]
-        x = list(range(len(sensor_values[sensor])))  # show index of the values
         # x = [':'.join(timestamp.split(':')[-2:]) for timestamp in sensor_timestamps]   # show MM:SS
-        y = sensor_values[sensor]
+        values = sensor_values[sensor]
+        num_values = len(values)
+        # only the selected range is taken, the older values of a HotWindow may be on the disk
         if upper_limit is None:
-            return x, y
-
-        if upper_limit and len(y) > upper_limit and lower_limit is None:
-            x = x[-upper_limit:]
-            y = y[-upper_limit:]
-            return x, y
-
-        x = x[lower_limit:upper_limit]
-        y = y[lower_limit:upper_limit]
+            lower, upper = 0, num_values
+        elif upper_limit and num_values > upper_limit and lower_limit is None:
+            lower, upper = num_values - upper_limit, num_values
+        else:
+            lower, upper, _ = slice(lower_limit, upper_limit).indices(num_values)
+        x = list(range(lower, max(lower, upper)))  # show index of the values
+        y = list(values[lower:upper])
         return x, y
 
     def update_threshold(self, increment: float):
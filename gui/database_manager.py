@@ -8,6 +8,8 @@ from tkinter import filedialog
 from pathlib import Path
 import re
 from data_analyst import DataAnalyst
+from retention import HotWindow
+from session_catalog import SessionCatalog
 import random
 import matplotlib.pyplot as plt
 from pathlib import Path
@@ -111,7 +113,7 @@ class UserDetails:
 class SessionInstance:
     id: str
     user_id: int
-    alarm_times: list[str]  # the variable stores sequences of alarms timestamps separated by "|"
+    alarm_times: HotWindow  # the variable stores sequences of alarms timestamps separated by "|"
     marked_data: pd.DataFrame  # list of the of values being commented during observations
     total_alarm_time: float
     user_details: UserDetails
@@ -122,7 +124,9 @@ class SessionInstance:
         self.id = datetime.datetime.now().strftime('%Y%m%d%H%M%S')  # generate unique id
         self.user_id = -1
         self.user_details = self.get_default_details()
-        self.alarm_times = ["|"]
+        # only the latest alarm sequences are kept, len() still counts the whole session
+        self.alarm_times = HotWindow(capacity=ui_config.Measurements.hot_window_size.value)
+        self.alarm_times.append("|")
         self.session_start_time = datetime.datetime.now()
         self.graph_file_path = self.get_graph_save_path()
         self.total_alarm_time = 0.0
@@ -367,6 +371,7 @@ class DatabaseManager:
     values_folder: str
     session: SessionInstance
     report_writer: ReportWriter
+    catalog: SessionCatalog
 
     def __init__(self):
         self.users_login_path = ui_config.FilePaths.user_login_db_path.value
@@ -374,6 +379,7 @@ class DatabaseManager:
         """ Store other object instances """
         self.session = SessionInstance()
         self.report_writer = ReportWriter(session=self.session)
+        self.catalog = SessionCatalog()
 
     def get_user_db(self) -> pd.DataFrame:
         """ The method checks for the existence of the file
@@ -454,6 +460,11 @@ class DatabaseManager:
                  "graph_path": self.session.graph_file_path}
         return paths
 
+    def get_user_sessions(self, start: Union[None, datetime.datetime] = None,
+                          end: Union[None, datetime.datetime] = None) -> pd.DataFrame:
+        """ Sessions of the signed-in user within the time range, found in the session catalog """
+        return self.catalog.find_sessions(user_id=self.session.user_id, start=start, end=end)
+
     def get_user_photo_path(self, relative_path=False) -> str:
         if not relative_path:
             details: UserDetails = self.session.user_details
@@ -0,0 +1,156 @@
+""" Imitation of the ESP firmware on a pseudo-terminal, the app reads it as a usual serial port:
+python device_simulator.py --rate 100 --register
+With --register the port is saved to 'serialPortName', so port_detection.GetPortName finds it.
+Linux and macOS only.
+"""
+import argparse
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+from typing import Union
+from frame_source import generate_frame_values, format_frame_lines
+from port_detection import WritePortName
+
+
+class DeviceSimulator:
+    """ Emit the lines of the device on the pty and log the commands written by the app, e.g. '!s1#'
+    Attributes:
+        rate is the number of frames per second
+        jitter is the standard deviation of the time between the frames in seconds
+        noise is the max deviation of the sensor readings
+        missing_face_ratio is the share of frames without detected face
+        color wraps the lines into the ANSI color codes
+        commands are the commands received so far
+        dropped_lines counts the lines lost because nobody has read the port
+    """
+    rate: float
+    jitter: float
+    noise: int
+    missing_face_ratio: float
+    color: bool
+    port_name: str
+    frames_sent: int
+    dropped_lines: int
+    commands: list[str]
+
+    def __init__(self, rate=10.0, jitter=0.0, noise=5, missing_face_ratio=0.0, color=False, seed=0):
+        self.rate = rate
+        self.jitter = jitter
+        self.noise = noise
+        self.missing_face_ratio = missing_face_ratio
+        self.color = color
+        self.random = random.Random(seed)
+        self.frames_sent = 0
+        self.dropped_lines = 0
+        self.commands = []
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)  # a port without reader loses the data as the UART does
+        self.port_name = os.ttyname(self.slave_fd)
+        self.is_running = False
+        self.threads = []
+
+    def start(self) -> None:
+        self.is_running = True
+        self.threads = [threading.Thread(target=self.emit_frames, daemon=True),
+                        threading.Thread(target=self.read_commands, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.is_running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def emit_frames(self) -> None:
+        period = 1 / self.rate
+        start_time = time.perf_counter()
+        due_time = start_time
+        while self.is_running:
+            timestamp = int((time.perf_counter() - start_time) * 1000)  # ms since the boot of the device
+            values = generate_frame_values(self.random, missing_face_ratio=self.missing_face_ratio,
+                                           noise=self.noise)
+            lines = format_frame_lines(timestamp, values, color=self.color)
+            self.write_lines(lines)
+            self.frames_sent += 1
+            due_time += max(0.0, self.random.gauss(period, self.jitter)) if self.jitter else period
+            delay = due_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def write_lines(self, lines: list[str]) -> None:
+        data = ''.join(line + '\n' for line in lines).encode()
+        try:
+            written = os.write(self.master_fd, data)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            return None  # the simulator is being stopped
+        if written < len(data):
+            self.dropped_lines += data.count(b'\n', written)
+
+    def read_commands(self) -> None:
+        """ The commands have the form '!<command>#' """
+        received = b''
+        while self.is_running:
+            ready, _, _ = select.select([self.master_fd], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                received += os.read(self.master_fd, 1024)
+            except (BlockingIOError, OSError):
+                continue
+            while b'#' in received:
+                command, received = received.split(b'#', 1)
+                start = command.rfind(b'!')
+                if start < 0:
+                    continue
+                command = command[start:].decode('utf-8', errors='ignore') + '#'
+                self.commands.append(command)
+                print(f"[SIMULATOR] Command received: {command}")
+
+    def get_summary(self) -> str:
+        return (f"{self.frames_sent} frames sent, {self.dropped_lines} lines dropped, "
+                f"{len(self.commands)} commands received")
+
+
+def run_simulator(rate: float, jitter: float, noise: int, missing_face_ratio: float, color: bool,
+                  duration: Union[None, float], register: bool) -> None:
+    simulator = DeviceSimulator(rate=rate, jitter=jitter, noise=noise,
+                                missing_face_ratio=missing_face_ratio, color=color)
+    if register:
+        WritePortName(simulator.port_name)
+    print(f"Device simulator on {simulator.port_name} at {rate} Hz")
+    simulator.start()
+    try:
+        if duration is None:
+            while True:
+                time.sleep(1)
+        time.sleep(duration)
+    except KeyboardInterrupt:
+        pass
+    simulator.stop()
+    print(simulator.get_summary())
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Imitate the FHP device on a pseudo-terminal")
+    arg_parser.add_argument('--rate', type=float, default=10.0, help="frames per second")
+    arg_parser.add_argument('--jitter', type=float, default=0.0, help="std of the frame period in seconds")
+    arg_parser.add_argument('--noise', type=int, default=5, help="max deviation of the sensor readings")
+    arg_parser.add_argument('--missing-face-ratio', type=float, default=0.0,
+                            help="share of the frames without detected face")
+    arg_parser.add_argument('--color', action='store_true', help="wrap the lines into the ANSI color codes")
+    arg_parser.add_argument('--duration', type=float, default=None, help="seconds to run, until Ctrl+C by default")
+    arg_parser.add_argument('--register', action='store_true',
+                            help="save the port to 'serialPortName' for port_detection.GetPortName")
+    args = arg_parser.parse_args()
+    run_simulator(rate=args.rate, jitter=args.jitter, noise=args.noise,
+                  missing_face_ratio=args.missing_face_ratio, color=args.color,
+                  duration=args.duration, register=args.register)
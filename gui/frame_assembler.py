@@ -0,0 +1,55 @@
+import time
+from typing import Callable, Union
+from line_parser import LineParser, ParsedLine
+
+
+class FrameAssembler:
+    """ Collect the range, bbox, face, MV and FHP records printed for one device tick 'I (ts)'
+    and emit the frame exactly once: when the next tick starts or when no record arrived for timeout seconds.
+    Attributes:
+        create_frame builds the empty frame for the given timestamp
+        late_records counts records of the frames which have been already emitted
+    """
+    timeout: float
+    late_records: int
+
+    def __init__(self, create_frame: Callable[[str], dict], timeout: float):
+        self.create_frame = create_frame
+        self.timeout = timeout
+        self.frame = None
+        self.timestamp = None
+        self.emitted_timestamp = None
+        self.updated_at = 0.0
+        self.late_records = 0
+
+    def feed(self, parsed: ParsedLine) -> Union[None, dict]:
+        """ Add the record to the open frame, return the previous frame once it is complete """
+        completed = None
+        if parsed.timestamp is not None and parsed.timestamp != self.timestamp:
+            if parsed.timestamp == self.emitted_timestamp:
+                # the frame has been emitted by timeout, the record came too late
+                self.late_records += 1
+                return None
+            completed = self.flush()
+            self.frame = self.create_frame(parsed.timestamp)
+            self.timestamp = parsed.timestamp
+        if self.frame is None:
+            return completed  # records received before the first tick
+        LineParser.apply(parsed, self.frame)
+        self.updated_at = time.perf_counter()
+        return completed
+
+    def poll(self) -> Union[None, dict]:
+        """ Emit the open frame if the device has been silent for longer than the timeout """
+        if self.frame is None or time.perf_counter() - self.updated_at < self.timeout:
+            return None
+        return self.flush()
+
+    def flush(self) -> Union[None, dict]:
+        """ Emit the open frame regardless of its completeness """
+        frame = self.frame
+        if frame is not None:
+            self.emitted_timestamp = self.timestamp
+        self.frame = None
+        self.timestamp = None
+        return frame
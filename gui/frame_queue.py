@@ -0,0 +1,65 @@
+import threading
+from collections import deque
+from enum import Enum
+from typing import Any, Union
+
+
+class OverflowPolicy(Enum):
+    """ What happens when the producer meets a full queue
+    drop_oldest suits rendering, where only the latest frames are worth drawing
+    drop_newest keeps the backlog and discards the incoming frame
+    block never drops, the producer waits for the consumer, e.g. for logging
+    """
+    drop_oldest = "drop_oldest"
+    drop_newest = "drop_newest"
+    block = "block"
+
+
+class FrameQueue:
+    """ Bounded queue between the serial reader thread and its consumers
+    The consumer takes everything available at once, so the work per batch
+    (e.g. a single graph redraw) does not depend on the number of frames received
+    """
+    maxsize: int
+    policy: OverflowPolicy
+    dropped: int
+
+    def __init__(self, maxsize: int, policy: OverflowPolicy):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.items = deque()
+        self.condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, item: Any, timeout: Union[None, float] = None) -> bool:
+        """ Add the item according to the overflow policy, return False if the item was dropped """
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                if self.policy == OverflowPolicy.drop_oldest:
+                    self.items.popleft()
+                    self.dropped += 1
+                elif self.policy == OverflowPolicy.drop_newest:
+                    self.dropped += 1
+                    return False
+                elif not self.condition.wait_for(lambda: len(self.items) < self.maxsize, timeout=timeout):
+                    return False
+            self.items.append(item)
+            self.condition.notify_all()
+            return True
+
+    def get_batch(self, max_items: Union[None, int] = None, timeout: Union[None, float] = 0.0) -> list:
+        """ Take up to max_items from the queue, waiting up to timeout for the first one """
+        with self.condition:
+            if not self.items and timeout != 0.0:
+                self.condition.wait_for(lambda: len(self.items) > 0, timeout=timeout)
+            if max_items is None or max_items >= len(self.items):
+                batch = list(self.items)
+                self.items.clear()
+            else:
+                batch = [self.items.popleft() for _ in range(max_items)]
+            if batch:
+                self.condition.notify_all()
+            return batch
@@ -0,0 +1,138 @@
+""" Single definition of the fields received from the device and logged for every frame.
+The numeric fields of a frame are kept in one float array, ordered so that
+the sensor values and the facial features are contiguous and can be sliced without copying.
+"""
+import datetime
+import time
+from typing import Any, Iterator, Union
+import numpy as np
+import ui_config as uc
+
+SENSOR_FIELDS = ['sensor_2', 'sensor_4']
+BBOX_FIELDS = ['bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2']
+LANDMARK_FIELDS = ['left_eye_x', 'left_eye_y', 'right_eye_x', 'right_eye_y',
+                   'nose_x', 'nose_y',
+                   'mouth_left_x', 'mouth_left_y', 'mouth_right_x', 'mouth_right_y']
+FACE_FEATURES = BBOX_FIELDS + LANDMARK_FIELDS
+MV_FIELDS = ['mv_1', 'mv_2', 'mv_3', 'mv_4']
+
+NUMERIC_FIELDS = SENSOR_FIELDS + FACE_FEATURES + MV_FIELDS + [
+    'fhp', 'prediction', 'notification_interval', 'feedback', 'model_threshold']
+# Fields stored as attributes of the frame, everything else is in Frame.values
+ATTRIBUTE_FIELDS = ['timestamp', 'local_timestamp', 'user_id',
+                    'notes', 'bad_posture_command', 'alarm_notification', 'model_notes']
+
+FIELD_INDEX = {field: i for i, field in enumerate(NUMERIC_FIELDS)}
+SENSOR_SLICE = slice(FIELD_INDEX['sensor_2'], FIELD_INDEX['sensor_4'] + 1)
+FACE_SLICE = slice(FIELD_INDEX[FACE_FEATURES[0]], FIELD_INDEX[FACE_FEATURES[-1]] + 1)
+
+# Columns of the log files in the order they are written
+COLUMNS = [
+    'timestamp', 'local_time', 'sensor_2', 'sensor_4',
+    'bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2',
+    'mv_1', 'mv_2', 'mv_3', 'mv_4',
+    'left_eye_x', 'left_eye_y', 'right_eye_x', 'right_eye_y',
+    'nose_x', 'nose_y', 'mouth_left_x', 'mouth_left_y',
+    'mouth_right_x', 'mouth_right_y', 'fhp', 'prediction',
+    'notes', 'user_id', 'alarm_notification',
+    'notification_interval', 'feedback', 'model_threshold', 'model_notes'
+]
+COLUMN_INDEX = {column: i for i, column in enumerate(COLUMNS)}
+
+# Keys of a frame in the order of the former default data entry
+ENTRY_KEYS = ['timestamp', 'local_time', 'local_timestamp'] + SENSOR_FIELDS + BBOX_FIELDS + MV_FIELDS + \
+             LANDMARK_FIELDS + ['fhp', 'prediction', 'user_id', 'bad_posture_command', 'alarm_notification',
+                                'notification_interval', 'feedback', 'notes', 'model_threshold', 'model_notes']
+
+empty_values = np.full(len(NUMERIC_FIELDS), np.nan)
+local_time_cache = (None, "")  # (second, formatted local time), replaced as a whole to stay thread-safe
+
+
+def format_local_time(local_timestamp: float) -> str:
+    """ Format the local time once per second instead of once per frame """
+    global local_time_cache
+    second = int(local_timestamp)
+    cached_second, text = local_time_cache
+    if second != cached_second:
+        text = datetime.datetime.fromtimestamp(second).strftime(uc.Measurements.time_format.value)
+        local_time_cache = (second, text)
+    return text
+
+
+class Frame:
+    """ All the data logged for one device timestamp
+    The frame supports the item access of the former data entry dict, e.g. frame['sensor_2']
+    """
+    __slots__ = ('values', 'timestamp', 'local_timestamp', 'user_id',
+                 'notes', 'bad_posture_command', 'alarm_notification', 'model_notes', 'fixed_local_time')
+
+    def __init__(self, timestamp: str, local_timestamp: Union[None, float] = None):
+        self.values = empty_values.copy()
+        self.timestamp = timestamp
+        self.local_timestamp = time.time() if local_timestamp is None else local_timestamp
+        self.user_id = -1
+        self.notes = ""
+        self.bad_posture_command = 'no'
+        self.alarm_notification = 'no'
+        self.model_notes = np.nan
+        self.fixed_local_time = None
+
+    def __repr__(self) -> str:
+        return f"Frame({dict(self.items())})"
+
+    @property
+    def local_time(self) -> str:
+        if self.fixed_local_time is not None:
+            return self.fixed_local_time
+        return format_local_time(self.local_timestamp)
+
+    def __getitem__(self, key: str) -> Any:
+        index = FIELD_INDEX.get(key)
+        if index is not None:
+            return self.values[index]
+        if key == 'local_time':
+            return self.local_time
+        if key in ATTRIBUTE_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        index = FIELD_INDEX.get(key)
+        if index is not None:
+            self.values[index] = value
+        elif key == 'local_time':
+            self.fixed_local_time = value
+        elif key in ATTRIBUTE_FIELDS:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in FIELD_INDEX or key == 'local_time' or key in ATTRIBUTE_FIELDS
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(ENTRY_KEYS)
+
+    def get(self, key: str, default=None) -> Any:
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self) -> list[str]:
+        return ENTRY_KEYS
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        for key in ENTRY_KEYS:
+            yield key, self[key]
+
+    def update(self, data: dict) -> None:
+        for key, value in data.items():
+            self[key] = value
+
+    def get_sensor_values(self) -> np.ndarray:
+        """ View of [sensor_2, sensor_4] """
+        return self.values[SENSOR_SLICE]
+
+    def get_face_vector(self) -> np.ndarray:
+        """ View of the facial features ordered as FACE_FEATURES """
+        return self.values[FACE_SLICE]
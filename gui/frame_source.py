@@ -0,0 +1,349 @@
+import heapq
+import random
+import re
+import threading
+import time
+from typing import Callable, Iterator, Union
+import ui_config as uc
+from serial_manager import SerialManager
+from frame_queue import FrameQueue, OverflowPolicy
+
+
+class FrameSource:
+    """ Producer of raw device lines consumed by ThreadManager.connect
+    Attributes:
+        is_exhausted becomes True once a finite source has no lines left
+        poll_delay is the time in seconds the reader waits when no line is available
+        serial_manager is the port receiving the commands to the device, None for offline sources
+    """
+    is_exhausted: bool
+    poll_delay: float
+    serial_manager: Union[None, SerialManager]
+
+    def __init__(self, poll_delay=0.0):
+        self.is_exhausted = False
+        self.poll_delay = poll_delay
+        self.serial_manager = None
+
+    def read_line(self) -> Union[str, None]:
+        raise NotImplementedError
+
+    def add_reconnect_listener(self, listener: Callable[[float, float], None]) -> None:
+        """ Call the listener after the lost device is reconnected, offline sources never disconnect """
+        pass
+
+    def read_lines(self) -> list[str]:
+        """ Return all the lines available at the moment, empty list if there are none """
+        line = self.read_line()
+        if line is None:
+            return []
+        return [line]
+
+    def close(self) -> None:
+        pass
+
+
+class SerialFrameSource(FrameSource):
+    """ Live source reading the lines from the connected device
+    In bulk mode the source blocks on the port until the data arrives and returns every complete line,
+    otherwise it polls SerialManager.read_line and the reader sleeps when nothing is buffered
+    """
+
+    def __init__(self, serial_manager: SerialManager, bulk=True):
+        super().__init__(poll_delay=0.0 if bulk else uc.Measurements.thread_delay.value)
+        self.serial_manager = serial_manager
+        self.bulk = bulk
+
+    def read_line(self) -> Union[str, None]:
+        return self.serial_manager.read_line()
+
+    def add_reconnect_listener(self, listener: Callable[[float, float], None]) -> None:
+        self.serial_manager.add_reconnect_listener(listener)
+
+    def read_lines(self) -> list[str]:
+        if not self.bulk:
+            return super().read_lines()
+        return self.serial_manager.read_lines()
+
+    def close(self) -> None:
+        self.serial_manager.close()
+
+
+def get_device_tick(line: str) -> Union[None, int]:
+    """ Device timestamp of the line 'I (ts) ...', None if the line has no header """
+    if not line.startswith('I ('):
+        return None
+    end = line.find(')', 3)
+    tick = line[3:end]
+    return int(tick) if end > 3 and tick.isdigit() else None
+
+
+class MultiPortSource(FrameSource):
+    """ Live source reading several ports of the same device concurrently, one reader thread per port
+    The ports print the same device clock, so the lines are merged by their timestamp 'I (ts)':
+    a tick is released only once every active port has moved past it,
+    which keeps the records of one tick together in one frame.
+    A port silent for longer than stale_timeout does not hold back the others.
+    The first port receives the commands to the device.
+    """
+    serial_managers: list[SerialManager]
+    stale_timeout: float
+
+    def __init__(self, serial_managers: list[SerialManager], stale_timeout: float):
+        super().__init__(poll_delay=0.0)
+        self.serial_managers = serial_managers
+        self.serial_manager = serial_managers[0]
+        self.stale_timeout = stale_timeout
+        self.queue = FrameQueue(maxsize=uc.Measurements.port_queue_size.value, policy=OverflowPolicy.block)
+        self.pending = []  # heap of (tick, arrival number, line)
+        self.arrivals = 0
+        self.port_ticks: list[Union[None, int]] = [None] * len(serial_managers)
+        self.port_updated = [0.0] * len(serial_managers)
+        self.is_running = True
+        self.threads = [threading.Thread(target=self.read_port, args=(index,), daemon=True)
+                        for index in range(len(serial_managers))]
+        for thread in self.threads:
+            thread.start()
+
+    def add_reconnect_listener(self, listener: Callable[[float, float], None]) -> None:
+        for serial_manager in self.serial_managers:
+            serial_manager.add_reconnect_listener(listener)
+
+    def read_port(self, index: int) -> None:
+        """ Reader thread of one port """
+        serial_manager = self.serial_managers[index]
+        while self.is_running:
+            if serial_manager.ser is None:
+                time.sleep(uc.Measurements.thread_delay.value)
+                continue
+            lines = serial_manager.read_lines()
+            # the lines are never dropped, a stalled consumer holds the reader back until the source is closed
+            while lines and not self.queue.put((index, lines), timeout=self.stale_timeout):
+                if not self.is_running:
+                    return None
+
+    def read_lines(self) -> list[str]:
+        now = time.perf_counter()
+        for index, lines in self.queue.get_batch(timeout=uc.Measurements.serial_read_timeout.value):
+            tick = self.port_ticks[index]
+            for line in lines:
+                line_tick = get_device_tick(line)
+                if line_tick is not None:
+                    tick = line_tick
+                # lines without the header stay with the last tick of their port
+                heapq.heappush(self.pending, (-1 if tick is None else tick, self.arrivals, line))
+                self.arrivals += 1
+            self.port_ticks[index] = tick
+            self.port_updated[index] = now
+        if not self.pending:
+            return []
+        active_ticks = [tick for tick, updated in zip(self.port_ticks, self.port_updated)
+                        if tick is not None and now - updated < self.stale_timeout]
+        # the active ports may still print the records of their current tick
+        watermark = min(active_ticks) if active_ticks else float('inf')
+        lines = []
+        while self.pending and self.pending[0][0] < watermark:
+            lines.append(heapq.heappop(self.pending)[2])
+        return lines
+
+    def close(self) -> None:
+        self.is_running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        for serial_manager in self.serial_managers:
+            serial_manager.close()
+
+
+class PacedFrameSource(FrameSource):
+    """ Finite or infinite source which replays the lines with the timing of the device
+    Speed 1.0 reproduces the original rate, N plays N times faster
+    and None emits the lines as fast as possible
+    """
+    timestamp_pattern = re.compile(r'I \((\d+)\)')
+
+    def __init__(self, speed: Union[None, float] = 1.0):
+        super().__init__(poll_delay=0.0)
+        self.speed = speed
+        self.first_timestamp = None
+        self.start_time = 0.0
+        self.lines_iter = None
+
+    def iter_lines(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def read_line(self) -> Union[str, None]:
+        if self.is_exhausted:
+            return None
+        if self.lines_iter is None:
+            self.lines_iter = self.iter_lines()
+        line = next(self.lines_iter, None)
+        if line is None:
+            self.is_exhausted = True
+            return None
+        self.wait_for(line)
+        return line
+
+    def wait_for(self, line: str) -> None:
+        """ Sleep until the device timestamp of the line is due """
+        if not self.speed:
+            return None
+        match = self.timestamp_pattern.search(line)
+        if not match:
+            return None
+        device_time = int(match.group(1)) / 1000  # device timestamps are in ms
+        if self.first_timestamp is None:
+            self.first_timestamp = device_time
+            self.start_time = time.perf_counter()
+            return None
+        due_time = self.start_time + (device_time - self.first_timestamp) / self.speed
+        delay = due_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RecordedLogSource(PacedFrameSource):
+    """ Replay a putty-style log recorded from the device, e.g. data/sample_data/0713putty.log """
+
+    def __init__(self, path: str, speed: Union[None, float] = 1.0, loop=False):
+        super().__init__(speed=speed)
+        self.path = path
+        self.loop = loop
+
+    def iter_lines(self) -> Iterator[str]:
+        while True:
+            with open(self.path, 'r', encoding='utf-8', errors='ignore') as log_file:
+                for line in log_file:
+                    line = line.rstrip()
+                    if line:
+                        yield line
+            if not self.loop:
+                return
+            self.first_timestamp = None  # restart the timing for the next round
+
+
+class SyntheticSource(PacedFrameSource):
+    """ Generate the device lines of a user sitting in front of the prototype
+    Attributes:
+        rate is the number of frames per second emitted by the imitated firmware
+        num_frames limits the number of generated frames or None for infinite source
+        missing_face_ratio is the share of frames without detected face
+        color wraps the lines into the ANSI color codes as the firmware console does
+    """
+
+    def __init__(self, rate=10.0, num_frames: Union[None, int] = None,
+                 speed: Union[None, float] = 1.0, missing_face_ratio=0.0, color=False, seed=0):
+        super().__init__(speed=speed)
+        self.rate = rate
+        self.color = color
+        self.num_frames = num_frames
+        self.missing_face_ratio = missing_face_ratio
+        self.random = random.Random(seed)
+
+    def iter_lines(self) -> Iterator[str]:
+        frame_num = 0
+        step_ms = 1000 / self.rate
+        while self.num_frames is None or frame_num < self.num_frames:
+            timestamp = int(frame_num * step_ms)
+            values = generate_frame_values(self.random, missing_face_ratio=self.missing_face_ratio)
+            for line in format_frame_lines(timestamp, values, color=self.color):
+                yield line
+            frame_num += 1
+
+
+def generate_frame_values(rnd: random.Random, missing_face_ratio=0.0, noise=5) -> dict:
+    """ Produce readings of a single frame in the range observed on the prototype """
+    sensor_2 = rnd.randint(480, 620)
+    sensor_4 = sensor_2 + rnd.randint(20, 180)
+    values = {'sensor_2': sensor_2 + rnd.randint(-noise, noise),
+              'sensor_4': sensor_4 + rnd.randint(-noise, noise),
+              'mv': [rnd.randint(0, 255) for _ in range(4)],
+              'fhp': sensor_4 - sensor_2,
+              'face': None}
+    if rnd.random() < missing_face_ratio:
+        return values
+    x1, y1 = rnd.randint(80, 120), rnd.randint(60, 100)
+    x2, y2 = x1 + rnd.randint(90, 110), y1 + rnd.randint(110, 130)
+    values['face'] = {'bbox': (x1, y1, x2, y2),
+                      'left_eye': (x1 + 25, y1 + 40),
+                      'right_eye': (x2 - 25, y1 + 40),
+                      'nose': ((x1 + x2) // 2, y1 + 65),
+                      'mouth_left': (x1 + 30, y2 - 30),
+                      'mouth_right': (x2 - 30, y2 - 30)}
+    return values
+
+
+def format_frame_lines(timestamp: int, values: dict, color=False) -> list[str]:
+    """ Format the readings of one frame as the ESP firmware prints them """
+    face = values['face']
+    lines = [f"I ({timestamp}) tof: Range: {values['sensor_2']} {values['sensor_4']}, "]
+    if face is not None:
+        lines.append(f"I ({timestamp}) face: detection_result: [0]: ({', '.join(str(v) for v in face['bbox'])})")
+        lines.append(f"I ({timestamp}) face: left eye: ({face['left_eye'][0]}, {face['left_eye'][1]}), "
+                     f"right eye: ({face['right_eye'][0]}, {face['right_eye'][1]}), "
+                     f"nose: ({face['nose'][0]}, {face['nose'][1]}), "
+                     f"mouth left: ({face['mouth_left'][0]}, {face['mouth_left'][1]}), "
+                     f"mouth right: ({face['mouth_right'][0]}, {face['mouth_right'][1]})")
+    lines.append(f"I ({timestamp}) tof: MV: {', '.join(str(v) for v in values['mv'])}")
+    lines.append(f"I ({timestamp}) tof: FHP detected, {values['fhp']}, mm")
+    if color:
+        lines = [f"\x1B[0;32m{line}\x1B[0m" for line in lines]
+    return lines
+
+
+class ReplayStats:
+    """ Throughput of the lines and frames pushed through the pipeline """
+    lines: int
+    frames: int
+    last_timestamp: Union[None, str]
+
+    def __init__(self):
+        self.lines = 0
+        self.frames = 0
+        self.last_timestamp = None
+        self.start_time = time.perf_counter()
+        self.finish_time = self.start_time
+
+    def add_line(self, timestamp: Union[None, str]) -> None:
+        self.lines += 1
+        if timestamp is not None and timestamp != self.last_timestamp:
+            self.frames += 1
+            self.last_timestamp = timestamp
+        self.finish_time = time.perf_counter()
+
+    def get_elapsed_time(self) -> float:
+        return max(self.finish_time - self.start_time, 1e-9)
+
+    def get_lines_per_second(self) -> float:
+        return self.lines / self.get_elapsed_time()
+
+    def get_frames_per_second(self) -> float:
+        return self.frames / self.get_elapsed_time()
+
+    def __repr__(self) -> str:
+        return (f"{self.lines} lines, {self.frames} frames in {self.get_elapsed_time():.3f} s "
+                f"({self.get_lines_per_second():.1f} lines/s, {self.get_frames_per_second():.1f} frames/s)")
+
+
+class ReplayEngine:
+    """ Pump a finite source into the handler without the UI, e.g. for CI throughput checks
+    The handler receives every line and returns the device timestamp it belongs to
+    """
+
+    def __init__(self, source: FrameSource, handler: Callable[[str], Union[None, str]]):
+        self.source = source
+        self.handler = handler
+        self.stats = ReplayStats()
+
+    def run(self, max_lines: Union[None, int] = None) -> ReplayStats:
+        self.stats = ReplayStats()
+        while max_lines is None or self.stats.lines < max_lines:
+            lines = self.source.read_lines()
+            if not lines:
+                if self.source.is_exhausted:
+                    break
+                time.sleep(self.source.poll_delay)
+                continue
+            for line in lines:
+                self.stats.add_line(self.handler(line))
+        self.source.close()
+        return self.stats
@@ -1,4 +1,3 @@
-import serial
 import tkinter as tk
 from serial_manager import SerialManager
 
@@ -49,12 +48,6 @@ class LightControllerApp:
             self.send_light_command(command)
 
     def send_light_command(self, command: str):
-        """ Send the light command to the device via SerialManager """
-        if self.serial_manager.ser:  # 确保串口已经初始化
-            try:
-                self.serial_manager.ser.write(command.encode())  # 使用 SerialManager 发送命令
-                print(f"[DEBUG] Command sent: {command}")
-            except serial.SerialException as e:
-                print(f"[ERROR] Error sending command: {e}")
-        else:
-            print("[ERROR] Serial port is not initialized")
+        """ Queue the light command for the writer thread of SerialManager """
+        if self.serial_manager.send_command(command):
+            print(f"[DEBUG] Command queued: {command}")
@@ -0,0 +1,93 @@
+import re
+from typing import Union
+
+
+class ParsedLine:
+    """ Typed content of a single device line
+    Attributes:
+        timestamp is the device timestamp 'I (ts)' as str or None if the line has no header
+        kind is one of the LineParser.record_fields keys or None for unknown records
+        values are the integers of the record ordered as LineParser.record_fields[kind]
+    """
+    __slots__ = ('timestamp', 'kind', 'values')
+
+    def __init__(self, timestamp: Union[None, str], kind: Union[None, str], values: tuple):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.values = values
+
+    def __repr__(self) -> str:
+        return f"ParsedLine(timestamp={self.timestamp}, kind={self.kind}, values={self.values})"
+
+
+class LineParser:
+    """ Single-pass parser of the lines printed by the ESP firmware, e.g.
+    I (12345) tof: Range: 512 640,
+    Every line carries one record, so the prefix of the message picks the only pattern to run.
+    All the patterns are compiled once per process.
+    """
+    ansi_pattern = re.compile(r'\x1B\[[0-9;]*[A-Za-z]')
+    header_pattern = re.compile(r'I \((\d+)\)(?:[^:]*:\s*)?')
+
+    record_fields = {
+        'range': ('sensor_2', 'sensor_4'),
+        'bbox': ('bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2'),
+        'face': ('left_eye_x', 'left_eye_y', 'right_eye_x', 'right_eye_y', 'nose_x', 'nose_y',
+                 'mouth_left_x', 'mouth_left_y', 'mouth_right_x', 'mouth_right_y'),
+        'mv': ('mv_1', 'mv_2', 'mv_3', 'mv_4'),
+        'fhp': ('fhp',),
+    }
+    # (message prefix, record kind, pattern) in the order the firmware prints them
+    record_patterns = (
+        ('Range:', 'range', re.compile(r'Range: (\d+)\s+(\d+),')),
+        ('detection_result', 'bbox',
+         re.compile(r'detection_result:\s*\[\s*\d+\]:\s*\(\s*(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\)')),
+        ('left eye', 'face',
+         re.compile(r'left eye: \(\s*(\d+),\s*(\d+)\), right eye: \(\s*(\d+),\s*(\d+)\), '
+                    r'nose: \(\s*(\d+),\s*(\d+)\), mouth left: \(\s*(\d+),\s*(\d+)\), '
+                    r'mouth right: \(\s*(\d+),\s*(\d+)\)')),
+        ('MV:', 'mv', re.compile(r'MV: (\d+), (\d+), (\d+), (\d+)')),
+        ('FHP detected', 'fhp', re.compile(r'FHP detected.*?(\d+), mm')),
+    )
+
+    def parse(self, line: str) -> ParsedLine:
+        if '\x1b' in line:
+            line = self.ansi_pattern.sub('', line)
+        timestamp = None
+        body = line
+        if line.startswith('I ('):
+            # fast path for the usual header 'I (ts) tag: message'
+            end = line.find(')', 3)
+            separator = line.find(': ', end)
+            if end > 3 and line[3:end].isdigit():
+                timestamp = line[3:end]
+                body = line[separator + 2:] if separator > 0 else line[end + 1:].lstrip()
+        if timestamp is None:
+            header = self.header_pattern.search(line)
+            if header:
+                timestamp = header.group(1)
+                body = line[header.end():]
+        for prefix, kind, pattern in self.record_patterns:
+            if body.startswith(prefix):
+                return self.match_record(timestamp, kind, pattern, body)
+        # The message does not start with a known prefix, look for the keyword anywhere
+        for prefix, kind, pattern in self.record_patterns:
+            if prefix in line:
+                return self.match_record(timestamp, kind, pattern, line)
+        return ParsedLine(timestamp, None, ())
+
+    @staticmethod
+    def match_record(timestamp: Union[None, str], kind: str, pattern: re.Pattern, body: str) -> ParsedLine:
+        match = pattern.search(body)
+        if not match:
+            return ParsedLine(timestamp, None, ())
+        return ParsedLine(timestamp, kind, tuple(map(int, match.groups())))
+
+    @classmethod
+    def apply(cls, parsed: ParsedLine, data_entry) -> dict:
+        """ Write the values of the parsed record into the data entry """
+        if parsed.kind is None:
+            return data_entry
+        for field, value in zip(cls.record_fields[parsed.kind], parsed.values):
+            data_entry[field] = value
+        return data_entry
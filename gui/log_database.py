@@ -0,0 +1,173 @@
+""" Frames of all the sessions in one SQLite database of the station, an alternative to the CSV log files
+    frames: session_id, segment, row, then the columns of the logs with the local timestamp instead of the local time
+    threshold_changes: the rows where the model threshold was changed, with its model notes
+Every log segment of a session is a small reference file in the session folder, data_..._<session id>.dbref:
+    {"format": "fhp-log-database", "version": 1, "database": "...", "session_id": "...", "segment": "..."}
+so the manifest, the rotation and the integration handle the segments of the database as the log files.
+The log writer inserts the rows in one transaction per flush, the predictions, notes, feedback and thresholds
+given after the flush update the saved row found by its timestamp, see LogDatabase.write_rows.
+The database is in the WAL mode, so the integration and the analysis read it while the logger writes.
+The rows of a time range are selected by e.g.: python log_database.py "SELECT ... FROM frames WHERE ..."
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable, Iterator, Union
+import numpy as np
+import pandas as pd
+import ui_config as uc
+from frame_schema import NUMERIC_FIELDS, COLUMNS
+from log_segments import ATTRIBUTE_COLUMNS, format_local_times, from_text_array
+from session_store import TEXT_FIELDS
+from session_archive import open_session_file
+
+REFERENCE_VERSION = 1
+REFERENCE_FORMAT = "fhp-log-database"
+DATABASE_EXTENSION = ".dbref"
+FRAME_COLUMNS = ATTRIBUTE_COLUMNS + NUMERIC_FIELDS
+COLUMN_TYPES = {'timestamp': "INTEGER NOT NULL", 'local_timestamp': "REAL NOT NULL", 'user_id': "INTEGER",
+                **{field: "TEXT" for field in TEXT_FIELDS}, **{field: "REAL" for field in NUMERIC_FIELDS}}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS frames (
+    session_id TEXT NOT NULL, segment TEXT NOT NULL, row INTEGER NOT NULL,
+    {", ".join(f"{column} {COLUMN_TYPES[column]}" for column in FRAME_COLUMNS)},
+    PRIMARY KEY (session_id, segment, row));
+CREATE INDEX IF NOT EXISTS frames_by_timestamp ON frames (session_id, timestamp);
+CREATE INDEX IF NOT EXISTS frames_by_time ON frames (local_timestamp);
+CREATE INDEX IF NOT EXISTS frames_by_user ON frames (user_id, local_timestamp);
+CREATE VIEW IF NOT EXISTS threshold_changes AS
+    SELECT session_id, timestamp, local_timestamp, user_id, model_threshold, model_notes
+    FROM frames WHERE model_notes IS NOT NULL;
+"""
+
+
+def write_reference(path: str, database_path: str, session_id: str) -> None:
+    """ The log segment at path is stored in the database, the file only points to its rows """
+    reference = {"format": REFERENCE_FORMAT, "version": REFERENCE_VERSION, "database": os.path.abspath(database_path),
+                 "session_id": session_id, "segment": os.path.basename(path)}
+    with open(path, 'w', encoding='utf-8') as reference_file:
+        json.dump(reference, reference_file)
+
+
+def read_reference(path: str) -> dict:
+    with open_session_file(path, 'r') as reference_file:
+        reference = json.load(reference_file)
+    if reference.get('format') != REFERENCE_FORMAT or reference.get('version', 0) > REFERENCE_VERSION:
+        raise ValueError(f"Unsupported log reference {path}: {reference.get('format')} "
+                         f"version {reference.get('version')}")
+    return reference
+
+
+def to_sql_value(value):
+    """ NaN is NULL and the NumPy scalars, e.g. a prediction of the model, are saved as the Python ones """
+    if isinstance(value, np.generic):
+        value = value.item()
+    return None if value != value else value
+
+
+def to_log_rows(frames: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """ Rows of the frames table in the given columns of the logs, read as pd.read_csv would """
+    data = {}
+    for column in columns:
+        if column == 'local_time':
+            data[column] = format_local_times(frames['local_timestamp'].to_numpy())
+        elif column in TEXT_FIELDS:
+            data[column] = from_text_array(frames[column].fillna('').to_numpy())
+        else:
+            data[column] = frames[column].to_numpy()
+    return pd.DataFrame(data, columns=columns)
+
+
+def read_reference_rows(path: str, start_row=0, num_rows: Union[None, int] = None,
+                        chunk_rows: Union[None, int] = None, columns: list[str] = COLUMNS) -> Iterator[pd.DataFrame]:
+    """ Rows of the log segment from start_row in chunks of chunk_rows, all the saved ones if num_rows is None """
+    reference = read_reference(path)
+    selected = list(dict.fromkeys(['local_timestamp' if column == 'local_time' else column for column in columns]))
+    query = (f"SELECT {', '.join(selected)} FROM frames WHERE session_id = ? AND segment = ? AND row >= ?"
+             + ("" if num_rows is None else " AND row < ?") + " ORDER BY row")
+    parameters = [reference['session_id'], reference['segment'], start_row]
+    if num_rows is not None:
+        parameters.append(start_row + num_rows)
+    # a connection of its own while the logger writes, the chunks may be read by the different threads in turn
+    connection = sqlite3.connect(reference['database'], timeout=10.0, check_same_thread=False)
+    try:
+        chunks = pd.read_sql_query(query, connection, params=parameters, chunksize=chunk_rows,
+                                   dtype={field: 'float64' for field in NUMERIC_FIELDS if field in selected})
+        for chunk in [chunks] if chunk_rows is None else chunks:
+            yield to_log_rows(chunk, columns)
+    finally:
+        connection.close()
+
+
+class LogDatabase:
+    """ Connection of the logger to the frames database, used by the log writer thread """
+    path: str
+
+    def __init__(self, path: Union[None, str] = None):
+        self.path = uc.FilePaths.log_database_path.value if path is None else path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def write_rows(self, session_id: str, segment: str, first_row: int, numeric: np.ndarray,
+                   attributes: dict[str, Iterable], updates: list[tuple[str, dict]]) -> None:
+        """ Insert the rows numbered from first_row and then apply the updates in one transaction
+        attributes are the ATTRIBUTE_COLUMNS, updates are (timestamp, {column: value}) of the rows saved before,
+        a timestamp repeated after the device restarted updates its latest row as Logger.logs does
+        """
+        columns = [list(attributes[column]) for column in ATTRIBUTE_COLUMNS]
+        numeric = np.asarray(numeric, dtype=np.float64).reshape(-1, len(NUMERIC_FIELDS))  # NaN is saved as NULL
+        rows = [(session_id, segment, first_row + i, *values)
+                for i, values in enumerate(zip(*columns, *numeric.T.tolist()))]
+        placeholders = ", ".join("?" * (3 + len(FRAME_COLUMNS)))
+        with self.lock, self.connection:
+            self.connection.executemany(f"INSERT INTO frames VALUES ({placeholders})", rows)
+            for timestamp, values in updates:
+                unknown = set(values) - set(FRAME_COLUMNS)
+                if unknown:
+                    raise KeyError(f"Unknown log columns {unknown}")
+                assignments = ", ".join(f"{column} = ?" for column in values)
+                self.connection.execute(
+                    f"UPDATE frames SET {assignments} WHERE rowid = "
+                    f"(SELECT rowid FROM frames WHERE session_id = ? AND timestamp = ? ORDER BY rowid DESC LIMIT 1)",
+                    [*[to_sql_value(value) for value in values.values()], session_id, timestamp])
+
+    def query(self, query: str, parameters: Iterable = ()) -> pd.DataFrame:
+        """ Result of a SELECT, e.g. the feedback of the alarms of a user within a week """
+        with self.lock:
+            return pd.read_sql_query(query, self.connection, params=list(parameters))
+
+    def get_frames(self, session_id: Union[None, str] = None, user_id: Union[None, int] = None,
+                   start_local_timestamp: Union[None, float] = None,
+                   end_local_timestamp: Union[None, float] = None) -> pd.DataFrame:
+        """ Rows of the session and the user within the range of local timestamps in the columns of the logs """
+        query, parameters = "SELECT * FROM frames WHERE 1", []
+        for condition, value in [("session_id = ?", session_id), ("user_id = ?", user_id),
+                                 ("local_timestamp >= ?", start_local_timestamp),
+                                 ("local_timestamp <= ?", end_local_timestamp)]:
+            if value is not None:
+                query += f" AND {condition}"
+                parameters.append(value)
+        frames = self.query(query + " ORDER BY local_timestamp, rowid", parameters)
+        return to_log_rows(frames.astype({field: 'float64' for field in NUMERIC_FIELDS}), COLUMNS)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Query the frames database of the station")
+    arg_parser.add_argument('query', help="SELECT statement, e.g. \"SELECT * FROM threshold_changes\"")
+    arg_parser.add_argument('--database', default=None, help="path of the database, the configured one by default")
+    args = arg_parser.parse_args()
+    database = LogDatabase(args.database)
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(database.query(args.query))
+    database.close()
@@ -1,12 +1,56 @@
+""" Integration of the log files of a session into a single sorted file
+The segments are merged by timestamp as a stream: each of them is read chunk by chunk ahead of the merge,
+the rows below the watermark, which no segment can precede any more, are post-processed and written at once,
+so the memory is bounded by the chunks in flight instead of the whole session.
+The state of the integrated file is checkpointed after every save, so the next save appends only the new rows,
+see IntegrationCheckpoint. The totals of the log files then replace those of the logger in the session catalog.
+The files of the compacted sessions are read from their archive, see session_archive.py.
+"""
+import io
+import json
 import os
+import sys
 import pandas as pd
 import glob
-from logger import Logger
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Iterator, Union
+import ui_config as uc
+from logger import Logger, CsvLogSink
+from frame_schema import COLUMNS, NUMERIC_FIELDS
+from log_segments import SEGMENT_EXTENSION, read_segment, load_segments, format_local_times
+from log_database import DATABASE_EXTENSION, read_reference_rows
+from session_manifest import SessionManifest, SegmentInfo
+from session_catalog import SessionCatalog, get_user_stats, merge_user_stats
+from session_archive import open_session_file, session_file_exists, list_session_files, get_merged_log
+
+SCAN_COLUMNS = ['timestamp', 'local_time', 'alarm_notification', 'notification_interval', 'feedback', 'user_id']
+
+
+def get_session_log_paths(folder_path: str, session_id: str) -> list[str]:
+    """ The files are taken from the session manifest, older sessions without it are globbed,
+    the CSV log files of a compacted session are read as the single file they are merged into
+    """
+    manifest = SessionManifest.load(folder_path, session_id)
+    if manifest is None:
+        # logged before the manifest existed
+        paths = list_session_files(folder_path, f"data_*_{session_id}.csv") + \
+            list_session_files(folder_path, f"data_*_{session_id}{SEGMENT_EXTENSION}") + \
+            list_session_files(folder_path, f"data_*_{session_id}{DATABASE_EXTENSION}")
+    else:
+        paths = manifest.get_segment_paths()
+    merged_log = get_merged_log(folder_path)
+    if merged_log is None:
+        return paths
+    merged_path, merged_files = merged_log
+    merged_files.append(os.path.basename(merged_path))
+    return [merged_path] + [path for path in paths if os.path.basename(path) not in merged_files]
 
 
 def integrate_csv_files(folder_path: str, session_id: str):
     """
     Integrates and sorts all CSV files associated with a specific session ID within a given folder.
+    The whole session is loaded into memory, save_integrated_csv streams it instead.
 
     Args:
         folder_path (str): The path to the folder containing the CSV files.
@@ -15,43 +59,638 @@ def integrate_csv_files(folder_path: str, session_id: str):
         pandas.DataFrame: A DataFrame containing the integrated and sorted data from all matching CSV files.
     """
 
-    file_pattern = os.path.join(folder_path, f"data_*_{session_id}.csv")
-    matching_files = glob.glob(file_pattern)
+    paths = get_session_log_paths(folder_path, session_id)
+    matching_files = [path for path in paths if not path.endswith((SEGMENT_EXTENSION, DATABASE_EXTENSION))]
+    segment_files = [path for path in paths if path.endswith(SEGMENT_EXTENSION)]
     all_data = []
 
     for file in matching_files:
-        df = pd.read_csv(file)
+        with open_session_file(file) as log_file:
+            df = pd.read_csv(log_file)
         if df.shape[0] > 0:
             all_data.append(df)
 
+    for path in paths:
+        if path.endswith(DATABASE_EXTENSION):
+            all_data += [df for df in read_reference_rows(path) if df.shape[0] > 0]
+
+    # the binary segments are loaded together, without parsing
+    if segment_files:
+        all_data.append(load_segments(segment_files))
+
     integrated_df = pd.concat(all_data, ignore_index=True)
-    integrated_df.sort_values(by='timestamp', inplace=True)
+    integrated_df.sort_values(by='timestamp', inplace=True, ignore_index=True)  # rows numbered in order
 
     return integrated_df
 
 
+def export_segments_csv(segment_paths: list[str], csv_path: str):
+    """ Save the binary log segments as a CSV log file, written as the logger writes its CSV files """
+    pd.DataFrame(columns=COLUMNS).to_csv(csv_path, index=False)  # header
+    sink = CsvLogSink(path=csv_path, columns=COLUMNS, flush_rows=1, flush_interval=float('inf'))
+    for path in segment_paths:
+        segment = read_segment(path)
+        numeric = np.column_stack([segment[field] for field in NUMERIC_FIELDS])
+        sink.write_table(numeric, segment['local_timestamp'],
+                         {column: segment[column] for column in sink.get_attribute_columns()})
+    sink.close()
+    print(f"{sink.rows_written} rows exported to {csv_path}")
+
+
 def get_saved_notes(folder_path: str, session_id: str) -> pd.DataFrame:
     file_name = f'notes_{session_id}_all.csv'
     path = os.path.join(folder_path, file_name)
     print(path)
-    return pd.read_csv(path, index_col=False)
+    with open_session_file(path) as notes_file:
+        return pd.read_csv(notes_file, index_col=False)
+
+
+def read_integrated_csv(folder_path: str, session_id: str, **kwargs) -> pd.DataFrame:
+    """ The integrated data of the session, also once it is compacted, kwargs are passed to pd.read_csv """
+    with open_session_file(os.path.join(folder_path, f"integrated_data_{session_id}.csv")) as integrated_file:
+        return pd.read_csv(integrated_file, **kwargs)
+
+
+class SegmentScan:
+    """ What the merge has to know about a log segment before reading it:
+    its first timestamp, whether its rows are in the timestamp order and its alarm notification rows,
+    which set the rows of the other segments as well
+    """
+    path: str
+    position: int  # order of the segment in the session, the rows of equal timestamps follow it
+    start_row: int  # rows of the segment integrated before, they are skipped
+    num_rows: int
+    first_timestamp: Union[None, int, str]
+    last_timestamp: Union[None, int, str]
+    max_timestamp: Union[None, int, str]
+    is_sorted: bool
+    alarms: pd.DataFrame  # SCAN_COLUMNS with the position and the row in the segment
+    users: dict[str, list]  # as counted by session_catalog.add_user_row
+
+    def __init__(self, path: str, position: int, start_row=0):
+        self.path = path
+        self.position = position
+        self.start_row = start_row
+        self.num_rows = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.max_timestamp = None
+        self.is_sorted = True
+        self.alarms = pd.DataFrame(columns=SCAN_COLUMNS + ['position', 'row'])
+        self.users = {}
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        """ Scan the next rows of the segment, only SCAN_COLUMNS are needed """
+        if len(chunk) == 0:
+            return None
+        timestamps = chunk['timestamp']
+        if self.num_rows == 0:
+            self.first_timestamp = timestamps.min()
+            self.max_timestamp = timestamps.max()
+        else:
+            self.is_sorted = self.is_sorted and timestamps.iloc[0] >= self.last_timestamp
+            self.first_timestamp = min(self.first_timestamp, timestamps.min())
+            self.max_timestamp = max(self.max_timestamp, timestamps.max())
+        self.is_sorted = self.is_sorted and timestamps.is_monotonic_increasing
+        self.last_timestamp = timestamps.iloc[-1]
+        is_alarm = (chunk['alarm_notification'] == "yes").to_numpy()
+        if is_alarm.any():
+            alarms = chunk.loc[is_alarm, SCAN_COLUMNS].assign(position=self.position,
+                                                              row=self.num_rows + np.flatnonzero(is_alarm))
+            self.alarms = pd.concat([self.alarms, alarms], ignore_index=True) if len(self.alarms) else alarms
+        self.users = merge_user_stats(self.users, get_user_stats(chunk['user_id'], chunk['local_time'], is_alarm))
+        self.num_rows += len(chunk)
+
+
+def get_complete_size(file: IO, block_size=4096) -> int:
+    """ Bytes of the binary file up to its last newline, the file is left at its start """
+    position = file.seek(0, io.SEEK_END)
+    while position > 0:
+        start = max(0, position - block_size)
+        file.seek(start)
+        newline = file.read(position - start).rfind(b'\n')
+        if newline >= 0:
+            file.seek(0)
+            return start + newline + 1
+        position = start
+    file.seek(0)
+    return 0
+
+
+class CompleteLinesReader(io.RawIOBase):
+    """ The lines of a CSV log file finished when it was opened,
+    the line the logger is appending meanwhile is left to the next save
+    """
+    def __init__(self, file: IO):
+        super().__init__()
+        self.file = file
+        self.bytes_left = get_complete_size(file)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.file.read(min(len(buffer), self.bytes_left))
+        buffer[:len(data)] = data
+        self.bytes_left -= len(data)
+        return len(data)
+
+
+def scan_segment(path: str, position: int, chunk_rows: int, start_row=0) -> SegmentScan:
+    """ Scan the rows of the segment after start_row, the rows appended meanwhile are left to the next save
+    a CSV line without its newline yet is not scanned, so the stream and the checkpoint do not count it either
+    """
+    scan = SegmentScan(path, position, start_row)
+    if path.endswith(SEGMENT_EXTENSION):
+        segment = {column: values[start_row:] for column, values in read_segment(path).items()}
+        local_times = format_local_times(segment['local_timestamp'])
+        scan.add(pd.DataFrame({column: local_times if column == 'local_time' else segment[column]
+                               for column in SCAN_COLUMNS}))
+        return scan
+    if path.endswith(DATABASE_EXTENSION):
+        for chunk in read_reference_rows(path, start_row, chunk_rows=chunk_rows, columns=SCAN_COLUMNS):
+            scan.add(chunk)
+        return scan
+    skiprows = range(1, start_row + 1)
+    with open_session_file(path) as log_file, io.BufferedReader(CompleteLinesReader(log_file)) as lines, \
+            pd.read_csv(lines, usecols=SCAN_COLUMNS, chunksize=chunk_rows, skiprows=skiprows) as reader:
+        for chunk in reader:
+            scan.add(chunk)
+    return scan
+
+
+class SegmentStream:
+    """ Rows of a log segment in the timestamp order, the next chunk is read in the background
+    The CSV files and the database segments in order are read chunk by chunk,
+    the binary segments and the rows out of order, e.g. after the device has restarted, are loaded whole,
+    which the size of the segments bounds.
+    """
+    scan: SegmentScan
+    rows: Union[None, pd.DataFrame]  # rows read but not merged yet
+    is_exhausted: bool
+
+    def __init__(self, scan: SegmentScan, chunk_rows: int, executor: ThreadPoolExecutor):
+        self.scan = scan
+        self.chunk_rows = chunk_rows
+        self.executor = executor
+        self.chunks = None
+        self.next_chunk: Union[None, Future] = None
+        self.rows = None
+        self.is_exhausted = False
+
+    def start(self) -> None:
+        """ Start reading the first chunk """
+        if self.chunks is None:
+            self.chunks = self.iter_chunks()
+            self.prefetch()
+
+    def prefetch(self) -> None:
+        self.next_chunk = self.executor.submit(next, self.chunks, None)
+
+    def load_chunk(self) -> bool:
+        """ Append the next chunk to the rows, False if the segment has no more rows """
+        self.start()
+        chunk = self.next_chunk.result()
+        if chunk is None:
+            self.is_exhausted = True
+            return False
+        self.prefetch()
+        self.rows = chunk if self.rows is None or len(self.rows) == 0 \
+            else pd.concat([self.rows, chunk], ignore_index=True)
+        return True
+
+    def get_last_timestamp(self):
+        return self.rows['timestamp'].iloc[-1]
+
+    def take(self, watermark=None) -> pd.DataFrame:
+        """ Remove the rows before the watermark, all of them if it is None """
+        if watermark is None:
+            rows, self.rows = self.rows, self.rows.iloc[:0]
+            return rows
+        size = int(np.searchsorted(self.rows['timestamp'].to_numpy(), watermark, side='left'))
+        rows = self.rows.iloc[:size]
+        self.rows = self.rows.iloc[size:].reset_index(drop=True)
+        return rows
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        path = self.scan.path
+        # exactly the rows scanned, the logger may be appending to the segment
+        skiprows = range(1, self.scan.start_row + 1)
+        if path.endswith(SEGMENT_EXTENSION):
+            rows = load_segments([path]).iloc[self.scan.start_row:self.scan.start_row + self.scan.num_rows]
+        elif path.endswith(DATABASE_EXTENSION):
+            chunks = read_reference_rows(path, self.scan.start_row, self.scan.num_rows,
+                                         chunk_rows=self.chunk_rows if self.scan.is_sorted else None)
+            if self.scan.is_sorted:
+                yield from (chunk for chunk in chunks if len(chunk))
+                return None
+            rows = pd.concat(list(chunks), ignore_index=True)
+        elif self.scan.is_sorted:
+            with open_session_file(path) as log_file, \
+                    pd.read_csv(log_file, chunksize=self.chunk_rows, skiprows=skiprows,
+                                nrows=self.scan.num_rows) as reader:
+                for chunk in reader:
+                    if len(chunk):
+                        yield chunk.reset_index(drop=True)
+            return None
+        else:
+            with open_session_file(path) as log_file:
+                rows = pd.read_csv(log_file, skiprows=skiprows, nrows=self.scan.num_rows)
+        if not self.scan.is_sorted:
+            rows = rows.sort_values(by='timestamp', kind='stable', ignore_index=True)
+        for start in range(0, len(rows), self.chunk_rows):
+            yield rows.iloc[start:start + self.chunk_rows].reset_index(drop=True)
+
+
+def merge_segments(scans: list[SegmentScan], chunk_rows: int, executor: ThreadPoolExecutor) -> Iterator[pd.DataFrame]:
+    """ K-way merge of the segments by timestamp, the rows of equal timestamps stay together
+    and follow the order of the segments. A segment is opened once the merge reaches its first timestamp,
+    so the consecutive segments of a session are read one after another.
+    """
+    scans = sorted([scan for scan in scans if scan.num_rows], key=lambda scan: (scan.first_timestamp, scan.position))
+    pending = [SegmentStream(scan, chunk_rows, executor) for scan in scans]
+    active: list[SegmentStream] = []
+    if pending:
+        pending[0].start()
+    while pending or active:
+        # no segment has rows before the watermark any more, except the rows read already
+        limits = [stream.get_last_timestamp() for stream in active if not stream.is_exhausted]
+        if pending:
+            limits.append(pending[0].scan.first_timestamp)
+        watermark = min(limits) if limits else None
+        parts = [stream.take(watermark) for stream in active]
+        parts = [part for part in parts if len(part)]
+        active = [stream for stream in active if not stream.is_exhausted or len(stream.rows)]
+        if parts:
+            rows = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+            if len(parts) > 1:
+                rows = rows.sort_values(by='timestamp', kind='stable', ignore_index=True)
+            yield rows
+            continue
+        if pending and pending[0].scan.first_timestamp == watermark:
+            stream = pending.pop(0)
+            stream.load_chunk()
+            active = sorted(active + [stream], key=lambda active_stream: active_stream.scan.position)
+            if pending:
+                pending[0].start()
+            continue
+        for stream in active:
+            if not stream.is_exhausted and stream.get_last_timestamp() == watermark:
+                stream.load_chunk()  # the rows of the watermark may continue in its next chunk
+                break
 
 
-def save_integrated_csv(folder_path: str, session_id: str):
+class IntegratedCsvWriter:
+    """ Post-process the merged rows part by part as Logger.post_process_df processes the whole session
+    and append them to the integrated file, carrying between the parts:
+        the last 2 rows, which take the notes of the next rows
+        the last model threshold, filled forward
+        the rows of the last timestamp, which the duplicates in the next part are dropped against
+    The alarm windows are found beforehand, as an alarm sets the rows before it.
+    A new file replaces the integrated one at the close, a checkpoint resumes the file written by the last save.
+    """
+    path: str
+    rows_written: int
+    last_local_second: float  # latest local time of the rows written, in seconds as by Logger.get_local_seconds
+
+    def __init__(self, path: str, notes: Union[None, pd.DataFrame], alarm_windows: pd.DataFrame,
+                 checkpoint: Union[None, 'IntegrationCheckpoint'] = None):
+        self.path = path
+        self.notes = None if notes is None or notes.shape[0] == 0 else Logger.rename_notes_columns(notes)
+        self.alarm_windows = alarm_windows
+        self.is_resumed = checkpoint is not None
+        if checkpoint is None:
+            self.notes_tail = None
+            self.last_threshold = np.nan
+            self.last_rows = None
+            self.rows_written = 0
+            self.last_local_second = -np.inf
+            self.file = open(path + ".tmp", mode='w', newline='', encoding='utf-8')
+        else:
+            # the rows of the tail are written again with the notes of the new rows
+            self.notes_tail = checkpoint.notes_tail
+            self.last_threshold = checkpoint.last_threshold
+            self.last_rows = checkpoint.last_rows
+            self.rows_written = checkpoint.rows_written - checkpoint.tail_rows
+            self.last_local_second = checkpoint.last_local_second
+            os.truncate(path, checkpoint.tail_offset)
+            self.file = open(path, mode='a', newline='', encoding='utf-8')
+        self.tail_offset = 0
+        self.tail_rows = 0
+
+    def add(self, rows: pd.DataFrame) -> None:
+        if self.notes is None:
+            self.write(rows)
+            return None
+        rows = Logger.merge_notes(rows, self.notes)
+        if self.notes_tail is not None:
+            rows = pd.concat([self.notes_tail, rows], ignore_index=True)
+        rows = Logger.process_notes_gaps(rows)
+        self.notes_tail = rows.iloc[-2:].reset_index(drop=True)
+        self.write(rows.iloc[:-2].reset_index(drop=True))
+
+    def close(self) -> None:
+        """ Write the rest and replace the integrated file at once,
+        the state before the tail is kept for the checkpoint
+        """
+        self.file.flush()
+        self.tail_offset = os.fstat(self.file.fileno()).st_size
+        self.tail_state = (self.last_threshold, self.last_rows)
+        rows_written = self.rows_written
+        if self.notes_tail is not None:
+            self.write(self.notes_tail)
+        self.tail_rows = self.rows_written - rows_written
+        self.file.close()
+        if not self.is_resumed:
+            os.replace(self.path + ".tmp", self.path)
+
+    def write(self, rows: pd.DataFrame) -> None:
+        if len(rows) == 0:
+            return None
+        rows = Logger.apply_alarm_windows(rows, self.alarm_windows)
+        thresholds = rows['model_threshold'].ffill()
+        rows['model_threshold'] = thresholds.fillna(self.last_threshold)
+        if thresholds.notna().any():
+            self.last_threshold = thresholds[thresholds.notna()].iloc[-1]
+        rows = self.drop_duplicates(rows)
+        seconds, _ = Logger.get_local_seconds(rows['local_time'])
+        self.last_local_second = np.nanmax(seconds, initial=self.last_local_second)
+        for column in rows.columns:
+            if rows[column].dtype.kind == 'f':
+                rows[column] = CsvLogSink.format_numeric(rows[column].to_numpy())
+        rows.to_csv(self.file, header=self.rows_written == 0, index=False)
+        self.rows_written += len(rows)
+
+    def drop_duplicates(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """ The same rows have the same timestamp, so they are in the same part or at its border """
+        if self.last_rows is None:
+            rows = rows.drop_duplicates()
+        else:
+            rows = pd.concat([self.last_rows, rows], ignore_index=True).drop_duplicates()
+            rows = rows.iloc[len(self.last_rows):].reset_index(drop=True)
+        if len(rows) == 0:
+            return rows
+        last_timestamp = rows['timestamp'].iloc[-1]
+        last_rows = rows[rows['timestamp'] == last_timestamp]
+        if self.last_rows is not None and self.last_rows['timestamp'].iloc[-1] == last_timestamp:
+            last_rows = pd.concat([self.last_rows, last_rows], ignore_index=True)
+        self.last_rows = last_rows
+        return rows
+
+
+CHECKPOINT_VERSION = 2
+ALARM_WINDOW_COLUMNS = ['start', 'end', 'notification_interval', 'feedback']  # as by Logger.get_alarm_windows
+
+
+def to_json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def to_csv_text(df: Union[None, pd.DataFrame]) -> Union[None, str]:
+    return None if df is None else df.to_csv(index=False)
+
+
+def from_csv_text(text: Union[None, str]) -> Union[None, pd.DataFrame]:
+    return None if text is None else pd.read_csv(io.StringIO(text))
+
+
+def get_notes_hash(notes: Union[None, pd.DataFrame]) -> str:
+    if notes is None or notes.shape[0] == 0:
+        return ""
+    return str(pd.util.hash_pandas_object(notes, index=False).sum())
+
+
+class IntegrationCheckpoint:
+    """ State of the integrated file after a save, kept next to it as <integrated file>_checkpoint.json,
+    so the next save integrates only the rows logged since then:
+        segments are the rows integrated of each log file, segment_users their users for the session catalog
+        last_timestamp and last_local_second are the latest rows integrated
+        the last 2 rows after tail_offset are written again, they take the notes of the next rows
+        notes_tail, last_rows, last_threshold and alarm_windows are the state carried by IntegratedCsvWriter
+        notes_rows, notes_columns and notes_hash are the notes merged so far
+    The session is integrated again if the file or the notes merged have changed,
+    or the new rows reach back into the rows integrated, see get_conflict.
+    """
+    path: str
+    segments: dict[str, int]
+    segment_users: dict[str, dict[str, list]]
+    last_timestamp: Union[None, int, str]
+    last_local_second: float
+    file_size: int
+    tail_offset: int
+    tail_rows: int
+    rows_written: int
+    last_threshold: float
+    alarm_windows: pd.DataFrame
+    notes_tail: Union[None, pd.DataFrame]
+    last_rows: Union[None, pd.DataFrame]
+    notes_rows: int
+    notes_columns: list[str]
+    notes_hash: str
+
+    def __init__(self, path: str, **state):
+        self.path = path
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    @staticmethod
+    def get_checkpoint_path(output_path: str) -> str:
+        return os.path.splitext(output_path)[0] + "_checkpoint.json"
+
+    @classmethod
+    def load(cls, output_path: str) -> Union[None, 'IntegrationCheckpoint']:
+        """ None if the session has not been integrated yet """
+        path = cls.get_checkpoint_path(output_path)
+        if not os.path.exists(path) or not os.path.exists(output_path):
+            return None
+        with open(path, encoding='utf-8') as checkpoint_file:
+            data = json.load(checkpoint_file)
+        if data.pop('version', 0) != CHECKPOINT_VERSION:
+            return None
+        data['alarm_windows'] = pd.DataFrame(data['alarm_windows'], columns=ALARM_WINDOW_COLUMNS, dtype=float)
+        data['notes_tail'] = from_csv_text(data['notes_tail'])
+        data['last_rows'] = from_csv_text(data['last_rows'])
+        return cls(path, **data)
+
+    def save(self) -> None:
+        """ Replace the checkpoint at once """
+        data = {key: to_json_value(value) for key, value in vars(self).items() if key != 'path'}
+        data['version'] = CHECKPOINT_VERSION
+        data['alarm_windows'] = self.alarm_windows.to_dict('list')
+        data['notes_tail'] = to_csv_text(self.notes_tail)
+        data['last_rows'] = to_csv_text(self.last_rows)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as checkpoint_file:
+            json.dump(data, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def remove(self) -> None:
+        """ The integrated file is about to change, a save interrupted meanwhile integrates the session again """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get_conflict(self, output_path: str, scans: list[SegmentScan], new_windows: pd.DataFrame,
+                     notes: Union[None, pd.DataFrame]) -> Union[None, str]:
+        """ Why the new rows cannot be appended, None if they can """
+        if os.path.getsize(output_path) != self.file_size:
+            return "the integrated file has changed"
+        files = {os.path.basename(scan.path) for scan in scans}
+        if any(file not in files for file in self.segments):
+            return "a log file has been removed"
+        if any(scan.num_rows and scan.first_timestamp < self.last_timestamp for scan in scans):
+            return "new rows precede the integrated ones"
+        if (new_windows['start'] <= self.last_local_second).any():
+            return "a new alarm notification reaches back into the integrated rows"
+        num_notes = 0 if notes is None else notes.shape[0]
+        if num_notes == 0 and self.notes_rows == 0:
+            return None
+        if self.notes_rows == 0:
+            return "the first notes have been added"
+        if num_notes < self.notes_rows or list(notes.columns) != self.notes_columns \
+                or get_notes_hash(notes.iloc[:self.notes_rows]) != self.notes_hash:
+            return "the notes have changed"
+        if num_notes > self.notes_rows:
+            seconds, _ = Logger.get_local_seconds(notes['Time'].iloc[self.notes_rows:])
+            if not (seconds > self.last_local_second).all():  # NaN if not parsed
+                return "a new note refers to the integrated rows"
+        return None
+
+
+def scan_segments(paths: list[str], start_rows: dict[str, int], chunk_rows: int,
+                  executor: ThreadPoolExecutor) -> list[SegmentScan]:
+    return list(executor.map(lambda position: scan_segment(paths[position], position, chunk_rows,
+                                                           start_rows.get(os.path.basename(paths[position]), 0)),
+                             range(len(paths))))
+
+
+def get_alarms(scans: list[SegmentScan]) -> pd.DataFrame:
+    """ Alarm notification rows of the segments in the order of the merge """
+    alarms = [scan.alarms for scan in scans if len(scan.alarms)]
+    alarms = pd.concat(alarms, ignore_index=True) if alarms else SegmentScan("", 0).alarms
+    return alarms.sort_values(by=['timestamp', 'position', 'row'], kind='stable', ignore_index=True)
+
+
+def stream_integrated_csv(paths: list[str], output_path: str, notes: Union[None, pd.DataFrame],
+                          checkpoint: Union[None, IntegrationCheckpoint] = None) -> IntegrationCheckpoint:
+    """ Integrate and post-process the log files into output_path as save_integrated_csv did in memory,
+    only the rows after the checkpoint are appended if it is given.
+    Return the checkpoint of the integrated file
+    """
+    chunk_rows = uc.Measurements.integration_chunk_rows.value
+    with ThreadPoolExecutor(max_workers=uc.Measurements.integration_workers.value) as executor:
+        previous_windows = None if checkpoint is None else checkpoint.alarm_windows
+        scans = scan_segments(paths, {} if checkpoint is None else checkpoint.segments, chunk_rows, executor)
+        alarm_windows = Logger.get_alarm_windows(get_alarms(scans), previous_windows)
+        if checkpoint is not None:
+            conflict = checkpoint.get_conflict(output_path, scans, alarm_windows.iloc[len(previous_windows):], notes)
+            if conflict is not None:
+                print(f"Integrating the whole session again, {conflict}")
+                checkpoint = None
+                scans = scan_segments(paths, {}, chunk_rows, executor)
+                alarm_windows = Logger.get_alarm_windows(get_alarms(scans))
+        if checkpoint is None and not any(scan.num_rows for scan in scans):
+            raise ValueError(f"No rows to integrate in {len(paths)} log files")
+        if notes is None or notes.shape[0] == 0:
+            print("Warning! No Data Notes found!", file=sys.stderr)
+        if checkpoint is not None:
+            checkpoint.remove()
+        writer = IntegratedCsvWriter(output_path, notes, alarm_windows, checkpoint)
+        parts, num_rows = [], 0
+        for rows in merge_segments(scans, chunk_rows, executor):
+            parts.append(rows)
+            num_rows += len(rows)
+            if num_rows >= chunk_rows:
+                writer.add(pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0])
+                parts, num_rows = [], 0
+        if parts:
+            writer.add(pd.concat(parts, ignore_index=True))
+        writer.close()
+    segments = {} if checkpoint is None else dict(checkpoint.segments)
+    segment_users = {} if checkpoint is None else dict(checkpoint.segment_users)
+    for scan in scans:
+        file = os.path.basename(scan.path)
+        segments[file] = scan.start_row + scan.num_rows
+        segment_users[file] = merge_user_stats(segment_users.get(file, {}), scan.users)
+    timestamps = [scan.max_timestamp for scan in scans if scan.num_rows]
+    if checkpoint is not None:
+        timestamps.append(checkpoint.last_timestamp)
+    last_threshold, last_rows = writer.tail_state
+    return IntegrationCheckpoint(IntegrationCheckpoint.get_checkpoint_path(output_path),
+                                 segments=segments, segment_users=segment_users, last_timestamp=max(timestamps),
+                                 last_local_second=float(writer.last_local_second),
+                                 file_size=os.path.getsize(output_path), tail_offset=writer.tail_offset,
+                                 tail_rows=writer.tail_rows, rows_written=writer.rows_written,
+                                 last_threshold=float(last_threshold), alarm_windows=alarm_windows,
+                                 notes_tail=writer.notes_tail if writer.notes is not None else None,
+                                 last_rows=last_rows, notes_rows=0 if notes is None else notes.shape[0],
+                                 notes_columns=[] if notes is None else list(notes.columns),
+                                 notes_hash=get_notes_hash(notes))
+
+
+def save_integrated_csv(folder_path: str, session_id: str, catalog: Union[None, SessionCatalog] = None):
     """
     Integrates CSV files for a session and saves the result to a new CSV file.
+    The files are merged and post-processed as a stream, see stream_integrated_csv,
+    and only the rows logged since the last save are appended to the integrated file.
 
     Args:
         folder_path (str): Folder of log files
         session_id (str): The session ID to filter the CSV files. The folder path is constructed using this ID.
+        catalog (SessionCatalog): Catalog updated with the totals of the session, the one of the station if None
     """
-    integrated_data = integrate_csv_files(folder_path, session_id)
     output_filename = os.path.join(folder_path, f"integrated_data_{session_id}.csv")
+    if not os.path.exists(output_filename) and session_file_exists(output_filename):
+        print(f"The session is compacted, its integrated data is read from the archive: {output_filename}")
+        return None
     notes = get_saved_notes(folder_path, session_id)
-    integrated_data = Logger.post_process_df(df=integrated_data, notes=notes)
-    integrated_data = integrated_data.drop_duplicates()
-    integrated_data.to_csv(output_filename, index=False)
-    print(f"Integrated data saved to: {output_filename}")
+    checkpoint = IntegrationCheckpoint.load(output_filename)
+    checkpoint = stream_integrated_csv(get_session_log_paths(folder_path, session_id), output_filename, notes,
+                                       checkpoint)
+    checkpoint.save()
+    print(f"Integrated data saved to: {output_filename} ({checkpoint.rows_written} rows)")
+    if catalog is None:
+        station_catalog = SessionCatalog()
+        update_catalog(station_catalog, folder_path, session_id, checkpoint.segments, checkpoint.segment_users)
+        station_catalog.close()
+    else:
+        update_catalog(catalog, folder_path, session_id, checkpoint.segments, checkpoint.segment_users)
+
+
+def update_catalog(catalog: SessionCatalog, folder_path: str, session_id: str, segments: dict[str, int],
+                   segment_users: dict[str, dict[str, list]]) -> None:
+    """ Replace the totals of the session in the catalog by those of its log files """
+    manifest = SessionManifest.load(folder_path, session_id)
+    is_closed = {} if manifest is None else {segment.file: segment.is_closed for segment in manifest.segments}
+    segment_infos = []
+    for file, rows in segments.items():
+        segment = SegmentInfo(file)
+        segment.rows = rows
+        segment.users = segment_users.get(file, {})
+        segment.is_closed = is_closed.get(file, True)
+        segment_infos.append(segment)
+    is_test = os.path.basename(os.path.normpath(folder_path)).endswith("_test")
+    catalog.update_session(session_id, folder_path, is_test, segment_infos)
+
+
+def index_logs_folder(logs_folder_path: str, catalog: SessionCatalog, reindex=False) -> None:
+    """ Add the session folders missing in the catalog, e.g. logged before it existed, all of them if reindex """
+    chunk_rows = uc.Measurements.integration_chunk_rows.value
+    folders = sorted(glob.glob(os.path.join(logs_folder_path, "session_*")))
+    with ThreadPoolExecutor(max_workers=uc.Measurements.integration_workers.value) as executor:
+        for folder_path in folders:
+            session_id = os.path.basename(folder_path)[len("session_"):].removesuffix("_test")
+            if not reindex and catalog.has_session(session_id):
+                continue
+            paths = get_session_log_paths(folder_path, session_id)
+            try:
+                scans = scan_segments(paths, {}, chunk_rows, executor)
+            except (ValueError, KeyError, pd.errors.ParserError) as e:
+                print(f"Session {session_id} not indexed: {e}", file=sys.stderr)
+                continue
+            update_catalog(catalog, folder_path, session_id,
+                           {os.path.basename(scan.path): scan.num_rows for scan in scans},
+                           {os.path.basename(scan.path): scan.users for scan in scans})
+            print(f"Session {session_id} indexed: {sum(scan.num_rows for scan in scans)} rows in {len(paths)} files")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+""" Binary log segments, an alternative to the CSV log files
+A segment is a compressed .npz with one typed array per column and a JSON header,
+so a session is loaded without parsing text:
+    schema: {"format": "fhp-log-segment", "version": 1, "numeric_fields": [...], "text_fields": [...]}
+    every numeric field: float32 if it keeps all the values exactly, e.g. the sensor readings, float64 otherwise
+    timestamp: int64, or unicode strings if some timestamp is not an integer
+    notes and the other text fields: dictionary encoded, int32 codes in <field>
+    and the unicode strings in <field>_values, NaN saved as ''
+    local_timestamp: float64, user_id: int32
+The numeric fields are matched by name, so segments of an older field order are still read.
+While the segment is written, every flush saves its rows as a numbered part file next to it,
+data_..._<session id>.npz.part00001, ..., which are merged into the segment once it is closed,
+so the rows of an open segment, or of one left open by a crash, are read from its parts.
+"""
+import glob
+import json
+import os
+from typing import Iterable
+import numpy as np
+import pandas as pd
+from frame_schema import NUMERIC_FIELDS, COLUMNS, format_local_time
+from session_store import TEXT_FIELDS
+from session_archive import open_session_file, list_session_files
+
+SCHEMA_VERSION = 1
+SEGMENT_FORMAT = "fhp-log-segment"
+SEGMENT_EXTENSION = ".npz"
+PART_SUFFIX = ".part"
+ATTRIBUTE_COLUMNS = ['timestamp', 'local_timestamp', 'user_id'] + TEXT_FIELDS
+
+
+def get_schema() -> dict:
+    return {"format": SEGMENT_FORMAT, "version": SCHEMA_VERSION,
+            "numeric_fields": NUMERIC_FIELDS, "text_fields": TEXT_FIELDS}
+
+
+def to_text_array(values: Iterable) -> np.ndarray:
+    """ Strings of the column, the missing values become '' as the empty cells of a CSV """
+    return np.array(['' if value is None or value != value else str(value) for value in values], dtype=str)
+
+
+def to_timestamp_array(values: Iterable) -> np.ndarray:
+    """ The device timestamps are integers, kept as strings only if some of them is not """
+    timestamps = to_text_array(values)
+    if np.char.isdigit(timestamps).all():
+        return timestamps.astype(np.int64)
+    return timestamps
+
+
+def from_text_array(values: np.ndarray) -> np.ndarray:
+    """ The empty strings become NaN as the empty cells read by pd.read_csv """
+    result = values.astype(object)
+    result[values == ''] = np.nan
+    return result
+
+
+def to_numeric_array(values: np.ndarray) -> np.ndarray:
+    narrow_values = values.astype(np.float32)
+    if np.array_equal(narrow_values, values, equal_nan=True):
+        return narrow_values
+    return values
+
+
+def encode_text(values: Iterable) -> tuple[np.ndarray, np.ndarray]:
+    """ The texts repeat for many rows, e.g. 'no' or the notes, they are saved once with the row codes """
+    texts, codes = np.unique(to_text_array(values), return_inverse=True)
+    return codes.astype(np.int32), texts
+
+
+def format_local_times(local_timestamps: np.ndarray) -> np.ndarray:
+    """ Vectorized format_local_time, every second is formatted once """
+    seconds, inverse = np.unique(local_timestamps.astype(np.int64), return_inverse=True)
+    texts = np.array([format_local_time(second) for second in seconds.tolist()], dtype=object)
+    return texts[inverse]
+
+
+def write_segment(path: str, numeric: np.ndarray, attributes: dict[str, Iterable]) -> None:
+    """ Save the rows at once, the file is replaced atomically so a reader never sees half of it
+    attributes are the ATTRIBUTE_COLUMNS
+    """
+    arrays = {
+        'schema': np.array(json.dumps(get_schema())),
+        'timestamp': to_timestamp_array(attributes['timestamp']),
+        'local_timestamp': np.asarray(attributes['local_timestamp'], dtype=np.float64),
+        'user_id': np.asarray(attributes['user_id'], dtype=np.int32),
+    }
+    numeric = np.asarray(numeric, dtype=np.float64).reshape(-1, len(NUMERIC_FIELDS))
+    for i, field in enumerate(NUMERIC_FIELDS):
+        arrays[field] = to_numeric_array(numeric[:, i])
+    for field in TEXT_FIELDS:
+        arrays[field], arrays[f"{field}_values"] = encode_text(attributes[field])
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as segment_file:
+        np.savez_compressed(segment_file, **arrays)
+    os.replace(temp_path, path)
+
+
+def write_empty_segment(path: str) -> None:
+    write_segment(path, np.empty((0, len(NUMERIC_FIELDS))), {column: [] for column in ATTRIBUTE_COLUMNS})
+
+
+def get_part_path(path: str, number: int) -> str:
+    return f"{path}{PART_SUFFIX}{number:05d}"
+
+
+def list_parts(path: str) -> list[str]:
+    """ Part files of the segment in the order they were written """
+    return list_session_files(os.path.dirname(path), glob.escape(os.path.basename(path)) + PART_SUFFIX + "*")
+
+
+def concat_segments(segments: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    columns = {}
+    for column in segments[0]:
+        values = [segment[column] for segment in segments]
+        if len({value.dtype.kind for value in values}) > 1:
+            values = [value.astype(str) for value in values]  # the integer timestamps of some parts only
+        columns[column] = np.concatenate(values)
+    return columns
+
+
+def read_segment(path: str) -> dict[str, np.ndarray]:
+    """ Columns of the segment, the numeric ones by field name
+    the closed segment replaces its empty placeholder before its parts are removed,
+    so the parts are read only while the segment itself is still empty
+    """
+    columns = read_segment_file(path)
+    if len(columns['timestamp']) == 0:
+        parts = list_parts(path)
+        if parts:
+            columns = concat_segments([read_segment_file(part) for part in parts])
+    return columns
+
+
+def read_segment_file(path: str) -> dict[str, np.ndarray]:
+    with open_session_file(path) as segment_file, np.load(segment_file, allow_pickle=False) as segment:
+        schema = json.loads(segment['schema'].item())
+        if schema.get('format') != SEGMENT_FORMAT or schema.get('version', 0) > SCHEMA_VERSION:
+            raise ValueError(f"Unsupported log segment {path}: {schema.get('format')} "
+                             f"version {schema.get('version')}")
+        columns = {field: segment[field].astype(np.float64) for field in schema['numeric_fields']}
+        for name in ['timestamp', 'local_timestamp', 'user_id']:
+            columns[name] = segment[name]
+        for field in schema['text_fields']:
+            columns[field] = from_text_array(segment[f"{field}_values"])[segment[field]]
+    for field in NUMERIC_FIELDS:
+        if field not in columns:
+            columns[field] = np.full(len(columns['timestamp']), np.nan)  # added after the segment was saved
+    return columns
+
+
+def load_segments(paths: list[str]) -> pd.DataFrame:
+    """ Rows of all the segments in the column order of the CSV logs, read as pd.read_csv would """
+    segments = [read_segment(path) for path in paths]
+    if not segments:
+        return pd.DataFrame(columns=COLUMNS)
+    data = {}
+    for column in COLUMNS:
+        if column == 'local_time':
+            data[column] = format_local_times(np.concatenate([segment['local_timestamp'] for segment in segments]))
+            continue
+        values = np.concatenate([segment[column] for segment in segments])
+        if values.dtype.kind == 'U':
+            values = from_text_array(values)
+        data[column] = values
+    return pd.DataFrame(data, columns=COLUMNS)
@@ -1,86 +1,491 @@
 import csv
 import datetime
+import sqlite3
 import sys
 import os
 import numpy as np
 import pandas as pd
 import ui_config as uc
-import copy
-from typing import Union, Callable
+import itertools
+import threading
+import time
+from typing import Iterable, Union, Callable
 import aiofiles
 from aiocsv import AsyncWriter
 from performance_tester import PerformanceTester
+from frame_schema import Frame, COLUMNS, FIELD_INDEX, NUMERIC_FIELDS, format_local_time
+from session_store import SessionStore, StoreChunk, RowView
+from session_manifest import SessionManifest
+from session_catalog import SessionCatalog
+from log_segments import (SEGMENT_EXTENSION, ATTRIBUTE_COLUMNS, write_segment, write_empty_segment, read_segment,
+                          get_part_path, list_parts)
+from log_database import DATABASE_EXTENSION, LogDatabase, read_reference, write_reference
+from frame_queue import FrameQueue, OverflowPolicy
+
+
+class CsvLogSink:
+    """ The only writer of a log file, the file stays open until the sink is closed
+    The entries are kept until the flush and serialized only then in the order of the columns,
+    so the predictions, notes and feedback added to an entry after its arrival are saved as well.
+    The rows are flushed once flush_rows are pending or the oldest one waits for flush_interval seconds.
+    """
+    path: str
+    columns: list[str]
+    flush_rows: int
+    flush_interval: float
+    rows_written: int
+
+    def __init__(self, path: str, columns: list[str], flush_rows: int, flush_interval: float):
+        self.path = path
+        self.columns = columns
+        self.column_indexes = [(column, FIELD_INDEX.get(column)) for column in columns]
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.pending = []
+        self.first_pending_time = 0.0
+        self.lock = threading.Lock()
+        self.file = open(path, mode='a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+
+    def add(self, data_entry: dict) -> None:
+        with self.lock:
+            if not self.pending:
+                self.first_pending_time = time.monotonic()
+            self.pending.append(data_entry)
+            if len(self.pending) >= self.flush_rows \
+                    or time.monotonic() - self.first_pending_time >= self.flush_interval:
+                self.write_pending()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self) -> None:
+        if self.file.closed or not self.pending:
+            return None
+        self.write_rows(self.pending)
+        self.file.flush()
+        self.pending.clear()
+
+    def write(self, entries: Iterable[dict]) -> None:
+        """ Write the entries straight away, in chunks to keep the memory flat """
+        with self.lock:
+            self.write_pending()
+            chunk_size = uc.Measurements.log_write_chunk.value
+            entries = iter(entries)
+            while chunk := list(itertools.islice(entries, chunk_size)):
+                self.write_rows(chunk)
+            self.file.flush()
+
+    def write_rows(self, entries: list[Union[Frame, RowView, dict]]) -> None:
+        if all(isinstance(data_entry, (Frame, RowView)) for data_entry in entries):
+            rows = self.get_frame_rows(entries)
+        else:
+            rows = [self.get_row(data_entry) for data_entry in entries]
+        self.writer.writerows(rows)
+        self.rows_written += len(entries)
+
+    def write_store(self, store: SessionStore) -> None:
+        """ Write all the rows of the store straight from its columns """
+        self.write_chunks(list(store.iter_chunks()))
+
+    def write_chunks(self, chunks: list[StoreChunk]) -> None:
+        with self.lock:
+            self.write_pending()
+            for chunk in chunks:
+                size = chunk.size  # the rows appended meanwhile are not written
+                self.write_table(chunk.numeric[:size], chunk.get_column('local_timestamp', size),
+                                 {column: chunk.get_column(column, size) for column in self.get_attribute_columns()})
+            self.file.flush()
+
+    def write_table(self, numeric: np.ndarray, local_timestamps: np.ndarray, attributes: dict[str, Iterable]) -> None:
+        """ Write the rows given by columns, ordered as NUMERIC_FIELDS in numeric """
+        attributes = dict(attributes, local_time=[format_local_time(local_timestamp)
+                                                  for local_timestamp in local_timestamps.tolist()])
+        self.writer.writerows(self.get_table_rows(numeric, attributes))
+        self.rows_written += numeric.shape[0]
+
+    def get_attribute_columns(self) -> list[str]:
+        """ The columns stored outside of the numeric fields, except the formatted local time """
+        return [column for column, index in self.column_indexes if index is None and column != 'local_time']
+
+    def copy_rows(self, path: str, num_rows: int) -> None:
+        """ Append the first num_rows of another log file as they are """
+        with self.lock, open(path, newline='', encoding='utf-8') as log_file:
+            self.write_pending()
+            reader = csv.reader(log_file)
+            next(reader, None)  # header
+            chunk_size = uc.Measurements.log_write_chunk.value
+            while num_rows > 0 and (rows := list(itertools.islice(reader, min(chunk_size, num_rows)))):
+                self.writer.writerows(rows)
+                self.rows_written += len(rows)
+                num_rows -= len(rows)
+            self.file.flush()
+
+    def get_frame_rows(self, frames: list[Union[Frame, RowView]]) -> list[list]:
+        numeric = np.stack([frame.values for frame in frames])
+        attributes = {column: [getattr(frame, column) for frame in frames]
+                      for column, index in self.column_indexes if index is None}
+        return self.get_table_rows(numeric, attributes)
+
+    def get_table_rows(self, numeric: np.ndarray, attributes: dict[str, Iterable]) -> list[list]:
+        """ Serialize the numeric fields of all the rows at once, column by column """
+        cells = self.format_numeric(numeric)
+        table = np.empty((numeric.shape[0], len(self.columns)), dtype=object)
+        for position, (column, index) in enumerate(self.column_indexes):
+            if index is None:
+                table[:, position] = [self.format_value(value) for value in attributes[column]]
+            else:
+                table[:, position] = cells[:, index]
+        return table.tolist()
 
+    @staticmethod
+    def format_numeric(numeric: np.ndarray) -> np.ndarray:
+        """ Cells of the numeric values, the integers without the decimal point and NaN as empty cells """
+        cells = numeric.astype(object)
+        is_integer = np.mod(numeric, 1) == 0  # False for NaN
+        cells[is_integer] = numeric[is_integer].astype(np.int64)
+        cells[np.isnan(numeric)] = ''
+        return cells
 
-class Buffer:
-    head: int
-    size: int
-    values: list[Union[None, dict]]
-    num_entries: int
-
-    def __init__(self):
-        self.size = uc.Measurements.graph_x_limit.value  # num of rows per log
-        self.values = [None] * self.size
-        self.head = 0
-        self.num_entries = 0
+    def get_row(self, data_entry: dict) -> list:
+        return [self.format_value(data_entry.get(column, np.nan)) for column in self.columns]
 
-    def reset(self):
-        self.values = [None] * self.size
+    @staticmethod
+    def format_value(value):
+        """ NaN values are saved as empty cells as pandas does, the integer readings without the decimal point """
+        if isinstance(value, float):
+            if value != value:
+                return ''
+            if value.is_integer():
+                return int(value)
+        return value
+
+    def close(self) -> None:
+        with self.lock:
+            self.write_pending()
+            self.file.close()
+
+
+class SegmentLogSink:
+    """ Writer of a binary log segment (see log_segments.py) with the interface of CsvLogSink
+    Every flush saves the pending rows as the next part file of the segment, as the CSV sink appends them,
+    so a crash loses only the rows not flushed yet. The close merges the parts into the segment file.
+    """
+    path: str
+    flush_rows: int
+    flush_interval: float
+    rows_written: int
+    num_parts: int
+
+    def __init__(self, path: str, flush_rows: int, flush_interval: float):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.pending = []
+        self.first_pending_time = 0.0
+        self.lock = threading.Lock()
+        self.is_closed = False
+        self.num_parts = 0
+
+    def add(self, data_entry: dict) -> None:
+        with self.lock:
+            if not self.pending:
+                self.first_pending_time = time.monotonic()
+            self.pending.append(data_entry)
+            if len(self.pending) >= self.flush_rows \
+                    or time.monotonic() - self.first_pending_time >= self.flush_interval:
+                self.write_pending()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self) -> None:
+        if self.is_closed or not self.pending:
+            return None
+        numeric = []
+        attributes = {column: [] for column in ATTRIBUTE_COLUMNS}
+        for data_entry in self.pending:
+            if isinstance(data_entry, (Frame, RowView)):
+                numeric.append(data_entry.values)
+            else:
+                numeric.append([data_entry.get(field, np.nan) for field in NUMERIC_FIELDS])
+            for column, values in attributes.items():
+                values.append(data_entry[column])
+        write_segment(get_part_path(self.path, self.num_parts),
+                      np.array(numeric).reshape(-1, len(NUMERIC_FIELDS)), attributes)
+        self.num_parts += 1
+        self.rows_written += len(self.pending)
+        self.pending.clear()
+
+    def close(self) -> None:
+        """ Replace the empty segment by all its parts and remove them """
+        with self.lock:
+            self.write_pending()
+            if self.is_closed:
+                return None
+            self.is_closed = True
+            parts = list_parts(self.path)
+            if not parts:
+                return None
+            segment = read_segment(self.path)
+            write_segment(self.path, np.column_stack([segment[field] for field in NUMERIC_FIELDS]),
+                          {column: segment[column] for column in ATTRIBUTE_COLUMNS})
+            for part in parts:
+                os.remove(part)
+
+
+class DatabaseLogSink:
+    """ Writer of the rows of a log segment into the frames database (see log_database.py)
+    with the interface of CsvLogSink. The pending rows are inserted in one transaction at the flush,
+    together with the updates of the rows inserted before, e.g. the feedback given to an alarm minutes later.
+    """
+    path: str
+    flush_rows: int
+    flush_interval: float
+    rows_written: int
+
+    def __init__(self, path: str, database: LogDatabase, flush_rows: int, flush_interval: float):
+        reference = read_reference(path)
+        self.path = path
+        self.database = database
+        self.session_id = reference['session_id']
+        self.segment = reference['segment']
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.pending = []
+        self.pending_updates = []
+        self.first_pending_time = 0.0
+        self.lock = threading.Lock()
+        self.is_closed = False
+
+    def add(self, data_entry: dict) -> None:
+        with self.lock:
+            if not self.pending:
+                self.first_pending_time = time.monotonic()
+            self.pending.append(data_entry)
+            if len(self.pending) >= self.flush_rows \
+                    or time.monotonic() - self.first_pending_time >= self.flush_interval:
+                self.write_pending()
+
+    def update(self, timestamp: str, values: dict) -> None:
+        """ Update the row of the session at the next flush, the pending rows are saved with the update anyway """
+        with self.lock:
+            self.pending_updates.append((timestamp, values))
+
+    def flush(self) -> None:
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self) -> None:
+        if self.is_closed or not (self.pending or self.pending_updates):
+            return None
+        numeric = []
+        attributes = {column: [] for column in ATTRIBUTE_COLUMNS}
+        for data_entry in self.pending:
+            if isinstance(data_entry, (Frame, RowView)):
+                numeric.append(data_entry.values)
+            else:
+                numeric.append([data_entry.get(field, np.nan) for field in NUMERIC_FIELDS])
+            for column, values in attributes.items():
+                values.append(data_entry[column])
+        self.database.write_rows(self.session_id, self.segment, self.rows_written,
+                                 np.array(numeric).reshape(-1, len(NUMERIC_FIELDS)), attributes, self.pending_updates)
+        self.rows_written += len(self.pending)
+        self.pending.clear()
+        self.pending_updates = []
+
+    def close(self) -> None:
+        with self.lock:
+            self.write_pending()
+            self.is_closed = True
+
+
+class LogUpdate:
+    """ New values of a logged row, queued for the log writer after the row itself """
+    __slots__ = ('timestamp', 'values')
+
+    def __init__(self, timestamp: str, values: dict):
+        self.timestamp = timestamp
+        self.values = values
+
+
+class ConnectionGap:
+    """ Interval without the data from the device, queued for the log writer """
+    __slots__ = ('disconnected_at', 'reconnected_at', 'last_timestamp')
+
+    def __init__(self, disconnected_at: float, reconnected_at: float, last_timestamp: str):
+        self.disconnected_at = disconnected_at
+        self.reconnected_at = reconnected_at
+        self.last_timestamp = last_timestamp
+
+
+class LogWriter:
+    """ Single thread doing all the file I/O of the logger
+    The reader thread only queues the frames, the writer adds them to the sink in batches,
+    rotates the log files and spills the old rows, so a slow disk never stalls the ingestion.
+    An idle writer flushes the pending rows after flush_interval seconds.
+    A failing write, e.g. a full disk, is reported and the writer goes on with the next items,
+    so the queue keeps draining and the reader never waits for a stopped writer.
+    """
+    rows_written: int
+    max_backlog: int
+    errors: int
+
+    def __init__(self, logger: 'Logger', queue_size: int, flush_interval: float):
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.queue = FrameQueue(maxsize=queue_size, policy=OverflowPolicy.block)  # the logs never drop a frame
+        self.rows_written = 0
+        self.max_backlog = 0
+        self.errors = 0
+        self.last_error = None
+        self.batch_left = 0  # items of the batch taken from the queue and not written yet
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, data_entry: dict, success_callback: Union[None, Callable]) -> None:
+        self.put_item((data_entry, success_callback))
+        self.max_backlog = max(self.max_backlog, len(self.queue))
+
+    def put_update(self, timestamp: str, values: dict) -> None:
+        self.put_item(LogUpdate(timestamp, values))
+
+    def put_gap(self, gap: ConnectionGap) -> None:
+        self.put_item(gap)
+
+    def put_item(self, item) -> bool:
+        """ Wait for the room in the queue as long as the writer runs, return False if the item was not queued """
+        while not self.queue.put(item, timeout=self.flush_interval):
+            if not self.thread.is_alive():
+                print(f"Log writer stopped, the item is not saved: {item}", file=sys.stderr)
+                return False
+        return True
+
+    def run(self) -> None:
+        while self.is_running or len(self.queue):
+            batch = self.queue.get_batch(timeout=self.flush_interval)
+            if not batch:
+                self.write_item(self.logger.flush_segment)
+            self.batch_left = len(batch)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    self.write_item(self.logger.flush_segment)
+                    item.set()  # the waiting thread goes on even if the flush failed
+                elif isinstance(item, LogUpdate):
+                    self.write_item(self.logger.write_update, item.timestamp, item.values)
+                elif isinstance(item, ConnectionGap):
+                    self.write_item(self.logger.write_connection_gap, item)
+                elif item is not None and self.write_item(self.logger.write_entry, *item):
+                    self.rows_written += 1
+                self.batch_left -= 1
+            if batch:
+                # the logs keep up to store_hot_rows whatever the size of the segment
+                self.write_item(self.logger.spill_logs)
+
+    def write_item(self, write: Callable, *args) -> bool:
+        """ Report a failing write and go on with the next items, the failed rows stay in the logs in memory
+        a repeated error, e.g. of a full disk, is reported once until a write succeeds again
+        """
+        try:
+            write(*args)
+        except Exception as e:  # e.g. OSError of a full disk or sqlite3.Error of the database
+            self.errors += 1
+            if str(e) != self.last_error:
+                self.last_error = str(e)
+                print(f"Log writer failed in {write.__name__}: {e}", file=sys.stderr)
+            return False
+        if self.last_error is not None:
+            print(f"Log writer recovered, {self.errors} failed writes so far", file=sys.stderr)
+            self.last_error = None
+        return True
+
+    def flush(self) -> None:
+        """ Wait until the frames queued so far are written to the file """
+        is_flushed = threading.Event()
+        if not self.put_item(is_flushed):
+            return None
+        while not is_flushed.wait(timeout=self.flush_interval):
+            if not self.thread.is_alive():
+                print("Log writer stopped before the flush", file=sys.stderr)
+                return None
+
+    def stop(self, timeout: float) -> bool:
+        """ Write the frames still queued and stop the thread, return False if it is still writing after timeout
+        a stalled writer, e.g. of a disk not responding, is reported instead of blocking the caller
+        """
+        self.is_running = False
+        self.queue.put(None, timeout=0.0)  # wake the writer up, a full queue wakes it up anyway
+        self.thread.join(timeout=timeout)
+        if self.thread.is_alive():
+            print(f"Log writer still busy after {timeout} s, {self.get_backlog()} items not saved", file=sys.stderr)
+            return False
+        return True
 
-    def add(self, data_entry: dict):
-        self.values[self.head] = data_entry
-        self.head = (self.head + 1) % self.size
-        self.num_entries += 1
+    def get_backlog(self) -> int:
+        return len(self.queue) + self.batch_left
 
-    def update_size(self, new_size: int):
-        self.size = new_size
+    def get_report(self) -> str:
+        return (f"{self.rows_written} rows written, backlog {self.get_backlog()}, max backlog {self.max_backlog}, "
+                f"{self.errors} errors")
 
 
 class Logger:
     """ Perform function strictly related to logging all possible data
     Attributes:
         log_path is an absolute path where the logs are stored
-        prediction_results are {timestamps as str: Union[1, 0]}
-        notes are {timestamp as str: text as str}
-        data_dict are {timestamp as str: data_entry as dict}
+        logs are the latest frames of the session, accessed as {timestamp as str: data_entry}
+        spill_sink writes the older frames removed from the logs, see spill_logs
+        writer is the thread writing the log files, the other threads never wait for the disk
+        manifest lists the log segments of the session, segment is the one being written
+        catalog indexes the session among all the others, it is updated whenever the manifest is saved
+        database keeps the frames if log_extension is that of log_database.py, None otherwise
+        prediction_results are {timestamps as str: Union[1, 0]}, read from the logs
+        notes are {timestamp as str: text as str}, read from the logs
     """
     session_id: str
     log_path: str
     folder_path: str
-    prediction_results: dict
-    notes: dict
-    logs: dict[str, dict]  # data collector, which saves everything together
+    logs: SessionStore  # data collector, which saves everything together
     last_timestamp: str
     last_model_threshold: float
     is_test: bool
     show_notification: bool
     tester = PerformanceTester(critical_file=True)
-    buffer = Buffer()
-
-    columns = [
-            'timestamp', 'local_time', 'sensor_2', 'sensor_4',
-            'bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2',
-            'mv_1', 'mv_2', 'mv_3', 'mv_4',
-            'left_eye_x', 'left_eye_y', 'right_eye_x', 'right_eye_y',
-            'nose_x', 'nose_y', 'mouth_left_x', 'mouth_left_y',
-            'mouth_right_x', 'mouth_right_y', 'fhp', 'prediction',
-            'notes', 'user_id', 'alarm_notification',
-            'notification_interval', 'feedback', 'model_threshold', 'model_notes'
-            ]
+
+    columns = COLUMNS
+    log_extension = uc.Measurements.log_file_extension.value
 
     def __init__(self, session_id: str, test=False):
         self.session_id = session_id
+        self.database = LogDatabase() if self.log_extension == DATABASE_EXTENSION else None
         self.folder_path = self.create_folder_logs(session_id, test)
         self.log_path = self.create_log_file(session_id=session_id,
                                              columns=self.columns,
-                                             folder_path=self.folder_path)
-        self.prediction_results = {}
-        self.notes = {}
-        self.logs = {}
+                                             folder_path=self.folder_path,
+                                             extension=self.log_extension)
+        self.sink = self.create_sink(self.log_path)
+        self.manifest = SessionManifest(self.folder_path, session_id)
+        self.segment = self.manifest.add_segment(self.log_path)
+        self.manifest.save()
+        self.saved_rows = 0  # rows of the segment in the saved manifest
+        self.logs = SessionStore(chunk_size=uc.Measurements.store_chunk_size.value)
+        self.spill_sink = None
+        self.spill_lock = threading.Lock()
         self.last_timestamp = ""
         self.last_model_threshold = np.nan
         self.is_test = test
         self.show_notification = True
+        self.catalog = SessionCatalog()
+        self.update_catalog()
+        self.writer = LogWriter(self,
+                                queue_size=uc.Measurements.log_queue_size.value,
+                                flush_interval=uc.Measurements.log_flush_interval.value)
 
     def __repr__(self) -> str:
         content = (f"===Logger START===\n"
@@ -92,47 +497,157 @@ class Logger:
                    f"===Logger END===")
         return content
 
+    @property
+    def prediction_results(self) -> dict:
+        predictions = self.logs.get_column('prediction')
+        timestamps = self.logs.get_column('timestamp')
+        has_prediction = ~np.isnan(predictions)
+        return dict(zip(timestamps[has_prediction].tolist(), predictions[has_prediction].tolist()))
+
+    @property
+    def notes(self) -> dict:
+        return {timestamp: notes for timestamp, notes
+                in zip(self.logs.get_column('timestamp').tolist(), self.logs.get_column('notes').tolist())
+                if notes}
+
+    def create_sink(self, path: str) -> Union[CsvLogSink, SegmentLogSink, DatabaseLogSink]:
+        if path.endswith(DATABASE_EXTENSION):
+            return DatabaseLogSink(path=path,
+                                   database=self.database,
+                                   flush_rows=uc.Measurements.log_flush_rows.value,
+                                   flush_interval=uc.Measurements.log_flush_interval.value)
+        if path.endswith(SEGMENT_EXTENSION):
+            return SegmentLogSink(path=path,
+                                  flush_rows=uc.Measurements.log_flush_rows.value,
+                                  flush_interval=uc.Measurements.log_flush_interval.value)
+        return CsvLogSink(path=path,
+                          columns=self.columns,
+                          flush_rows=uc.Measurements.log_flush_rows.value,
+                          flush_interval=uc.Measurements.log_flush_interval.value)
+
     def add_to_buffer(self, data_entry: dict, success_callback: Union[None, Callable]):
-        """ Add the new data to the buffer
-        1. New data will be added to the log file
-        2. Once the log file is full, it created a new log file to save the data
-        3. Buffer gets empty
+        """ Queue the new data for the writer thread, see write_entry """
+        self.writer.put(data_entry, success_callback)
+
+    def write_entry(self, data_entry: dict, success_callback: Union[None, Callable]):
+        """ Add the new data to the log segment, called by the writer thread
+        1. New data will be written to the log file by the sink
+        2. Once the segment has log_segment_rows or is open for log_segment_duration, a new log file is created
+        3. The manifest lists the closed segment with its rows and time range
         """
-        self.buffer.add(data_entry)
-        # Add data entry to the logs
-        # asyncio.run(self.add_row_async(data_entry, file_path=self.log_path))
-        self.add_row(data_entry)  # add row in sync
-        if self.buffer.head == 0:
-            """ Postprocess the data stored in the buffer """
+        self.sink.add(data_entry)
+        self.segment.add(data_entry)
+        if self.segment.rows >= uc.Measurements.log_segment_rows.value \
+                or self.segment.get_age() >= uc.Measurements.log_segment_duration.value:
             self.log_buffer()
+            self.sink.close()
+            self.segment.is_closed = True
+            saved_segment = self.segment
             self.log_path = self.create_log_file(session_id=self.session_id,
                                                  columns=self.columns,
-                                                 folder_path=self.folder_path)
-            # self.buffer = [None] * self.buffer_size
-            self.buffer.reset()
+                                                 folder_path=self.folder_path,
+                                                 extension=self.log_extension)
+            self.sink = self.create_sink(self.log_path)
+            self.segment = self.manifest.add_segment(self.log_path)
+            self.manifest.save()
+            self.update_catalog()
+            self.saved_rows = 0
             # Show success saving notification
             if success_callback and self.show_notification:
                 success_callback(subject="Data Logged!")
-            print(f"{self.buffer.size} Rows saved to {self.log_path}")
+            print(f"{saved_segment.rows} Rows saved to {saved_segment.file}")
+
+    def write_update(self, timestamp: str, values: dict) -> None:
+        """ Save the new values of a row already written, called by the writer thread """
+        if isinstance(self.sink, DatabaseLogSink):
+            self.sink.update(timestamp, values)
+
+    def save_update(self, timestamp: str, values: dict) -> None:
+        """ The log files keep the values known at the flush, the database updates the row afterwards as well """
+        if self.database is not None:
+            self.writer.put_update(timestamp, values)
+
+    def log_connection_gap(self, disconnected_at: float, reconnected_at: float) -> None:
+        """ Queue the interval without the data from the device for the gaps file, see write_connection_gap """
+        self.writer.put_gap(ConnectionGap(disconnected_at, reconnected_at, self.last_timestamp))
+
+    def write_connection_gap(self, gap: ConnectionGap) -> None:
+        """ Mark the interval without the data from the device in the gaps file of the session,
+        called by the writer thread
+        """
+        gaps_path = os.path.join(self.folder_path, f"gaps_{self.session_id}.csv")
+        is_new_file = not os.path.exists(gaps_path)
+        time_format = uc.Measurements.time_format.value
+        with open(gaps_path, mode='a', newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            if is_new_file:
+                writer.writerow(['start_local_time', 'end_local_time', 'duration', 'last_timestamp'])
+            writer.writerow([datetime.datetime.fromtimestamp(gap.disconnected_at).strftime(time_format),
+                             datetime.datetime.fromtimestamp(gap.reconnected_at).strftime(time_format),
+                             round(gap.reconnected_at - gap.disconnected_at, 3),
+                             gap.last_timestamp])
+        print(f"Connection gap saved to {gaps_path}")
+
+    def flush_segment(self) -> None:
+        """ Write the pending rows and the current size of the segment to the manifest
+        the manifest and the catalog are saved only if the segment has new rows, e.g. not while the device is silent
+        """
+        self.sink.flush()
+        if self.segment.rows == self.saved_rows:
+            return None
+        self.manifest.save()
+        self.update_catalog()
+        self.saved_rows = self.segment.rows
+
+    def flush(self) -> None:
+        """ Write all the data added so far to the log file """
+        self.writer.flush()
+
+    def close(self) -> None:
+        """ Write the queued and pending rows and close the log files """
+        is_stopped = self.writer.stop(timeout=uc.Measurements.log_close_timeout.value)
+        print(f"Log writer: {self.writer.get_report()}")
+        if not is_stopped:
+            return None  # the files still belong to the writer thread
+        self.sink.close()
+        self.segment.is_closed = True
+        self.manifest.save()
+        self.update_catalog()
+        self.catalog.close()
+        if self.database is not None:
+            self.database.close()
+        if self.spill_sink is not None:
+            self.spill_sink.close()
+
+    def update_catalog(self) -> None:
+        """ The catalog is only an index of the logs, the logging goes on if it cannot be updated """
+        try:
+            self.catalog.update_session(self.session_id, self.folder_path, self.is_test, self.manifest.segments)
+        except sqlite3.Error as e:
+            print(f"Session catalog not updated: {e}", file=sys.stderr)
+
+    def spill_logs(self) -> None:
+        """ Keep up to store_hot_rows in the logs, the older chunks are written to the spill file
+        with all the updates they received, and read back from it when all the data is saved
+        """
+        with self.spill_lock:
+            while len(self.logs) - self.logs.chunk_size >= uc.Measurements.store_hot_rows.value:
+                if self.spill_sink is None:
+                    spill_path = self.create_log_file(session_id=self.session_id,
+                                                      columns=self.columns,
+                                                      note='spill',
+                                                      folder_path=self.folder_path)
+                    self.spill_sink = self.create_sink(spill_path)
+                self.spill_sink.write_chunks([self.logs.pop_chunk()])
 
     def log_buffer(self):
         self.tester.end()
         self.tester.show_time_summary(function_name='log_buffer',
                                       notes="See the time interval between creating a new file")
         self.tester.start()
-        """ Log the buffer to the file """
-        # Convert buffer to DataFrame
-        df = pd.DataFrame(columns=self.columns)
-        for data_entry in self.buffer.values:
-            if data_entry is None:
-                continue
-            new_row = {}
-            for key in df.columns:
-                new_row[key] = data_entry.get(key, np.nan)
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        # Save DataFrame to CSV
-        df.to_csv(self.log_path, index=False)
-        print(f"Data saved to {self.log_path}")
+        """ Write the rows still pending in the sink to the file """
+        self.sink.flush()
+        print(f"Data saved to {self.sink.path}")
 
     @staticmethod
     async def add_row_async(data_entry: dict, file_path: str):
@@ -144,21 +659,24 @@ class Logger:
             await writer.writerow(readings)
 
     def log_all_data(self) -> None:
-        data = copy.deepcopy(self.logs)
-        # Convert to DataFrame
-        df = pd.DataFrame(columns=self.columns)
-        for timestamp, data in data.items():
-            new_row = {'timestamp': timestamp}
-            for key in df.columns:
-                new_row[key] = data.get(key, np.nan)
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+        """ Stream all the rows of the session to a new file,
+        the spilled ones from the spill file and the rest straight from the columns of the store
+        """
         # New file path
         new_path = self.create_log_file(session_id=self.session_id,
                                         columns=self.columns,
                                         note='all',
                                         folder_path=self.folder_path)
-        # Save DataFrame to CSV
-        df.to_csv(new_path, index=False)
+        with self.spill_lock:
+            # the same rows are never both in the spill file and in the logs
+            chunks = list(self.logs.iter_chunks())
+            spill_sink = self.spill_sink
+            num_spilled = 0 if spill_sink is None else spill_sink.rows_written
+        sink = self.create_sink(new_path)
+        if num_spilled:
+            sink.copy_rows(spill_sink.path, num_spilled)
+        sink.write_chunks(chunks)
+        sink.close()
         print(f"All Data saved to {new_path}")
 
     @staticmethod
@@ -181,35 +699,27 @@ class Logger:
         df = Logger.process_models_thresholds_gaps(df)
         return df
 
-    def add_row(self, data_entry: dict):
-        """ Simply write add one additional row of data
-        Note: 1. the function supposed to be called at the end of iteration
-        when all necessary information has been received
-        2. Not in use !
-        """
-        readings = []
-        for key, value in data_entry.items():
-            readings.append(value)
-        row = ','.join(str(r) for r in readings)
-        with open(self.log_path, mode='a', newline='', encoding='utf-8') as csv_file:
-            csv_file.write(row + '\n')
-
     def get_last_data_entry(self) -> dict:
         return self.logs[self.last_timestamp]
 
     def get_last_local_time(self) -> str:
         return self.logs[self.last_timestamp]['local_time']
 
-    def add_sensor_entry(self, data_entry: dict, timestamp: str, user_id: int) -> None:
-        """ Function is responsible for processing only data received from the sensor """
+    def add_sensor_entry(self, data_entry: dict, timestamp: str, user_id: int) -> RowView:
+        """ Function is responsible for processing only data received from the sensor
+        The data is copied to the logs, the returned entry of the logs has to be used for the further updates
+        """
         data_entry['user_id'] = user_id
         if timestamp not in self.logs:
-            local_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            data_entry['local_time'] = local_time
-            data_entry['local_timestamp'] = datetime.datetime.now().timestamp()
-            self.logs[timestamp] = data_entry
-        else:
-            self.logs[timestamp].update(data_entry)
+            if 'local_timestamp' not in data_entry:
+                # the frames keep the local time of their first record
+                local_timestamp = datetime.datetime.now().timestamp()
+                data_entry['local_time'] = format_local_time(local_timestamp)
+                data_entry['local_timestamp'] = local_timestamp
+            return self.logs.append(data_entry)
+        entry = self.logs[timestamp]
+        entry.update(data_entry)
+        return entry
 
     @staticmethod
     def create_folder_logs(session_id: str, is_test: bool) -> str:
@@ -222,12 +732,31 @@ class Logger:
         return path
 
     @staticmethod
-    def create_log_file(session_id: str, columns: list[str], folder_path: str, note=None) -> str:
-        today = datetime.datetime.now()
-        file_name = f"/data_{today.strftime('%Y%m%d%H%M%S')}_{session_id}.csv"
+    def get_log_file_path(folder_path: str, file_time: str, session_id: str, note=None, extension='.csv') -> str:
+        file_name = f"/data_{file_time}_{session_id}{extension}"
         if note:
-            file_name = f"/data_{today.strftime('%Y%m%d%H%M%S')}_{session_id}_{note}.csv"
-        file_path = folder_path + file_name
+            file_name = f"/data_{file_time}_{session_id}_{note}{extension}"
+        return folder_path + file_name
+
+    @staticmethod
+    def create_log_file(session_id: str, columns: list[str], folder_path: str, note=None, extension='.csv') -> str:
+        file_time = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        file_path = Logger.get_log_file_path(folder_path, file_time, session_id, note, extension)
+        copy_num = 1
+        while os.path.exists(file_path):
+            # Several files created within one second, e.g. in the fast replay
+            file_path = Logger.get_log_file_path(folder_path, f"{file_time}-{copy_num}", session_id, note, extension)
+            copy_num += 1
+        if extension == SEGMENT_EXTENSION:
+            # an empty segment reserves the name, it is replaced once the segment is closed
+            write_empty_segment(file_path)
+            print(f"Log segment created: {file_path}")
+            return file_path
+        if extension == DATABASE_EXTENSION:
+            # the rows are in the database, the file reserves the name of the segment and points to them
+            write_reference(file_path, uc.FilePaths.log_database_path.value, session_id)
+            print(f"Log segment created in the database: {file_path}")
+            return file_path
         # Create the CSV file
         with open(file_path, 'w', encoding='utf-8') as csv_file:
             writer = csv.writer(csv_file)
@@ -237,19 +766,17 @@ class Logger:
 
     def update_prediction(self, timestamp: str, prediction: int):
         """ Update the prediction data for a given timestamp """
-        self.prediction_results[timestamp] = prediction
-        if timestamp in self.prediction_results:
+        if timestamp in self.logs:
             # add to the main data collector
             self.logs[timestamp]['prediction'] = prediction
+            self.save_update(timestamp, {'prediction': prediction})
 
     def update_notes(self, timestamp: str, notes: str):
         """ Update the notes data for a given timestamp """
-        self.notes[timestamp] = notes
-        if len(timestamp) == 0:
-            return None
-        if timestamp in self.notes:
+        if timestamp in self.logs:
             # add to the main data collector
             self.logs[timestamp]['notes'] = notes
+            self.save_update(timestamp, {'notes': notes})
 
     def update_last_timestamp(self, timestamp: str):
         self.last_timestamp = timestamp
@@ -264,18 +791,23 @@ class Logger:
         if stamp in self.logs:
             self.logs[stamp]['alarm_notification'] = status
             self.logs[stamp]['notification_interval'] = interval
+            self.save_update(stamp, {'alarm_notification': status, 'notification_interval': interval})
 
     def update_user_feedback(self, value: int, timestamp: str):
-        """ Value 1 and 0 represents True and False, respectively """
+        """ Value 1 and 0 represents True and False, respectively
+        The feedback may come after the row has left the logs, the database still updates it
+        """
         stamp = timestamp
         if stamp in self.logs:
             self.logs[stamp]['feedback'] = value
+        self.save_update(stamp, {'feedback': value})
 
     def update_model_threshold(self, value: float, timestamp: str):
         if timestamp in self.logs:
             self.logs[timestamp]['model_threshold'] = value
             note = f"Thresholds changed from {self.last_model_threshold} to {value} at {timestamp} local time."
             self.add_model_notes(note, timestamp)
+            self.save_update(timestamp, {'model_threshold': value, 'model_notes': note})
             self.last_model_threshold = value
 
     def add_model_notes(self, note: str, timestamp: str):
@@ -286,37 +818,48 @@ class Logger:
     def add_notes(df_collector: pd.DataFrame, marked_data: pd.DataFrame) -> pd.DataFrame:
         if len(marked_data) == 0:
             return df_collector
-        columns_to_rename = {"Sensor 2": "sensor_2",
-                             "Sensor 4": "sensor_4",
-                             "Time": "local_time"}
         merging_columns = ["local_time", "sensor_2", "sensor_4"]
-        renamed_notes = marked_data.rename(columns=columns_to_rename)
+        renamed_notes = Logger.rename_notes_columns(marked_data)
         print("Marked DF:")
         print(renamed_notes[merging_columns])
-        result_df = pd.merge(df_collector, renamed_notes,
-                             on=merging_columns,
-                             how='left')
+        result_df = Logger.merge_notes(df_collector, renamed_notes)
         print("Data Collector DF:")
         print(df_collector[merging_columns])
         print("Merged DF: ")
         print(result_df[merging_columns+["Notes"]])
         return result_df
 
+    @staticmethod
+    def rename_notes_columns(marked_data: pd.DataFrame) -> pd.DataFrame:
+        columns_to_rename = {"Sensor 2": "sensor_2",
+                             "Sensor 4": "sensor_4",
+                             "Time": "local_time"}
+        return marked_data.rename(columns=columns_to_rename)
+
+    @staticmethod
+    def merge_notes(df_collector: pd.DataFrame, renamed_notes: pd.DataFrame) -> pd.DataFrame:
+        """ Notes of the rows matched by the local time and the readings, the notes renamed by rename_notes_columns """
+        merging_columns = ["local_time", "sensor_2", "sensor_4"]
+        return pd.merge(df_collector, renamed_notes,
+                        on=merging_columns,
+                        how='left')
+
     @staticmethod
     def process_notes_gaps(df: pd.DataFrame) -> pd.DataFrame:
         """ Dataframe has rows where notes are NaN, due to NaN values of Sensor 2 and Sensor 4.
         However, the rows are required to be commented as well.
-        Therefore, this function is responsible to fill in the rows with Notes as NaN
+        Therefore, the notes are copied to the 2 rows before them, the closer note wins when they overlap
         """
         # Check if the "Notes" exists
         col = 'Notes'
         if col not in df.columns:
             print(f"Warning! Column '{col}' does not exists in DataFrame", file=sys.stderr)
             return df
-        mask = ~pd.isna(df[col])
-        rows_with_notes = df.loc[mask].index
-        for row in rows_with_notes:
-            df.loc[row-2:row-1, col] = df.loc[row, col]
+        notes = df[col]
+        next_notes = notes.shift(-1)
+        second_next_notes = notes.shift(-2)
+        notes = next_notes.where(next_notes.notna(), notes)
+        df[col] = second_next_notes.where(second_next_notes.notna(), notes)
         return df
 
     # @staticmethod
@@ -379,20 +922,89 @@ class Logger:
 
     @staticmethod
     def process_alarm_notifications(df: pd.DataFrame) -> pd.DataFrame:
-        # Tested and works
-        is_alarm = df['alarm_notification'] == "yes"
-        alarm_indexes: list[int] = df[is_alarm].index
-        for i in alarm_indexes:
-            time = df.loc[i, 'local_time']
-            interval = int(df.loc[i, 'notification_interval'])
-            indicated_feedback = df.loc[i, 'feedback']
-            timestamps = Logger.get_timestamps_by_interval(time, interval)
-            df = Logger.set_status_by_local_time(df, local_times=timestamps,
-                                                 new_statuses={"alarm_notification": "yes",
-                                                               "notification_interval": interval,
-                                                               "feedback": indicated_feedback})
+        """ Every row within notification_interval seconds before an alarm notification gets its status,
+        interval and feedback. The alarms are applied in the row order, so the later one wins where they overlap,
+        and an alarm inside an earlier window takes the interval and feedback of that window first
+        """
+        alarms = df[df['alarm_notification'] == "yes"]
+        return Logger.apply_alarm_windows(df, Logger.get_alarm_windows(alarms))
+
+    @staticmethod
+    def get_alarm_windows(alarms: pd.DataFrame, previous: Union[None, pd.DataFrame] = None) -> pd.DataFrame:
+        """ Windows of the alarm notification rows given in the row order of the session:
+        start and end in seconds as by get_local_seconds, notification_interval and feedback.
+        The previous windows, e.g. of the rows integrated already, precede the alarms and are returned with them
+        """
+        num_previous = 0 if previous is None else len(previous)
+        seconds, is_formatted = Logger.get_local_seconds(alarms['local_time'])
+        # only the exact local times have been matched
+        alarm_seconds = np.concatenate([np.full(num_previous, np.nan), np.where(is_formatted, seconds, np.nan)])
+        intervals = alarms['notification_interval'].to_numpy(dtype=float)
+        feedbacks = alarms['feedback'].to_numpy(dtype=float)
+        ends = seconds
+        starts = np.full(len(alarms), np.inf)
+        if num_previous:
+            intervals = np.concatenate([previous['notification_interval'].to_numpy(dtype=float), intervals])
+            feedbacks = np.concatenate([previous['feedback'].to_numpy(dtype=float), feedbacks])
+            ends = np.concatenate([previous['end'].to_numpy(dtype=float), ends])
+            starts = np.concatenate([previous['start'].to_numpy(dtype=float), starts])
+        for j in range(num_previous, len(ends)):
+            if np.isnan(ends[j]):
+                raise ValueError(f"Local time of the alarm notification at row {alarms.index[j - num_previous]} "
+                                 f"does not match the format {uc.Measurements.time_format.value}")
+            covering = np.flatnonzero((starts[:j] <= alarm_seconds[j]) & (alarm_seconds[j] <= ends[:j]))
+            if len(covering):
+                intervals[j] = intervals[covering[-1]]
+                feedbacks[j] = feedbacks[covering[-1]]
+            intervals[j] = int(intervals[j])
+            starts[j] = ends[j] - intervals[j]
+        return pd.DataFrame({'start': starts, 'end': ends,
+                             'notification_interval': intervals, 'feedback': feedbacks})
+
+    @staticmethod
+    def apply_alarm_windows(df: pd.DataFrame, windows: pd.DataFrame) -> pd.DataFrame:
+        """ Set the status, interval and feedback of the last window covering each row,
+        the windows of get_alarm_windows may come from the rows of the whole session while df is a part of it
+        """
+        if len(windows) == 0 or len(df) == 0:
+            return df
+        seconds, is_formatted = Logger.get_local_seconds(df['local_time'])
+        row_seconds = np.where(is_formatted, seconds, np.nan)
+        # the last alarm covering each row, by the windows of seconds over the sorted rows
+        order = np.argsort(row_seconds, kind='stable')
+        sorted_seconds = row_seconds[order]
+        starts = windows['start'].to_numpy()
+        ends = windows['end'].to_numpy()
+        alarm_of_row = np.full(len(df), -1)
+        for j in np.flatnonzero((starts <= np.nanmax(row_seconds, initial=-np.inf)) &
+                                (ends >= np.nanmin(row_seconds, initial=np.inf))):
+            first = np.searchsorted(sorted_seconds, starts[j], side='left')
+            last = np.searchsorted(sorted_seconds, ends[j], side='right')
+            alarm_of_row[order[first:last]] = j
+        rows = np.flatnonzero(alarm_of_row >= 0)
+        if len(rows) == 0:
+            return df
+        alarms = alarm_of_row[rows]
+        df.iloc[rows, df.columns.get_loc('alarm_notification')] = "yes"
+        df.iloc[rows, df.columns.get_loc('notification_interval')] = windows['notification_interval'].to_numpy()[alarms]
+        df.iloc[rows, df.columns.get_loc('feedback')] = windows['feedback'].to_numpy()[alarms]
         return df
 
+    @staticmethod
+    def get_local_seconds(local_times: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """ Seconds of the local times since 1970 as naive datetimes, NaN if they cannot be parsed,
+        and whether each local time is formatted exactly as Measurements.time_format formats it
+        """
+        time_format = uc.Measurements.time_format.value
+        codes, texts = pd.factorize(local_times)  # every distinct local time is parsed once
+        texts = pd.Series(texts, dtype=object).astype(str)
+        parsed = pd.to_datetime(texts, format=time_format, errors='coerce')
+        is_formatted = (parsed.dt.strftime(time_format) == texts).to_numpy()
+        seconds = ((parsed - pd.Timestamp(1970, 1, 1)) // pd.Timedelta(seconds=1)).to_numpy(dtype=float, na_value=np.nan)
+        is_known = codes >= 0
+        return (np.where(is_known, seconds[codes], np.nan),
+                np.where(is_known, is_formatted[codes], False))
+
     @staticmethod
     def save_alarm_texts(path: str, texts: list[str]):
         with open(path, 'w') as file:
@@ -401,24 +1013,7 @@ class Logger:
 
     @staticmethod
     def process_models_thresholds_gaps(df: pd.DataFrame) -> pd.DataFrame:
+        """ Every threshold is used for the rows until the next one, the rows before the first one stay NaN """
         col_name = 'model_threshold'
-        mask = ~pd.isna(df[col_name])
-        indexes = df[mask].index
-        if len(indexes) == 0:
-            return df
-        print(indexes)
-        lower = 0  # start with 0
-        for i in range(len(indexes)):
-            upper: int = indexes[i]  # determine the limits
-            threshold = df.loc[lower, col_name]
-            selected_indexes = [i for i in range(lower, upper)]
-            df.loc[selected_indexes, col_name] = threshold
-            lower = upper
-        else:
-            # the last threshold is fills out the remaining None values in csv
-            lower = indexes[-1]
-            upper = df.shape[0]
-            threshold = df.loc[lower, col_name]
-            selected_indexes = [i for i in range(lower, upper)]
-            df.loc[selected_indexes, col_name] = threshold
+        df[col_name] = df[col_name].ffill()
         return df
@@ -15,6 +15,14 @@ import csv
 import os
 import datetime
 from performance_tester import PerformanceTester
+from line_parser import LineParser
+from frame_assembler import FrameAssembler
+from frame_schema import Frame, FACE_FEATURES
+from frame_source import FrameSource, SerialFrameSource, MultiPortSource, RecordedLogSource, ReplayStats
+from typing import Union
+
+
+line_parser = LineParser()
 
 
 class ThreadManager:
@@ -29,21 +37,38 @@ class ThreadManager:
     _lock = threading.Lock()
     time_assessor: PerformanceTester
     process: psutil.Process
+    source: FrameSource
+    frame_assembler: FrameAssembler
+    stats: ReplayStats
     data_dict: dict[str, dict]
     prediction_dict: dict
     #notes_dict: dict
 
-    def __init__(self, app_title: str):
+    def __init__(self, app_title: str, source: Union[None, FrameSource] = None, test=False):
+        """ Without the source given, the lines are read from the device detected on the serial port """
         self.process = psutil.Process()
+        self.memory_reported_at = time.monotonic()
         # self.log_path = self.create_log_file()
-        self.app = App(title=app_title, fullscreen=False)  # 先初始化self.app
+        self.app = App(title=app_title, fullscreen=False, test=test,
+                       detect_port=source is None)  # 先初始化self.app
         self.time_assessor = PerformanceTester(critical_file=False)
         self.reading_thread = threading.Thread(target=self.connect, daemon=False)
-        self.time_delay = 0.01  # Set to a shorter delay for faster reading
         self.alarm_num = 0
         self.serial_manager = self.app.serial_manager
-        if self.serial_manager.ser is None:
-            raise Exception("Failed to open serial port")
+        if source is None:
+            if self.serial_manager.ser is None:
+                raise Exception("Failed to open serial port")
+            source = SerialFrameSource(self.serial_manager)
+        elif source.serial_manager is not None:
+            # the commands go to the port of the source
+            self.serial_manager = source.serial_manager
+            self.app.set_serial_manager(source.serial_manager)
+        self.source = source
+        self.source.add_reconnect_listener(self.record_connection_gap)
+        self.time_delay = source.poll_delay  # Set to a shorter delay for faster reading
+        self.frame_assembler = FrameAssembler(create_frame=self.get_default_entry,
+                                              timeout=uc.Measurements.frame_timeout.value)
+        self.stats = ReplayStats()
 
     @staticmethod
     def create_log_file() -> str:
@@ -85,167 +110,94 @@ class ThreadManager:
         #self.app.save_last_data()
         if self.reading_thread and self.reading_thread.is_alive():
             self.reading_thread.join()  # Wait for the thread to finish
+        self.app.logger.close()
         self.app.destroy()
 
     def connect(self, data_entry=None) -> None:
-        """ Connect to the COM port """
+        """ Read the lines from the frame source until the app is stopped or the source is exhausted
+        The reading goes on while the app is paused, so the port never overflows and no frame is lost
+        """
         while not self.app.is_stopped:
-            if not self.app.is_paused:
-                line = self.serial_manager.read_line()
-                if line is None:
-                    continue
-                clean_line = self.clean_line(line)
-                timestamp, data_entry = self.parse_line(clean_line)
-                if timestamp is None:
-                    continue
-                if timestamp == self.app.logger.last_timestamp:
-                    # full join received data entry and last data entry
-                    received_data = data_entry
-                    last_data = self.app.logger.get_last_data_entry()
-                    data_entry = self.app.data_analyst.custom_dict_update(original_data=last_data,
-                                                                          new_data=received_data)
-                self.app.logger.add_sensor_entry(data_entry=data_entry,
-                                                 timestamp=timestamp,
-                                                 user_id=self.app.db_manager.session.user_id)
-                self.app.logger.add_to_buffer(data_entry=data_entry,
-                                              success_callback=self.app.show_notify_log_success)
-                # print("Data Parsed and Logged:")
-                # print(data_entry)
-            time.sleep(self.time_delay)
-        else:
-            print("Data Parsing has been stopped")
-            self.serial_manager.close()
-
-    @staticmethod
-    def clean_line(line):
-        # 去除“绿色”设置的乱码
-        clean_line = re.sub(r'\x1B\[[0-9;]*[A-Za-z]', '', line)
-        return clean_line
-
-    def parse_line(self, line: str) -> tuple:
-        """ Parse the sensor data 
-        Return timestamp as str and data entry as dict
+            lines = self.source.read_lines()
+            if not lines:
+                if self.source.is_exhausted:
+                    self.process_frame(self.frame_assembler.flush())
+                    print(f"Frame source exhausted: {self.stats}")
+                    break
+                # the device is silent, the last frame may be complete already
+                self.process_frame(self.frame_assembler.poll())
+                time.sleep(self.time_delay)  # only non-blocking sources need to wait for new data
+                continue
+            for line in lines:
+                self.stats.add_line(self.process_line(line))
+            if time.monotonic() - self.memory_reported_at >= uc.Measurements.memory_report_interval.value:
+                self.check_memory_usage()
+        print("Data Parsing has been stopped")
+        self.source.close()
+
+    def record_connection_gap(self, disconnected_at: float, reconnected_at: float) -> None:
+        """ The device has been reconnected, the session continues """
+        self.app.logger.log_connection_gap(disconnected_at, reconnected_at)
+
+    def process_line(self, line: str) -> Union[None, str]:
+        """ Parse a single line, return the device timestamp it belongs to
+        The line is only added to its frame, the frame is processed once the next tick starts
         """
-        timestamp_match = re.search(r'I \((\d+)\)', line)
-        if timestamp_match:
-            last_timestamp = timestamp_match.group(1)
-            self.app.logger.update_last_timestamp(timestamp=last_timestamp)
-            if last_timestamp not in self.app.logger.logs:
-                self.app.logger.logs[last_timestamp] = self.get_default_entry(last_timestamp)
-        if not self.app.logger.last_timestamp:
-            return None, None
-
-        entry = self.app.logger.logs[self.app.logger.last_timestamp]
-        entry_modified = self.parse_data(line, entry)
-        sens_2, sens_4 = self.app.validate_sens_values(sens_2=entry_modified["sensor_2"],
-                                                       sens_4=entry_modified["sensor_4"],
+        # the parser removes the 'green' ANSI codes and picks the record by the line prefix
+        parsed = line_parser.parse(line)
+        self.process_frame(self.frame_assembler.feed(parsed))
+        return parsed.timestamp
+
+    def process_frame(self, frame: Union[None, Frame]) -> None:
+        """ Validate, log and render the frame completed by the assembler """
+        if frame is None:
+            return None
+        timestamp: str = frame['timestamp']
+        logger = self.app.logger
+        logger.update_last_timestamp(timestamp=timestamp)
+        frame = logger.add_sensor_entry(data_entry=frame,
+                                        timestamp=timestamp,
+                                        user_id=self.app.db_manager.session.user_id)
+        sens_2, sens_4 = self.app.validate_sens_values(sens_2=frame["sensor_2"],
+                                                       sens_4=frame["sensor_4"],
                                                        values=self.app.sensor_values)
-        entry_modified["sensor_2"] = sens_2
-        entry_modified["sensor_4"] = sens_4
+        frame["sensor_2"] = sens_2
+        frame["sensor_4"] = sens_4
+        logger.add_to_buffer(data_entry=frame,
+                             success_callback=self.app.notify_log_success)
 
         # Extract facial values
-        face_features = ['bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2',
-                'left_eye_x', 'left_eye_y', 'right_eye_x', 'right_eye_y',
-                'nose_x', 'nose_y',
-                'mouth_left_x', 'mouth_left_y', 'mouth_right_x', 'mouth_right_y']
-        
-        # Check if all keys in face_features exist in entry_modified
-        if all(face_feature in entry_modified for face_feature in face_features):
-            face_values = {face_feature: entry_modified[face_feature] for face_feature in face_features}
-        else:
-            face_values = None
+        face_values = dict(zip(FACE_FEATURES, frame.get_face_vector().tolist()))
 
         # 更新 recent_data
-        self.app.data_analyst.recent_data["sensor_2"] = entry_modified["sensor_2"]
-        self.app.data_analyst.recent_data["sensor_4"] = entry_modified["sensor_4"]
-
-        self.app.update_sensor_values(sens_2=entry_modified["sensor_2"],
-                                      sens_4=entry_modified["sensor_4"],
-                                      timestamp = int(self.app.logger.last_timestamp),
-                                      local_time=entry['local_time'])
-        self.app.update_facial_values(facial_data=face_values,
-                                      timestamp = int(self.app.logger.last_timestamp),
-                                      local_timestamp=entry['local_timestamp'])
-        return self.app.logger.last_timestamp, entry_modified
+        self.app.data_analyst.recent_data["sensor_2"] = sens_2
+        self.app.data_analyst.recent_data["sensor_4"] = sens_4
+
+        # The values are rendered later by the Tk main loop, the reader does not wait for the redraw
+        self.app.push_sensor_values(sens_2=sens_2,
+                                    sens_4=sens_4,
+                                    timestamp=int(timestamp),
+                                    local_time=frame['local_time'],
+                                    facial_data=face_values,
+                                    local_timestamp=frame['local_timestamp'])
 
     @staticmethod
     def parse_data(data, data_entry) -> dict:
-        range_pattern = re.compile(r'Range: (\d+)\s+(\d+),')
-        bbox_pattern = re.compile(r'detection_result:\s*\[\s*\d+\]:\s*\(\s*(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\)')
-        face_pattern = re.compile(
-            r'left eye: \(\s*(\d+),\s*(\d+)\), right eye: \(\s*(\d+),\s*(\d+)\), nose: \(\s*(\d+),\s*(\d+)\), mouth left: \(\s*(\d+),\s*(\d+)\), mouth right: \(\s*(\d+),\s*(\d+)\)')
-        fhp_pattern = re.compile(r'FHP detected.*?(\d+), mm')
-        mv_pattern = re.compile(r'MV: (\d+), (\d+), (\d+), (\d+)')
-
-        range_match = range_pattern.search(data)
-        if range_match:
-            data_entry['sensor_2'] = int(range_match.group(1))
-            data_entry['sensor_4'] = int(range_match.group(2))
-
-        bbox_match = bbox_pattern.search(data)
-        if bbox_match:
-            data_entry['bbox_x1'], data_entry['bbox_y1'], data_entry['bbox_x2'], data_entry['bbox_y2'] = [
-                int(bbox_match.group(i)) for i in range(1, 5)]
-
-        face_match = face_pattern.search(data)
-        if face_match:
-            data_entry['left_eye_x'], data_entry['left_eye_y'], data_entry['right_eye_x'], data_entry['right_eye_y'], \
-                data_entry['nose_x'], data_entry['nose_y'], data_entry['mouth_left_x'], data_entry['mouth_left_y'], \
-                data_entry['mouth_right_x'], data_entry['mouth_right_y'] = [int(face_match.group(i)) for i in
-                                                                            range(1, 11)]
-
-        mv_match = mv_pattern.search(data)
-        if mv_match:
-            data_entry['mv_1'], data_entry['mv_2'], data_entry['mv_3'], data_entry['mv_4'] = [int(mv_match.group(i)) for
-                                                                                              i in range(1, 5)]
-
-        fhp_match = fhp_pattern.search(data)
-        if fhp_match:
-            data_entry['fhp'] = int(fhp_match.group(1))
-
-        return data_entry
+        return LineParser.apply(line_parser.parse(data), data_entry)
 
     def check_memory_usage(self):
+        """ Reported periodically, the usage of a long session has to stay flat """
+        self.memory_reported_at = time.monotonic()
         memory_info = self.process.memory_info()
         print(f"Memory usage: {memory_info.rss / (1024 ** 2):.2f} MB (resident set size)")
         print(f"Memory usage: {memory_info.vms / (1024 ** 2):.2f} MB (virtual memory size)")
+        logs = self.app.logger.logs
+        print(f"Logs in memory: {len(logs)} of {logs.get_num_rows()} rows")
+        print(f"Log writer: {self.app.logger.writer.get_report()}")
 
     @staticmethod
-    def get_default_entry(timestamp: str) -> dict:
-        entry = {
-            'timestamp': timestamp,
-            'local_time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'local_timestamp': datetime.datetime.now().timestamp(),
-            'sensor_2': np.nan,
-            'sensor_4': np.nan,
-            'bbox_x1': np.nan,
-            'bbox_y1': np.nan,
-            'bbox_x2': np.nan,
-            'bbox_y2': np.nan,
-            'mv_1': np.nan,
-            'mv_2': np.nan,
-            'mv_3': np.nan,
-            'mv_4': np.nan,
-            'left_eye_x': np.nan,
-            'left_eye_y': np.nan,
-            'right_eye_x': np.nan,
-            'right_eye_y': np.nan,
-            'nose_x': np.nan,
-            'nose_y': np.nan,
-            'mouth_left_x': np.nan,
-            'mouth_left_y': np.nan,
-            'mouth_right_x': np.nan,
-            'mouth_right_y': np.nan,
-            'fhp': np.nan,
-            'prediction': np.nan,
-            #'notes': "",
-            'user_id': -1,
-            'bad_posture_command': 'no',
-            'alarm_notification': 'no',
-            'notification_interval': np.nan,
-            'feedback': np.nan
-        }
-        return entry
+    def get_default_entry(timestamp: str) -> Frame:
+        return Frame(timestamp)
 
 
 def start_data_collection():
@@ -253,8 +205,8 @@ def start_data_collection():
     app.mainloop()
 
 
-def start_main_app():
-    test_proc = ThreadManager(app_title="Testing Data Validation")
+def start_main_app(source: Union[None, FrameSource] = None, test=False):
+    test_proc = ThreadManager(app_title="Testing Data Validation", source=source, test=test)
     sample_data = {"Sensor 2": [], "Sensor 4": []}
     test_proc.app.sensor_values = sample_data
     """ Add buttons """
@@ -288,7 +240,28 @@ def start_main_app():
     test_proc.run()
 
 
+def start_replay_app(log_path: str, speed: Union[None, float] = 1.0):
+    """ Drive the whole app by a recorded log instead of the device
+    Speed 1.0 replays in real time, N is N times faster, None is as fast as possible
+    """
+    start_main_app(source=RecordedLogSource(path=log_path, speed=speed), test=True)
+
+
+def start_multi_port_app(ports: Union[None, list[str]] = None):
+    """ Read the sensors connected to separate ports concurrently, the first port receives the commands """
+    if ports is None:
+        ports = uc.Ports.linux_split_sensors.value
+    serial_managers = [SerialManager(port=port, timeout=uc.Measurements.serial_read_timeout.value)
+                       for port in ports]
+    if any(serial_manager.ser is None for serial_manager in serial_managers):
+        raise Exception("Failed to open serial ports")
+    start_main_app(source=MultiPortSource(serial_managers=serial_managers,
+                                          stale_timeout=uc.Measurements.port_stale_timeout.value))
+
+
 if __name__ == '__main__':
     # start_data_collection()
+    # start_replay_app(uc.FilePaths.sample_log_path.value, speed=None)
+    # start_multi_port_app()
     start_main_app()
 
@@ -0,0 +1,132 @@
+""" Models and scalers of the predictions, each loaded once and shared by all the following calls
+A model is registered by name with its loader, e.g. registry.register('model2', lambda: ort.InferenceSession(path)),
+and loaded by the first get, or ahead of it by preload, e.g. at the sign-in.
+Every model has its own lock, so a model is never loaded twice while the other ones stay available.
+The metrics are the load time of every model and the latencies of the calls measured with registry.measure:
+    {"loads": {"model2": 0.05, ...}, "calls": {"model2": {"count", "mean", "p50", "p95", "max", "last"}, ...}}
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Union
+import numpy as np
+
+LATENCY_WINDOW = 1000  # recent calls of every name kept for the percentiles
+
+
+class CallStats:
+    """ Latencies of the calls of one name in seconds """
+    count: int
+    total: float
+    max: float
+    recent: deque
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, latency: float) -> None:
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.recent.append(latency)
+
+    def to_dict(self) -> dict:
+        recent = np.array(self.recent)
+        return {"count": self.count, "mean": self.total / self.count,
+                "p50": float(np.percentile(recent, 50)), "p95": float(np.percentile(recent, 95)),
+                "max": self.max, "last": float(recent[-1])}
+
+
+class ModelRegistry:
+    """ Models of the predictions loaded lazily, once per process, and shared by the threads
+    Attributes:
+        loaders create the model of every registered name, called by the first get of the name
+        models are the loaded ones, read without a lock once they are there
+        load_times are the seconds every model took to load
+        calls are the CallStats of every name measured by measure, e.g. one prediction of a model
+        locks hold one lock per name, the first get loads the model under it and the concurrent ones wait,
+        while the other models stay available; lock guards the dicts themselves
+    """
+    loaders: dict[str, Callable[[], Any]]
+    models: dict[str, Any]
+    load_times: dict[str, float]
+    calls: dict[str, CallStats]
+
+    def __init__(self):
+        self.loaders = {}
+        self.models = {}
+        self.load_times = {}
+        self.calls = {}
+        self.locks: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()  # guards the dicts, a model is loaded under its own lock
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        """ Replacing the loader of a name drops its loaded model """
+        with self.lock:
+            self.loaders[name] = loader
+            self.locks.setdefault(name, threading.Lock())
+            self.models.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """ The loaded model, the first call of every name loads it and the concurrent ones wait for it """
+        model = self.models.get(name)
+        if model is not None:
+            return model
+        with self.lock:
+            if name not in self.loaders:
+                raise KeyError(f"Unknown model {name}")
+            model_lock, loader = self.locks[name], self.loaders[name]
+        with model_lock:
+            model = self.models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = loader()
+                load_time = time.perf_counter() - start
+                with self.lock:
+                    self.models[name] = model
+                    self.load_times[name] = load_time
+                print(f"Loaded {name} in {load_time * 1000:.1f} ms")
+        return model
+
+    def preload(self, names: Union[None, list[str]] = None) -> None:
+        """ Load the models ahead of the first prediction, all the registered ones by default
+        a model which fails to load is reported and loaded again by its first get
+        """
+        with self.lock:
+            names = list(self.loaders) if names is None else names
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Failed to preload {name}: {e}")
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self.models
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """ Add the latency of the block to the call metrics of the name """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.calls.setdefault(name, CallStats()).add(latency)
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {"loads": dict(self.load_times),
+                    "calls": {name: stats.to_dict() for name, stats in self.calls.items()}}
+
+    def print_metrics(self) -> None:
+        metrics = self.get_metrics()
+        for name, load_time in metrics["loads"].items():
+            print(f"{name}: loaded in {load_time * 1000:.1f} ms")
+        for name, stats in metrics["calls"].items():
+            print(f"{name}: {stats['count']} calls, mean {stats['mean'] * 1000:.2f} ms, "
+                  f"p50 {stats['p50'] * 1000:.2f} ms, p95 {stats['p95'] * 1000:.2f} ms, max {stats['max'] * 1000:.2f} ms")
@@ -0,0 +1,103 @@
+""" Retention policy of the long sessions
+Only the latest values are kept in memory for the live graph and the prediction,
+the older ones are dropped or spilled to the session folder and read back when the history is viewed.
+"""
+import threading
+from typing import Any, Callable, Iterator, Union
+import numpy as np
+
+
+class SpillFile:
+    """ Numeric series appended to a binary file of float64, so any range is read with a single seek """
+    path: str
+    num_values: int
+    item_size = np.dtype(np.float64).itemsize
+
+    def __init__(self, path: str):
+        self.path = path
+        self.num_values = 0
+        self.file = open(path, mode='wb')
+
+    def append(self, values: list) -> None:
+        if self.file.closed:
+            return None
+        np.asarray(values, dtype=np.float64).tofile(self.file)
+        self.file.flush()
+        self.num_values += len(values)
+
+    def read(self, start: int, stop: int) -> list:
+        """ Values [start:stop] of the spilled series """
+        count = min(stop, self.num_values) - start
+        if count <= 0:
+            return []
+        return np.fromfile(self.path, dtype=np.float64, count=count, offset=start * self.item_size).tolist()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class HotWindow:
+    """ Series keeping only the latest values in memory
+    The indexes count from the start of the session, so the positions drawn on the graph stay valid:
+    window[-1] is the latest value and len(window) is the number of values appended so far.
+    Once 2 * capacity values are held, the oldest half is handed to spill (dropped if it is None)
+    and read back by load(start, stop) when asked for.
+    Attributes:
+        offset is the number of values removed from memory
+    """
+    capacity: int
+    offset: int
+
+    def __init__(self, capacity: int, spill: Union[None, Callable[[list], None]] = None,
+                 load: Union[None, Callable[[int, int], list]] = None):
+        self.capacity = capacity
+        self.spill = spill
+        self.load = load
+        self.offset = 0
+        self.items = []
+        self.lock = threading.Lock()  # the reader thread looks up the latest value while the Tk thread appends
+
+    @classmethod
+    def spilled_to(cls, spill_file: SpillFile, capacity: int) -> 'HotWindow':
+        return cls(capacity, spill=spill_file.append, load=spill_file.read)
+
+    def __len__(self) -> int:
+        return self.offset + len(self.items)
+
+    def __iter__(self) -> Iterator[Any]:
+        """ Iterate the values kept in memory """
+        with self.lock:
+            items = list(self.items)
+        return iter(items)
+
+    def __getitem__(self, key: Union[int, slice]) -> Any:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step < 0:
+                return self.get_range(stop + 1, start + 1)[::-1][::-step]
+            return self.get_range(start, stop)[::step]
+        index = key + len(self) if key < 0 else key
+        values = self.get_range(index, index + 1)
+        if not values:
+            raise IndexError("HotWindow index out of range")
+        return values[0]
+
+    def append(self, value: Any) -> None:
+        with self.lock:
+            self.items.append(value)
+            if len(self.items) < 2 * self.capacity:
+                return None
+            spilled = self.items[:-self.capacity]
+            if self.spill is not None:
+                self.spill(spilled)  # written before the offset moves, so the range is readable at once
+            self.items = self.items[-self.capacity:]
+            self.offset += len(spilled)
+
+    def get_range(self, start: int, stop: int) -> list:
+        """ Values [start:stop], the spilled part is loaded from the disk """
+        with self.lock:
+            offset = self.offset
+            hot_values = self.items[max(start - offset, 0):max(stop - offset, 0)]
+        if start >= offset or self.load is None:
+            return hot_values
+        return self.load(start, min(stop, offset)) + hot_values
@@ -1,46 +1,313 @@
 import serial
-from typing import Union
+from serial.tools import list_ports
+from collections import deque
+from enum import Enum
+from typing import Callable, Union
 import threading
+import time
 import re
+import ui_config as uc
+
+
+ansi_pattern = re.compile(r'\x1B\[[0-9;]*[A-Za-z]')
+
+
+def remove_ansi_codes(line: str) -> str:
+    """ Remove any 'green' characters (e.g., ANSI escape codes) """
+    if '\x1b' not in line:
+        return line
+    return ansi_pattern.sub('', line)
+
+
+class ConnectionState(Enum):
+    connected = "connected"
+    reconnecting = "reconnecting"
+    closed = "closed"
+
+
+def get_device_id(port: str) -> Union[None, tuple]:
+    """ (VID, PID, serial number) of the USB device on the port, None for other ports """
+    for port_info in list_ports.comports():
+        if port_info.device == port and port_info.vid is not None:
+            return port_info.vid, port_info.pid, port_info.serial_number
+    return None
+
+
+def find_device_port(device_id: tuple) -> Union[None, str]:
+    """ Port of the USB device, which may change after the device is plugged in again """
+    for port_info in list_ports.comports():
+        if (port_info.vid, port_info.pid, port_info.serial_number) == device_id:
+            return port_info.device
+    return None
+
+
+class CommandStats:
+    """ Number and latency of the commands of one kind, from queueing until the bytes are written """
+    sent: int
+    coalesced: int
+    failed: int
+    total_latency: float
+    max_latency: float
+
+    def __init__(self):
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add_latency(self, latency: float) -> None:
+        self.sent += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def __str__(self) -> str:
+        mean_latency = self.total_latency / self.sent if self.sent else 0.0
+        return (f"sent {self.sent}, coalesced {self.coalesced}, failed {self.failed}, "
+                f"latency mean {mean_latency * 1000:.1f} ms, max {self.max_latency * 1000:.1f} ms")
+
+
+class CommandWriter:
+    """ Single thread writing the commands to the device, e.g. '!s1#' or '!le1#'
+    The callers never wait for the port: a command is queued and the writer sends it under the write lock
+    of the port, so it never waits for the reader blocked in a read.
+    A command already waiting in the queue is not queued again
+    and the writes are at least min_interval seconds apart.
+    """
+    min_interval: float
+    stats: dict[str, CommandStats]
+
+    def __init__(self, serial_manager: 'SerialManager', min_interval: float):
+        self.serial_manager = serial_manager
+        self.min_interval = min_interval
+        self.stats = {}
+        self.pending = deque()  # (command, time queued)
+        self.pending_commands = set()
+        self.condition = threading.Condition()
+        self.is_running = True
+        self.last_write = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, command: str) -> bool:
+        """ Queue the command, return False if the same command is already waiting """
+        with self.condition:
+            stats = self.stats.setdefault(command, CommandStats())
+            if command in self.pending_commands:
+                stats.coalesced += 1
+                return False
+            self.pending.append((command, time.perf_counter()))
+            self.pending_commands.add(command)
+            self.condition.notify()
+            return True
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or not self.is_running)
+                if not self.pending:
+                    return None
+                command, queued_at = self.pending[0]
+            delay = self.last_write + self.min_interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with self.condition:
+                self.pending.popleft()
+                self.pending_commands.discard(command)
+            is_written = self.serial_manager.write(command)
+            self.last_write = time.perf_counter()
+            with self.condition:
+                if is_written:
+                    self.stats[command].add_latency(self.last_write - queued_at)
+                else:
+                    self.stats[command].failed += 1
+
+    def stop(self) -> None:
+        """ Send the commands still queued and stop the thread """
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        self.thread.join(timeout=1.0)
+
+    def get_report(self) -> str:
+        with self.condition:
+            return '\n'.join(f"{command}: {stats}" for command, stats in self.stats.items())
 
 
 class SerialManager:
+    """ Access to one serial port, every port gets its own manager and locks,
+    so several ports can be read concurrently. _instance is the first manager created.
+    pySerial allows one reader and one writer at the same time, so the reads and the writes have separate locks,
+    the port is replaced or closed only under both of them.
+    When the device is lost, a background thread re-opens it with exponential backoff,
+    the same USB device is found by its VID, PID and serial number even if the port name changes.
+    """
     _instance = None
-    _lock = threading.Lock()
 
     def __new__(cls, port=None, baudrate=115200, timeout=1):
-        cls._instance = super(SerialManager, cls).__new__(cls)
+        instance = super(SerialManager, cls).__new__(cls)
+        instance._read_lock = threading.Lock()
+        instance._write_lock = threading.Lock()
+        instance.port = port
+        instance.baudrate = baudrate
+        instance.timeout = timeout
+        instance.rx_buffer = bytearray()  # bytes received after the last complete line
+        instance.command_writer = None  # started by the first command
+        instance._state_lock = threading.Lock()  # the connection state and the command writer
+        instance.state = ConnectionState.connected
+        instance.connected_event = threading.Event()
+        instance.disconnected_at = 0.0
+        instance.gaps = []  # (local timestamp of the disconnection, local timestamp of the reconnection)
+        instance.reconnect_listeners = []
         try:
-            cls._instance.ser = serial.Serial(port, baudrate, timeout=timeout)
+            instance.ser = serial.Serial(port, baudrate, timeout=timeout)
+            instance.connected_event.set()
         except serial.SerialException as e:
             print(f"Error opening serial port: {e}")
-            cls._instance.ser = None
-        return cls._instance
+            instance.ser = None
+            instance.state = ConnectionState.closed
+        instance.device_id = get_device_id(port) if instance.ser else None
+        if cls._instance is None:
+            cls._instance = instance
+        return instance
+
+    def add_reconnect_listener(self, listener: Callable[[float, float], None]) -> None:
+        """ The listener receives the local timestamps of the disconnection and reconnection """
+        self.reconnect_listeners.append(listener)
+
+    def handle_disconnect(self, error: Exception) -> None:
+        """ Close the lost port and start reconnecting, the readers wait meanwhile """
+        with self._state_lock:
+            if self.state != ConnectionState.connected:
+                return None
+            self.state = ConnectionState.reconnecting
+            self.connected_event.clear()
+            self.disconnected_at = time.time()
+        print(f"[WARNING] Connection to {self.port} lost: {error}")
+        with self._read_lock, self._write_lock:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+        threading.Thread(target=self.reconnect, daemon=True).start()
+
+    def reconnect(self) -> None:
+        delay = uc.Measurements.reconnect_min_delay.value
+        while self.state == ConnectionState.reconnecting:
+            time.sleep(delay)
+            delay = min(delay * 2, uc.Measurements.reconnect_max_delay.value)
+            port = self.port if self.device_id is None else find_device_port(self.device_id)
+            if port is None:
+                continue
+            try:
+                ser = serial.Serial(port, self.baudrate, timeout=self.timeout)
+            except serial.SerialException:
+                continue
+            with self._read_lock, self._write_lock:
+                if self.state != ConnectionState.reconnecting:
+                    ser.close()  # closed by the app meanwhile
+                    return None
+                self.ser = ser
+                self.port = port
+                self.rx_buffer.clear()  # the tail of the lost line
+                self.state = ConnectionState.connected
+            gap = (self.disconnected_at, time.time())
+            self.gaps.append(gap)
+            self.connected_event.set()
+            print(f"[INFO] Reconnected to {port} after {gap[1] - gap[0]:.1f} s")
+            for listener in self.reconnect_listeners:
+                listener(*gap)
 
     def read_line(self) -> Union[str, None]:
-        with self._lock:
-            if self.ser and self.ser.in_waiting > 0:
-                try:
+        if self.state == ConnectionState.reconnecting:
+            return None
+        error = None
+        with self._read_lock:
+            try:
+                if self.ser and self.ser.in_waiting > 0:
                     line = self.ser.readline().decode('utf-8', errors='ignore').rstrip()
-                    # Remove any 'green' characters (e.g., ANSI escape codes)
-                    line = re.sub(r'\x1B\[[0-9;]*[A-Za-z]', '', line)
-                    return line
-                except serial.SerialException as e:
-                    print(f"Error reading line: {e}")
-                    return None
+                    return remove_ansi_codes(line)
+            except (serial.SerialException, OSError) as e:
+                error = e
+        if error is not None:
+            print(f"Error reading line: {error}")
+            self.handle_disconnect(error)
         return None
 
+    def read_lines(self) -> list[str]:
+        """ Bulk read of all the complete lines received so far
+        The call blocks up to the port timeout until the first byte arrives,
+        then takes everything buffered by the OS in a single read.
+        The incomplete tail is kept in the reusable buffer for the next call.
+        """
+        if self.state == ConnectionState.reconnecting:
+            self.connected_event.wait(self.timeout)
+            return []
+        error = None
+        with self._read_lock:  # the commands are written meanwhile under the write lock
+            if not self.ser:
+                return []
+            try:
+                chunk = self.ser.read(max(1, self.ser.in_waiting))
+            except (serial.SerialException, OSError) as e:
+                error = e
+        if error is not None:
+            print(f"Error reading lines: {error}")
+            self.handle_disconnect(error)
+            return []
+        if not chunk:
+            return []
+        buffer = self.rx_buffer
+        buffer += chunk
+        end = buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        with memoryview(buffer) as view:
+            text = str(view[:end], 'utf-8', 'ignore')
+        del buffer[:end + 1]
+        return [remove_ansi_codes(line.rstrip()) for line in text.split('\n') if not line.isspace() and line]
+
+    def send_command(self, command: str) -> bool:
+        """ Queue the command for the writer thread, the call does not block """
+        if not self.ser:
+            print("[ERROR] Serial port is not initialized")
+            return False
+        if self.command_writer is None:
+            with self._state_lock:  # not the read lock, which the reader holds while waiting for the data
+                if self.command_writer is None:
+                    self.command_writer = CommandWriter(self, min_interval=uc.Measurements.command_interval.value)
+        return self.command_writer.send(command)
+
+    def write(self, command: str) -> bool:
+        if self.state == ConnectionState.reconnecting:
+            return False
+        error = None
+        with self._write_lock:
+            if not self.ser:
+                return False
+            try:
+                self.ser.write(command.encode())
+                return True
+            except (serial.SerialException, OSError) as e:  # OSError of a device unplugged on Linux
+                error = e
+        print(f"[ERROR] Error sending command: {error}")
+        self.handle_disconnect(error)
+        return False
+
     def close(self):
-        with self._lock:
+        if self.command_writer is not None:
+            self.command_writer.stop()
+            print(f"Commands sent to {self.port}:\n{self.command_writer.get_report()}")
+        self.state = ConnectionState.closed
+        self.connected_event.set()
+        with self._read_lock, self._write_lock:
             if self.ser:
                 self.ser.close()
 
     def test_readline(self) -> Union[str, None]:
         try:
             line = self.ser.readline().decode('utf-8', errors='ignore').rstrip()
-            # Remove any 'green' characters (e.g., ANSI escape codes)
-            line = re.sub(r'\x1B\[[0-9;]*[A-Za-z]', '', line)
-            return line
+            return remove_ansi_codes(line)
         except serial.SerialException as e:
             print(f"Error reading line: {e}")
             return None
@@ -0,0 +1,321 @@
+""" Compaction of the finished sessions: the files of a session folder are merged into one compressed archive,
+session_archive.zip, and only the manifest stays next to it as the index of the session.
+    data_compacted_<session id>.csv: the CSV log files of the session one after another under a single header,
+    they compress twice as well together as each on its own
+    compaction.json: where each of the log files is in data_compacted_<session id>.csv
+    every other file of the folder, e.g. the integrated data and the notes, as it was
+Every member is compressed on its own, so a file is read from the archive without unpacking the others,
+see open_session_file, which the readers of the logs use instead of open().
+The archive is verified against the files before they are removed. A session is finished once all the segments
+of its manifest are closed, or nothing was written to its folder for compaction_idle_time, e.g. after a crash.
+    python session_archive.py compact  # all the finished sessions in data/logs
+    python session_archive.py extract <session folder>  # restore the files, e.g. to integrate the session again
+"""
+import argparse
+import fnmatch
+import glob
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import time
+import zipfile
+from typing import IO, Union
+import ui_config as uc
+from session_manifest import SessionManifest
+
+ARCHIVE_NAME = "session_archive.zip"
+INDEX_NAME = "compaction.json"
+INDEX_VERSION = 1
+ARCHIVE_COMPRESSION = zipfile.ZIP_DEFLATED  # fast to read, ZIP_LZMA saves another 25% at a quarter of the speed
+ARCHIVE_COMPRESS_LEVEL = 9
+
+
+def get_archive_path(folder_path: str) -> str:
+    return os.path.join(folder_path, ARCHIVE_NAME)
+
+
+def get_session_id(folder_path: str) -> str:
+    return os.path.basename(os.path.normpath(folder_path))[len("session_"):].removesuffix("_test")
+
+
+def get_merged_name(session_id: str) -> str:
+    return f"data_compacted_{session_id}.csv"
+
+
+def load_index(archive: zipfile.ZipFile) -> Union[None, dict]:
+    """ {"version": 1, "merged": file, "header_size": bytes, "files": [{"file", "offset", "size"}, ...]},
+    None if the log files were archived each on its own
+    """
+    if INDEX_NAME not in archive.namelist():
+        return None
+    index = json.loads(archive.read(INDEX_NAME))
+    if index.get('version', 0) > INDEX_VERSION:
+        raise ValueError(f"Unsupported compaction index in {archive.filename}: version {index.get('version')}")
+    return index
+
+
+def read_merged_file(archive: zipfile.ZipFile, index: dict, name: str) -> Union[None, bytes]:
+    """ Content of the log file merged into the archive, None if it is not one of them """
+    for file in index['files']:
+        if file['file'] == name:
+            with archive.open(index['merged']) as merged:
+                header = merged.read(index['header_size'])
+                merged.seek(file['offset'])
+                return header + merged.read(file['size'])
+    return None
+
+
+def open_session_file(path: str, mode='rb') -> IO:
+    """ Open a file of a session folder for reading, from the archive if the session has been compacted """
+    archive_path = get_archive_path(os.path.dirname(path))
+    if os.path.exists(path) or not os.path.exists(archive_path):
+        return open(path, mode, **({} if 'b' in mode else {'encoding': 'utf-8', 'newline': ''}))
+    name = os.path.basename(path)
+    with zipfile.ZipFile(archive_path) as archive:
+        if name in archive.namelist():
+            file = archive.open(name)  # keeps the archive file open until it is closed
+        else:
+            index = load_index(archive)
+            content = None if index is None else read_merged_file(archive, index, name)
+            if content is None:
+                raise FileNotFoundError(f"No such file in the session folder or its archive: {path}")
+            file = io.BytesIO(content)
+    return file if 'b' in mode else io.TextIOWrapper(file, encoding='utf-8', newline='')
+
+
+def list_archived_files(folder_path: str) -> list[str]:
+    """ Names of the files in the archive of the session folder, the merged log files included """
+    archive_path = get_archive_path(folder_path)
+    if not os.path.exists(archive_path):
+        return []
+    with zipfile.ZipFile(archive_path) as archive:
+        index = load_index(archive)
+        names = archive.namelist()
+    return names + ([] if index is None else [file['file'] for file in index['files']])
+
+
+def session_file_exists(path: str) -> bool:
+    return os.path.exists(path) or os.path.basename(path) in list_archived_files(os.path.dirname(path))
+
+
+def list_session_files(folder_path: str, pattern: str) -> list[str]:
+    """ Sorted paths of the files of the session folder matching the glob pattern, the archived ones included """
+    paths = set(glob.glob(os.path.join(folder_path, pattern)))
+    paths.update(os.path.join(folder_path, name) for name in fnmatch.filter(list_archived_files(folder_path), pattern))
+    return sorted(paths)
+
+
+def get_merged_log(folder_path: str) -> Union[None, tuple[str, list[str]]]:
+    """ Path of the merged CSV log files of a compacted session and the files merged into it,
+    None if the session is not compacted or its log files were archived each on its own
+    """
+    archive_path = get_archive_path(folder_path)
+    if not os.path.exists(archive_path):
+        return None
+    with zipfile.ZipFile(archive_path) as archive:
+        index = load_index(archive)
+    if index is None:
+        return None
+    return os.path.join(folder_path, index['merged']), [file['file'] for file in index['files']]
+
+
+def get_digest(file: IO, size: Union[None, int] = None, digest=None) -> str:
+    """ sha256 of the next size bytes of the file, all of them by default, added to digest if it is given """
+    digest = hashlib.sha256() if digest is None else digest
+    remaining = float('inf') if size is None else size
+    while remaining > 0:
+        block = file.read(int(min(remaining, 2 ** 20)))
+        if not block:
+            break
+        digest.update(block)
+        remaining -= len(block)
+    return digest.hexdigest()
+
+
+def is_finished(folder_path: str, idle_time: float) -> bool:
+    """ All the segments are closed, or the session has been idle for idle_time seconds """
+    manifest = SessionManifest.load(folder_path, get_session_id(folder_path))
+    if manifest is not None and all(segment.is_closed for segment in manifest.segments):
+        return True
+    paths = glob.glob(os.path.join(folder_path, "*"))
+    return time.time() - max((os.path.getmtime(path) for path in paths), default=0.0) >= idle_time
+
+
+def get_compacted_files(folder_path: str) -> list[str]:
+    """ Names of the files to archive, all but the manifest, the archive and the files being replaced """
+    manifest_name = os.path.basename(SessionManifest.get_manifest_path(folder_path, get_session_id(folder_path)))
+    return sorted(name for name in os.listdir(folder_path)
+                  if os.path.isfile(os.path.join(folder_path, name))
+                  and name not in (manifest_name, ARCHIVE_NAME) and not name.endswith(".tmp"))
+
+
+def get_mergeable_logs(folder_path: str, names: list[str]) -> list[str]:
+    """ The CSV log files of the session in the order of the manifest, or of their names for the older sessions,
+    if they can be merged: all of them have the same header and end with a complete line
+    """
+    session_id = get_session_id(folder_path)
+    manifest = SessionManifest.load(folder_path, session_id)
+    if manifest is None:
+        logs = sorted(fnmatch.filter(names, f"data_*_{session_id}.csv"))
+    else:
+        logs = [segment.file for segment in manifest.segments
+                if segment.file.endswith(".csv") and segment.file in names]
+    headers = set()
+    for name in logs:
+        with open(os.path.join(folder_path, name), 'rb') as log_file:
+            headers.add(log_file.readline())
+            log_file.seek(0, os.SEEK_END)
+            if log_file.tell() > 0:
+                log_file.seek(-1, os.SEEK_END)
+                if log_file.read(1) != b'\n':
+                    return []
+    if len(logs) < 2 or len(headers) != 1 or not next(iter(headers)).endswith(b'\n'):
+        return []
+    return logs
+
+
+def write_archive(folder_path: str, path: str, names: list[str], logs: list[str]) -> None:
+    """ Write the files to the archive at path, the logs merged under the header of the first one """
+    session_id = get_session_id(folder_path)
+    with zipfile.ZipFile(path, 'w', ARCHIVE_COMPRESSION, compresslevel=ARCHIVE_COMPRESS_LEVEL) as archive:
+        if logs:
+            index = {"version": INDEX_VERSION, "merged": get_merged_name(session_id), "header_size": 0, "files": []}
+            with archive.open(index['merged'], 'w', force_zip64=True) as merged:
+                offset = 0
+                for name in logs:
+                    with open(os.path.join(folder_path, name), 'rb') as log_file:
+                        header = log_file.readline()
+                        if offset == 0:
+                            merged.write(header)
+                            index['header_size'] = offset = len(header)
+                        size = os.path.getsize(log_file.name) - len(header)
+                        shutil.copyfileobj(log_file, merged)
+                    index['files'].append({"file": name, "offset": offset, "size": size})
+                    offset += size
+            archive.writestr(INDEX_NAME, json.dumps(index, indent=1))
+        for name in names:
+            if name not in logs:
+                archive.write(os.path.join(folder_path, name), name)
+
+
+def verify_archive(folder_path: str, path: str, names: list[str]) -> None:
+    """ Raise ValueError unless every file is read back from the archive at path byte for byte """
+    with zipfile.ZipFile(path) as archive:
+        corrupted = archive.testzip()
+        if corrupted is not None:
+            raise ValueError(f"Corrupted member {corrupted} in {path}")
+        index = load_index(archive)
+        merged_files = [] if index is None else index['files']
+        if merged_files:
+            with archive.open(index['merged']) as merged:
+                header = merged.read(index['header_size'])
+                for file in merged_files:
+                    with open(os.path.join(folder_path, file['file']), 'rb') as log_file:
+                        expected = get_digest(log_file)
+                    digest = hashlib.sha256(header)
+                    if merged.tell() != file['offset'] or get_digest(merged, file['size'], digest) != expected:
+                        raise ValueError(f"{file['file']} differs from its copy in {path}")
+        merged_names = {file['file'] for file in merged_files}
+        for name in names:
+            if name in merged_names:
+                continue
+            with open(os.path.join(folder_path, name), 'rb') as file, archive.open(name) as member:
+                if get_digest(file) != get_digest(member):
+                    raise ValueError(f"{name} differs from its copy in {path}")
+
+
+def compact_session(folder_path: str) -> Union[None, str]:
+    """ Merge the files of the session folder into its archive and remove them once the archive is verified,
+    an archive of the session compacted before is extracted first.
+    Return the path of the archive, None if there was nothing to compact
+    """
+    names = get_compacted_files(folder_path)
+    if not names:
+        return None
+    archive_path = get_archive_path(folder_path)
+    if os.path.exists(archive_path):
+        extract_session(folder_path)
+        names = get_compacted_files(folder_path)
+    temp_path = archive_path + ".tmp"
+    try:
+        write_archive(folder_path, temp_path, names, get_mergeable_logs(folder_path, names))
+        verify_archive(folder_path, temp_path, names)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, archive_path)
+    for name in names:
+        os.remove(os.path.join(folder_path, name))
+    return archive_path
+
+
+def extract_session(folder_path: str) -> None:
+    """ Restore the archived files of the session folder, the files present in the folder are kept """
+    archive_path = get_archive_path(folder_path)
+    with zipfile.ZipFile(archive_path) as archive:
+        index = load_index(archive)
+        if index is not None:
+            with archive.open(index['merged']) as merged:
+                header = merged.read(index['header_size'])
+                for file in index['files']:
+                    path = os.path.join(folder_path, file['file'])
+                    if os.path.exists(path):
+                        continue
+                    merged.seek(file['offset'])
+                    with open(path + ".tmp", 'wb') as log_file:
+                        log_file.write(header)
+                        log_file.write(merged.read(file['size']))
+                    os.replace(path + ".tmp", path)
+        for name in archive.namelist():
+            path = os.path.join(folder_path, name)
+            if os.path.exists(path) or name == INDEX_NAME or (index is not None and name == index['merged']):
+                continue
+            with archive.open(name) as member, open(path + ".tmp", 'wb') as file:
+                shutil.copyfileobj(member, file)
+            os.replace(path + ".tmp", path)
+    os.remove(archive_path)
+
+
+def get_folder_size(folder_path: str) -> int:
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(folder_path, "*")) if os.path.isfile(path))
+
+
+def compact_logs_folder(logs_folder_path: str, idle_time: float) -> None:
+    """ Compact every finished session of the logs folder """
+    size_before, size_after, num_sessions = 0, 0, 0
+    for folder_path in sorted(glob.glob(os.path.join(logs_folder_path, "session_*"))):
+        if not os.path.isdir(folder_path) or not get_compacted_files(folder_path) \
+                or not is_finished(folder_path, idle_time):
+            continue
+        folder_size = get_folder_size(folder_path)
+        try:
+            archive_path = compact_session(folder_path)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            print(f"Session {folder_path} not compacted: {e}", file=sys.stderr)
+            continue
+        if archive_path is None:
+            continue
+        size_before += folder_size
+        size_after += get_folder_size(folder_path)
+        num_sessions += 1
+    print(f"{num_sessions} sessions compacted: {size_before / 2 ** 20:.1f} MB -> {size_after / 2 ** 20:.1f} MB")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Compact the finished sessions in the logs folder")
+    sub_parsers = arg_parser.add_subparsers(dest='command', required=True)
+    compact_parser = sub_parsers.add_parser('compact', help="archive the finished sessions")
+    compact_parser.add_argument('--idle-hours', type=float, default=None,
+                                help="compact the sessions with open segments after this time without writes")
+    extract_parser = sub_parsers.add_parser('extract', help="restore the files of a session folder")
+    extract_parser.add_argument('folder')
+    args = arg_parser.parse_args()
+    if args.command == 'compact':
+        idle_time = uc.Measurements.compaction_idle_time.value if args.idle_hours is None else args.idle_hours * 3600
+        compact_logs_folder(uc.FilePaths.logs_folder_path.value, idle_time)
+    else:
+        extract_session(args.folder)
@@ -0,0 +1,183 @@
+""" Catalog of the sessions in data/logs, a SQLite database answering e.g. "all the sessions of user X last month"
+without opening the log files:
+    sessions: session_id, folder, is_test, start_time, end_time, num_rows, num_alarms
+    session_users: the same totals for each user of the session
+    segments: the log files of each session with their rows and time range
+The times are local times formatted by Measurements.time_format, so they are compared as text.
+The totals are summed from the users of each segment, which the logger updates as it writes the rows
+and log_integration replaces with the totals of the log files once the session is integrated.
+The sessions logged before the catalog are added by: python session_catalog.py index
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import threading
+from typing import Iterable, Union
+import pandas as pd
+import ui_config as uc
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY, folder TEXT NOT NULL, is_test INTEGER NOT NULL,
+    start_time TEXT, end_time TEXT, num_rows INTEGER NOT NULL, num_alarms INTEGER NOT NULL, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS segments (
+    session_id TEXT NOT NULL, position INTEGER NOT NULL, file TEXT NOT NULL, num_rows INTEGER NOT NULL,
+    start_time TEXT, end_time TEXT, is_closed INTEGER NOT NULL, PRIMARY KEY (session_id, file));
+CREATE TABLE IF NOT EXISTS segment_users (
+    session_id TEXT NOT NULL, file TEXT NOT NULL, user_id INTEGER NOT NULL,
+    num_rows INTEGER NOT NULL, num_alarms INTEGER NOT NULL, start_time TEXT, end_time TEXT,
+    PRIMARY KEY (session_id, file, user_id));
+CREATE TABLE IF NOT EXISTS session_users (
+    session_id TEXT NOT NULL, user_id INTEGER NOT NULL,
+    num_rows INTEGER NOT NULL, num_alarms INTEGER NOT NULL, start_time TEXT, end_time TEXT,
+    PRIMARY KEY (session_id, user_id));
+CREATE INDEX IF NOT EXISTS sessions_by_time ON sessions (start_time, end_time);
+CREATE INDEX IF NOT EXISTS session_users_by_user ON session_users (user_id, start_time, end_time);
+"""
+
+
+def add_user_row(users: dict[str, list], user_id: int, local_time: str, is_alarm: bool) -> None:
+    """ Count a row in users, which are {user id as str: [rows, alarms, first local time, last local time]} """
+    stats = users.get(str(user_id))
+    if stats is None:
+        users[str(user_id)] = [1, int(is_alarm), local_time, local_time]
+        return None
+    stats[0] += 1
+    stats[1] += int(is_alarm)
+    stats[2] = min(stats[2], local_time)
+    stats[3] = max(stats[3], local_time)
+
+
+def get_user_stats(user_ids: Iterable, local_times: Iterable, is_alarm: Iterable) -> dict[str, list]:
+    """ The users of the rows given by columns, as counted by add_user_row """
+    table = pd.DataFrame({'user_id': pd.to_numeric(pd.Series(user_ids), errors='coerce'),  # shifted rows of old logs
+                          'local_time': local_times, 'is_alarm': is_alarm})
+    grouped = table.groupby('user_id')
+    stats = zip(grouped.size().index, grouped.size(), grouped['is_alarm'].sum(),
+                grouped['local_time'].min(), grouped['local_time'].max())
+    return {str(int(user_id)): [int(rows), int(alarms), None if start != start else start, None if end != end else end]
+            for user_id, rows, alarms, start, end in stats}
+
+
+def merge_user_stats(users: dict[str, list], other: dict[str, list]) -> dict[str, list]:
+    merged = {user_id: list(stats) for user_id, stats in users.items()}
+    for user_id, (rows, alarms, start, end) in other.items():
+        stats = merged.get(user_id)
+        if stats is None:
+            merged[user_id] = [rows, alarms, start, end]
+            continue
+        stats[0] += rows
+        stats[1] += alarms
+        stats[2] = min([time for time in (stats[2], start) if time is not None], default=None)
+        stats[3] = max([time for time in (stats[3], end) if time is not None], default=None)
+    return merged
+
+
+def format_time(value: Union[None, str, datetime.datetime]) -> Union[None, str]:
+    if isinstance(value, datetime.datetime):
+        return value.strftime(uc.Measurements.time_format.value)
+    return value
+
+
+class SessionCatalog:
+    """ Connection to the catalog, shared by the threads of the app """
+    path: str
+
+    def __init__(self, path: Union[None, str] = None):
+        self.path = uc.FilePaths.session_catalog_path.value if path is None else path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        # the logger and the integration may write at the same time from the separate connections
+        self.connection = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def update_session(self, session_id: str, folder_path: str, is_test: bool, segments: list) -> None:
+        """ Replace the segments of the session and its totals,
+        the segments have file, rows, is_closed and users as SegmentInfo of session_manifest
+        """
+        segment_rows, user_rows = [], []
+        for position, segment in enumerate(segments):
+            starts = [stats[2] for stats in segment.users.values() if stats[2] is not None]
+            ends = [stats[3] for stats in segment.users.values() if stats[3] is not None]
+            segment_rows.append((session_id, position, segment.file, segment.rows,
+                                 min(starts, default=None), max(ends, default=None), int(segment.is_closed)))
+            user_rows += [(session_id, segment.file, int(user_id), *stats) for user_id, stats in segment.users.items()]
+        updated_at = datetime.datetime.now().strftime(uc.Measurements.time_format.value)
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM segments WHERE session_id = ?", (session_id,))
+            self.connection.execute("DELETE FROM segment_users WHERE session_id = ?", (session_id,))
+            self.connection.execute("DELETE FROM session_users WHERE session_id = ?", (session_id,))
+            self.connection.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?)", segment_rows)
+            self.connection.executemany("INSERT INTO segment_users VALUES (?, ?, ?, ?, ?, ?, ?)", user_rows)
+            self.connection.execute(
+                "INSERT INTO session_users SELECT session_id, user_id, SUM(num_rows), SUM(num_alarms), "
+                "MIN(start_time), MAX(end_time) FROM segment_users WHERE session_id = ? GROUP BY user_id",
+                (session_id,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions SELECT ?, ?, ?, MIN(start_time), MAX(end_time), "
+                "COALESCE(SUM(num_rows), 0), COALESCE(SUM(num_alarms), 0), ? FROM session_users WHERE session_id = ?",
+                (session_id, folder_path, int(is_test), updated_at, session_id))
+
+    def has_session(self, session_id: str) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM sessions WHERE session_id = ?",
+                                           (session_id,)).fetchone() is not None
+
+    def find_sessions(self, user_id: Union[None, int] = None,
+                      start: Union[None, str, datetime.datetime] = None,
+                      end: Union[None, str, datetime.datetime] = None, include_test=False) -> pd.DataFrame:
+        """ Sessions overlapping the time range, with the totals of the user if user_id is given """
+        if user_id is None:
+            query = "SELECT * FROM sessions AS s WHERE 1"
+            parameters = []
+        else:
+            query = ("SELECT u.session_id, s.folder, s.is_test, u.user_id, u.start_time, u.end_time, "
+                     "u.num_rows, u.num_alarms FROM session_users AS u JOIN sessions AS s USING (session_id) "
+                     "WHERE u.user_id = ?")
+            parameters = [user_id]
+        table = "s" if user_id is None else "u"
+        if start is not None:
+            query += f" AND {table}.end_time >= ?"
+            parameters.append(format_time(start))
+        if end is not None:
+            query += f" AND {table}.start_time <= ?"
+            parameters.append(format_time(end))
+        if not include_test:
+            query += " AND s.is_test = 0"
+        with self.lock:
+            return pd.read_sql_query(query + f" ORDER BY {table}.start_time", self.connection, params=parameters)
+
+    def get_segment_paths(self, session_id: str) -> list[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT s.folder, g.file FROM segments AS g JOIN sessions AS s USING (session_id) "
+                "WHERE g.session_id = ? ORDER BY g.position", (session_id,)).fetchall()
+        return [os.path.join(folder, file) for folder, file in rows]
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Index and query the sessions in the logs folder")
+    sub_parsers = arg_parser.add_subparsers(dest='command', required=True)
+    index_parser = sub_parsers.add_parser('index', help="add the sessions missing in the catalog")
+    index_parser.add_argument('--all', action='store_true', help="index all the sessions again")
+    sessions_parser = sub_parsers.add_parser('sessions', help="list the sessions")
+    sessions_parser.add_argument('--user', type=int, default=None)
+    sessions_parser.add_argument('--start', default=None, help="local time, e.g. '2024-07-01 00:00:00'")
+    sessions_parser.add_argument('--end', default=None)
+    sessions_parser.add_argument('--test', action='store_true', help="include the test sessions")
+    args = arg_parser.parse_args()
+    catalog = SessionCatalog()
+    if args.command == 'index':
+        from log_integration import index_logs_folder  # log_integration updates the catalog itself
+        index_logs_folder(uc.FilePaths.logs_folder_path.value, catalog, reindex=args.all)
+    else:
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            print(catalog.find_sessions(user_id=args.user, start=args.start, end=args.end, include_test=args.test))
+    catalog.close()
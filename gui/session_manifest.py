@@ -0,0 +1,129 @@
+""" Index of the log segments of a session, saved next to them as manifest_<session id>.json:
+{"version": 1, "session_id": "...", "segments": [{"file": "data_..._<session id>.csv", "rows": 36000,
+  "first_timestamp": "...", "last_timestamp": "...", "start_local_timestamp": ..., "end_local_timestamp": ...,
+  "is_closed": true, "users": {"<user id>": [rows, alarms, first local time, last local time]}}, ...]}
+The readers open only the segments of the time range they need instead of globbing the session folder.
+"""
+import json
+import os
+import time
+from typing import Union
+from session_catalog import add_user_row
+
+MANIFEST_VERSION = 1
+
+
+class SegmentInfo:
+    """ Rows and time range of one log segment, the device timestamps restart with the device,
+    so the ranges are selected by the local timestamps
+    """
+    file: str
+    rows: int
+    first_timestamp: Union[None, str]
+    last_timestamp: Union[None, str]
+    start_local_timestamp: Union[None, float]
+    end_local_timestamp: Union[None, float]
+    is_closed: bool
+    users: dict[str, list]  # as counted by session_catalog.add_user_row
+
+    def __init__(self, file: str):
+        self.file = file
+        self.rows = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.start_local_timestamp = None
+        self.end_local_timestamp = None
+        self.is_closed = False
+        self.users = {}
+        self.opened_at = time.monotonic()
+
+    def add(self, data_entry: dict) -> None:
+        local_timestamp = float(data_entry['local_timestamp'])
+        if self.rows == 0:
+            self.first_timestamp = data_entry['timestamp']
+            self.start_local_timestamp = local_timestamp
+        self.rows += 1
+        self.last_timestamp = data_entry['timestamp']
+        self.end_local_timestamp = local_timestamp
+        add_user_row(self.users, int(data_entry['user_id']), data_entry['local_time'],
+                     data_entry['alarm_notification'] == "yes")
+
+    def get_age(self) -> float:
+        """ Seconds since the segment was opened """
+        return time.monotonic() - self.opened_at
+
+    def to_dict(self) -> dict:
+        return {"file": self.file, "rows": self.rows,
+                "first_timestamp": self.first_timestamp, "last_timestamp": self.last_timestamp,
+                "start_local_timestamp": self.start_local_timestamp, "end_local_timestamp": self.end_local_timestamp,
+                "is_closed": self.is_closed, "users": self.users}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'SegmentInfo':
+        segment = cls(data['file'])
+        for key, value in data.items():
+            setattr(segment, key, value)
+        return segment
+
+
+class SessionManifest:
+    folder_path: str
+    session_id: str
+    segments: list[SegmentInfo]
+
+    def __init__(self, folder_path: str, session_id: str, segments: Union[None, list[SegmentInfo]] = None):
+        self.folder_path = folder_path
+        self.session_id = session_id
+        self.segments = [] if segments is None else segments
+        self.path = self.get_manifest_path(folder_path, session_id)
+
+    @staticmethod
+    def get_manifest_path(folder_path: str, session_id: str) -> str:
+        return os.path.join(folder_path, f"manifest_{session_id}.json")
+
+    @classmethod
+    def load(cls, folder_path: str, session_id: str) -> Union[None, 'SessionManifest']:
+        """ None for the sessions logged before the manifest existed """
+        path = cls.get_manifest_path(folder_path, session_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as manifest_file:
+            data = json.load(manifest_file)
+        if data.get('version', 0) > MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest {path}: version {data.get('version')}")
+        return cls(folder_path, session_id, [SegmentInfo.from_dict(segment) for segment in data['segments']])
+
+    def add_segment(self, path: str) -> SegmentInfo:
+        segment = SegmentInfo(os.path.basename(path))
+        self.segments.append(segment)
+        return segment
+
+    def save(self) -> None:
+        """ Replace the manifest at once, so a reader never sees half of it """
+        data = {"version": MANIFEST_VERSION, "session_id": self.session_id,
+                "segments": [segment.to_dict() for segment in self.segments]}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(data, manifest_file, indent=1)
+        os.replace(temp_path, self.path)
+
+    def get_segment_paths(self, start_local_timestamp: Union[None, float] = None,
+                          end_local_timestamp: Union[None, float] = None) -> list[str]:
+        """ Segments with rows within the range of local timestamps, all of them by default """
+        paths = []
+        for segment in self.segments:
+            if not segment.is_closed:
+                # still being written, its rows are known only up to the last save
+                paths.append(os.path.join(self.folder_path, segment.file))
+                continue
+            if segment.rows == 0:
+                continue
+            if start_local_timestamp is not None and segment.end_local_timestamp < start_local_timestamp:
+                continue
+            if end_local_timestamp is not None and segment.start_local_timestamp > end_local_timestamp:
+                continue
+            paths.append(os.path.join(self.folder_path, segment.file))
+        return paths
+
+    def get_num_rows(self) -> int:
+        return sum(segment.rows for segment in self.segments)
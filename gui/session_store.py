@@ -0,0 +1,277 @@
+""" Columnar in-memory storage of all the frames of a session
+The rows are kept in fixed-size chunks of NumPy columns, so the memory grows without copying
+and the data can be exported or analysed chunk by chunk without converting it back from Python objects.
+"""
+import sys
+import threading
+from typing import Any, Iterator, Union
+import numpy as np
+import pandas as pd
+from frame_schema import (Frame, NUMERIC_FIELDS, FIELD_INDEX, ENTRY_KEYS, SENSOR_SLICE, FACE_SLICE,
+                          empty_values, format_local_time)
+
+TEXT_FIELDS = ['notes', 'bad_posture_command', 'alarm_notification', 'model_notes']
+
+
+def intern_text(value: Any) -> Any:
+    """ The same notes repeat for many frames, keep one copy of each text """
+    return sys.intern(value) if type(value) is str else value
+
+
+class StoreChunk:
+    """ Up to capacity rows, the numeric fields of a row are contiguous as in Frame.values """
+    __slots__ = ('numeric', 'local_timestamps', 'user_ids', 'timestamps', 'texts', 'size')
+
+    def __init__(self, capacity: int):
+        self.numeric = np.empty((capacity, len(NUMERIC_FIELDS)))
+        self.local_timestamps = np.empty(capacity)
+        self.user_ids = np.empty(capacity, dtype=np.int32)
+        self.timestamps = np.empty(capacity, dtype=object)
+        self.texts = {field: np.empty(capacity, dtype=object) for field in TEXT_FIELDS}
+        self.size = 0
+
+    def get_column(self, field: str, size: Union[None, int] = None) -> np.ndarray:
+        """ View of the first size rows of the column, all the filled rows by default """
+        if size is None:
+            size = self.size
+        index = FIELD_INDEX.get(field)
+        if index is not None:
+            return self.numeric[:size, index]
+        if field == 'local_timestamp':
+            return self.local_timestamps[:size]
+        if field == 'user_id':
+            return self.user_ids[:size]
+        if field == 'timestamp':
+            return self.timestamps[:size]
+        return self.texts[field][:size]
+
+
+class SessionStore:
+    """ Frames of the session indexed by the device timestamp
+    The store supports the dict access used by Logger.logs, e.g. store[timestamp]['prediction'] = 1,
+    where store[timestamp] is a RowView writing straight into the columns.
+    The oldest chunks can be popped once they are saved, the store then holds the latest rows only.
+    The rows are appended by the reader thread while the log writer pops the chunks, hence the lock.
+    """
+    chunk_size: int
+    chunks: list[StoreChunk]
+    index: dict[str, int]  # device timestamp -> row number since the start of the session
+    first_chunk: int  # number of chunks popped so far
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.index = {}
+        self.first_chunk = 0
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, timestamp: str) -> bool:
+        return timestamp in self.index
+
+    def __getitem__(self, timestamp: str) -> 'RowView':
+        with self.lock:
+            return self.get_row(self.index[timestamp])
+
+    def __setitem__(self, timestamp: str, data_entry: Union[Frame, dict]) -> None:
+        row = self.index.get(timestamp)
+        if row is None:
+            self.append(data_entry)
+        else:
+            self.get_row(row).update(data_entry)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def values(self) -> Iterator['RowView']:
+        for chunk in list(self.chunks):
+            for offset in range(chunk.size):
+                yield RowView(chunk, offset)
+
+    def items(self) -> Iterator[tuple[str, 'RowView']]:
+        for row_view in self.values():
+            yield row_view.timestamp, row_view
+
+    def get_num_rows(self) -> int:
+        """ Number of rows appended in the session, including the popped ones """
+        if not self.chunks:
+            return self.first_chunk * self.chunk_size
+        return (self.first_chunk + len(self.chunks) - 1) * self.chunk_size + self.chunks[-1].size
+
+    def get_row(self, row: int) -> 'RowView':
+        with self.lock:
+            return RowView(self.chunks[row // self.chunk_size - self.first_chunk], row % self.chunk_size)
+
+    def append(self, data_entry: Union[Frame, dict]) -> 'RowView':
+        """ Copy the entry into a new row
+        The row is filled before it is counted and indexed, so the readers never see a row half written
+        """
+        with self.lock:
+            if not self.chunks or self.chunks[-1].size == self.chunk_size:
+                self.chunks.append(StoreChunk(self.chunk_size))
+            chunk = self.chunks[-1]
+            offset = chunk.size
+            row = (self.first_chunk + len(self.chunks) - 1) * self.chunk_size + offset
+        row_view = RowView(chunk, offset)
+        if isinstance(data_entry, Frame):
+            chunk.numeric[offset] = data_entry.values
+            chunk.timestamps[offset] = data_entry.timestamp
+            chunk.local_timestamps[offset] = data_entry.local_timestamp
+            chunk.user_ids[offset] = data_entry.user_id
+            for field in TEXT_FIELDS:
+                chunk.texts[field][offset] = intern_text(getattr(data_entry, field))
+        else:
+            row_view.clear()
+            row_view.update(data_entry)
+        with self.lock:
+            chunk.size += 1  # the row is complete, it can be saved
+            self.index[data_entry['timestamp']] = row
+        return row_view
+
+    def iter_chunks(self) -> Iterator[StoreChunk]:
+        return iter(self.chunks)
+
+    def pop_chunk(self) -> StoreChunk:
+        """ Remove the oldest chunk, its rows are no longer found by the timestamp """
+        with self.lock:
+            chunk = self.chunks.pop(0)
+            for timestamp in chunk.get_column('timestamp').tolist():
+                self.index.pop(timestamp, None)
+            self.first_chunk += 1
+        return chunk
+
+    def get_column(self, field: str) -> np.ndarray:
+        """ The whole column, a view if the session fits into one chunk """
+        columns = [chunk.get_column(field) for chunk in self.chunks]
+        if len(columns) == 1:
+            return columns[0]
+        if not columns:
+            return np.empty(0)
+        return np.concatenate(columns)
+
+    def to_dataframe(self, columns: list[str]) -> pd.DataFrame:
+        data = {}
+        for column in columns:
+            if column == 'local_time':
+                data[column] = [format_local_time(local_timestamp)
+                                for local_timestamp in self.get_column('local_timestamp').tolist()]
+            else:
+                data[column] = self.get_column(column)
+        return pd.DataFrame(data, columns=columns)
+
+
+def text_field(field: str) -> property:
+    def get_text(self: 'RowView') -> Any:
+        return self.chunk.texts[field][self.offset]
+
+    def set_text(self: 'RowView', value: Any) -> None:
+        self.chunk.texts[field][self.offset] = intern_text(value)
+    return property(get_text, set_text)
+
+
+class RowView:
+    """ One row of the store with the interface of Frame, the changes are written to the columns """
+    __slots__ = ('chunk', 'offset')
+
+    def __init__(self, chunk: StoreChunk, offset: int):
+        self.chunk = chunk
+        self.offset = offset
+
+    def __repr__(self) -> str:
+        return f"RowView({dict(self.items())})"
+
+    @property
+    def values(self) -> np.ndarray:
+        """ View of the numeric fields ordered as NUMERIC_FIELDS """
+        return self.chunk.numeric[self.offset]
+
+    @property
+    def timestamp(self) -> str:
+        return self.chunk.timestamps[self.offset]
+
+    @property
+    def local_timestamp(self) -> float:
+        return self.chunk.local_timestamps[self.offset]
+
+    @local_timestamp.setter
+    def local_timestamp(self, value: float) -> None:
+        self.chunk.local_timestamps[self.offset] = value
+
+    @property
+    def local_time(self) -> str:
+        return format_local_time(self.local_timestamp)
+
+    @property
+    def user_id(self) -> int:
+        return int(self.chunk.user_ids[self.offset])
+
+    @user_id.setter
+    def user_id(self, value: int) -> None:
+        self.chunk.user_ids[self.offset] = value
+
+    notes = text_field('notes')
+    bad_posture_command = text_field('bad_posture_command')
+    alarm_notification = text_field('alarm_notification')
+    model_notes = text_field('model_notes')
+
+    def clear(self) -> None:
+        """ Reset the row to the defaults of an empty Frame """
+        empty_frame = Frame(timestamp="", local_timestamp=0.0)
+        self.chunk.numeric[self.offset] = empty_values
+        for field in TEXT_FIELDS:
+            setattr(self, field, getattr(empty_frame, field))
+        self.user_id = empty_frame.user_id
+
+    def __getitem__(self, key: str) -> Any:
+        index = FIELD_INDEX.get(key)
+        if index is not None:
+            return self.chunk.numeric[self.offset, index]
+        if key in ENTRY_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        index = FIELD_INDEX.get(key)
+        if index is not None:
+            self.chunk.numeric[self.offset, index] = value
+        elif key == 'timestamp':
+            self.chunk.timestamps[self.offset] = value
+        elif key == 'local_time':
+            pass  # the local time is formatted from the local timestamp
+        elif key in ENTRY_KEYS:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in ENTRY_KEYS
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(ENTRY_KEYS)
+
+    def get(self, key: str, default=None) -> Any:
+        if key in ENTRY_KEYS:
+            return self[key]
+        return default
+
+    def keys(self) -> list[str]:
+        return ENTRY_KEYS
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        for key in ENTRY_KEYS:
+            yield key, self[key]
+
+    def update(self, data: dict) -> None:
+        for key, value in data.items():
+            self[key] = value
+
+    def get_sensor_values(self) -> np.ndarray:
+        return self.values[SENSOR_SLICE]
+
+    def get_face_vector(self) -> np.ndarray:
+        return self.values[FACE_SLICE]
@@ -1,4 +1,3 @@
-import serial
 import tkinter as tk
 from serial_manager import SerialManager
 
@@ -39,12 +38,6 @@ class SoundControllerApp:
         self.send_sound_command(command)
 
     def send_sound_command(self, command: str):
-        """ Send the sound command to the device via SerialManager """
-        if self.serial_manager.ser:  # Ensure the serial port is initialized
-            try:
-                self.serial_manager.ser.write(command.encode())  # Send the command
-                print(f"[DEBUG] Command sent: {command}")
-            except serial.SerialException as e:
-                print(f"[ERROR] Error sending command: {e}")
-        else:
-            print("[ERROR] Serial port is not initialized")
+        """ Queue the sound command for the writer thread of SerialManager """
+        if self.serial_manager.send_command(command):
+            print(f"[DEBUG] Command queued: {command}")
@@ -61,9 +61,26 @@ class ElementNames(Enum):
 
 
 class Measurements(Enum):
+    # a member with the value of an earlier one is its alias, the settings of the data pipeline have distinct values
     window_size = "1100x600"
     graph_size = (6, 3)
     graph_x_limit = 50  # show up to last X values or None for infinite number
+    log_flush_rows = 64  # rows written to the log file at once
+    log_segment_rows = 36000  # rows of a log file, a new one is started after them or after log_segment_duration
+    log_segment_duration = 3600.0  # s
+    log_flush_interval = 2.0  # s, max time a row waits for the flush
+    log_file_extension = ".csv"  # ".npz" saves the session as binary log segments, see log_segments.py,
+    # ".dbref" into the SQLite database of the station, see log_database.py
+    log_queue_size = 12000  # frames waiting for the log writer before the reader has to wait
+    log_close_timeout = 15.0  # s, max wait for the log writer when the app is closed
+    log_write_chunk = 8000  # rows serialized at once when all the session data is saved
+    store_chunk_size = 4096  # rows allocated at once by the session store
+    hot_window_size = 6000  # values of a graph series kept in memory, the older ones go to the session folder
+    store_hot_rows = 4 * store_chunk_size  # rows of the session store kept in memory, the older ones are spilled
+    memory_report_interval = 60.0  # s between the memory usage reports
+    integration_chunk_rows = 50000  # rows read and post-processed at once when the session logs are integrated
+    integration_workers = 4  # threads reading the log segments ahead of the merge
+    compaction_idle_time = 24 * 3600.0  # s without writes before a session with open segments is compacted
     header_h = 200
     body_h = 500
     footer_h = 500
@@ -74,10 +91,20 @@ class Measurements(Enum):
 
     pop_up_closing_delay = 2000  # ms
     thread_delay = 0.01  # s
+    serial_read_timeout = 0.05  # s, max time the bulk reader blocks waiting for the device
+    frame_timeout = 0.2  # s, silence after which the frame of the last device tick is complete
 
     time_format = "%Y-%m-%d %H:%M:%S"  # "H:M:S.MS PM/AM, DD-MM-YYYY
     csv_time_format = "%I%M%S%d%m%y"
     graph_refresh_rate = 5
+    render_tick = 80  # ms between draining the frames received from the reader thread
+    render_queue_size = 512  # max frames waiting for rendering
+    render_queue_policy = "drop_oldest"  # see frame_queue.OverflowPolicy
+    port_queue_size = 1000  # max batches of lines waiting to be merged from the port readers
+    command_interval = 0.04  # s, min time between two commands written to the device
+    reconnect_min_delay = 0.1  # s, first wait before re-opening a lost port, doubled after every attempt
+    reconnect_max_delay = 8.0  # s
+    port_stale_timeout = 0.5  # s, silence after which a port no longer holds back the lines of the other ports
 
     notification_delay = 2000  # in ms
 
@@ -112,6 +139,7 @@ class FilePaths(Enum):
     user_photo_icon = project_root + '/data/img/user_photo.jpeg'
     user_login_db_path = project_root + "/data/users/logins.csv"
     flex_collect_csv_path = project_root + '/data/dynamic_data_collected/posture_data_20240713145850.csv'
+    sample_log_path = project_root + '/data/sample_data/0713putty.log'
 
     """ Folder paths """
     values_folder_path = project_root + "/data/values"
@@ -119,6 +147,8 @@ class FilePaths(Enum):
     piechart_folder_path = project_root + "/data/img/piecharts"
     reports_folder_path = project_root + "/data/reports"
     logs_folder_path = project_root + "/data/logs"
+    session_catalog_path = logs_folder_path + "/catalog.sqlite"  # index of the sessions, see session_catalog.py
+    log_database_path = logs_folder_path + "/frames.sqlite"  # frames of the sessions, see log_database.py
     model_path = project_root + '/models'
 
 
@@ -134,6 +164,7 @@ class Ports(Enum):
     linux_sensor_1 = linux_path + "ACM0"
     linux_sensor_2 = linux_path + "AMA0"
     linux_img_sensor = linux_path + "ACM1"
+    linux_split_sensors = [linux_sensor_1, linux_img_sensor]  # rigs with the ToF and image sensors on separate ports
 
     windows_serial = "COM8"
 